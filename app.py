@@ -1,17 +1,48 @@
 from dotenv import load_dotenv
 from flask import (
     Flask, render_template, request, redirect, url_for, session,
-    send_from_directory, jsonify, g, abort
+    send_from_directory, send_file, jsonify, g, abort, has_app_context, make_response, Response
 )
 from flask_mail import Mail, Message
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
+from PIL import Image, ImageOps
+import click
 import sqlite3
 import psycopg2
 import psycopg2.extras
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+import bisect
+import functools
+import gzip
+import hashlib
+from datetime import datetime, timezone
+import atexit
+import csv
+import io
 import json, os
+import mimetypes
+import re
+import secrets
+import socket
+import socketserver
+import threading
+import time
 import uuid
+from urllib.parse import urlparse
+
+try:
+    import brotli   # opcional: só para gerar as variantes .br dos estáticos
+except ImportError:
+    brotli = None
+
+try:
+    import fcntl    # lock do METRICS_DIR entre workers (só POSIX)
+except ImportError:
+    fcntl = None
 
 # -----------------------------------------------------------------------------
 # Configuração da App
@@ -22,6 +53,13 @@ load_dotenv()
 # ⚠️ Em produção, use uma SECRET_KEY de ambiente
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'default_local_key')
 
+# Atrás de um proxy (Render, nginx) o remote_addr é o do proxy: PROXY_HOPS diz
+# quantos proxies de confiança acrescentam X-Forwarded-For/-Proto à frente da app
+# (1 no Render). Com 0 os cabeçalhos são ignorados (um cliente podia forjá-los).
+PROXY_HOPS = int(os.environ.get('PROXY_HOPS', '0'))
+if PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS, x_proto=PROXY_HOPS)
+
 # E-mail (Flask-Mail) – credenciais via variáveis de ambiente
 app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
 app.config['MAIL_PORT'] = int(os.environ.get('MAIL_PORT', '587'))
@@ -59,21 +97,432 @@ db_url = os.environ.get("DATABASE_URL", "")
 USE_POSTGRES = db_url.startswith("postgres://") or db_url.startswith("postgresql://")
 
 
-def get_db():
+# Pool de ligações: limitado, criado à preguiça e recriado após fork (gunicorn),
+# para que cada worker tenha as suas próprias ligações.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '5'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+DB_POOL_PING_AFTER = float(os.environ.get('DB_POOL_PING_AFTER', '30'))
+
+# Perfil SQLite de produção: WAL (leitores não bloqueiam o escritor nem vice-versa),
+# synchronous=NORMAL (seguro em WAL; só o último commit se perde num corte de
+# energia), cache e mmap maiores e busy_timeout para esperar pelo lock entre
+# workers. As leituras usam uma ligação só de leitura por thread, que vive
+# enquanto a thread viver; as escritas passam, uma de cada vez, por uma única
+# ligação de escrita por processo. Ligações longas reaproveitam as instruções já
+# preparadas (cache de SQLITE_STATEMENT_CACHE por ligação).
+# SQLITE_PROFILE=basic volta ao comportamento anterior (journal por omissão, pool).
+SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'production')
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', '16384'))
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+SQLITE_STATEMENT_CACHE = int(os.environ.get('SQLITE_STATEMENT_CACHE', '256'))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, connect, maxsize, timeout, ping_after):
+        self.connect = connect
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self.pid = os.getpid()
+        self._idle = []          # [(conn, released_at)]
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+        self._discarded = 0
+        self._timeouts = 0
+
+    def _healthy(self, conn, idle_for):
+        if USE_POSTGRES and conn.closed:
+            return False
+        if idle_for < self.ping_after:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            cur.close()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        self._discarded += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def getconn(self):
+        started = time.monotonic()
+        waited = False
+        with self._cond:
+            while not self._idle and self._in_use >= self.maxsize:
+                waited = True
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(f"Sem ligações livres após {self.timeout}s (pool={self.maxsize})")
+                self._cond.wait(remaining)
+            self._in_use += 1
+            item = self._idle.pop() if self._idle else None
+            wait = time.monotonic() - started
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+                self._wait_time += wait
+                self._max_wait = max(self._max_wait, wait)
+
+        try:
+            # health check fora do lock; ligação morta é substituída
+            if item is not None:
+                conn, released_at = item
+                if self._healthy(conn, time.monotonic() - released_at):
+                    return conn
+                self._discard(conn)
+            return self.connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, conn, broken=False):
+        if not broken:
+            try:
+                if USE_POSTGRES:
+                    broken = bool(conn.closed)
+                    if not broken and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                        conn.rollback()
+                elif conn.in_transaction:
+                    conn.rollback()
+            except Exception:
+                broken = True
+        if broken:
+            self._discard(conn)
+        with self._cond:
+            self._in_use -= 1
+            if not broken:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self.maxsize,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_time_total': round(self._wait_time, 6),
+                'wait_time_max': round(self._max_wait, 6),
+                'discarded': self._discarded,
+                'timeouts': self._timeouts,
+            }
+
+
+def _connect():
     if USE_POSTGRES:
         conn = psycopg2.connect(os.environ["DATABASE_URL"], sslmode="require")
         conn.autocommit = True
         return conn
     else:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        conn.execute("PRAGMA foreign_keys = ON;")
-        return conn
+        return _sqlite_connect()
 
-def execute_query(query, params=(), fetchone=False, fetchall=False, commit=False):
-    conn = get_db()
-    
+def sqlite_production():
+    return not USE_POSTGRES and SQLITE_PROFILE == 'production'
+
+def _sqlite_connect(readonly=False):
+    # check_same_thread=False: a ligação pode ser usada por outra thread
+    # depois de devolvida ao pool (nunca por duas ao mesmo tempo)
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False,
+                           timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+                           cached_statements=SQLITE_STATEMENT_CACHE)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON;")
+    if sqlite_production():
+        conn.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA journal_mode = WAL")   # fica gravado no ficheiro
+        conn.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        if readonly:
+            # uma escrita por engano na ligação de leitura falha em vez de pegar no lock
+            conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+class SqliteWriter:
+    """A única ligação de escrita do processo; quem escreve espera pela vez."""
+
+    def __init__(self, path, timeout):
+        self.pid = os.getpid()
+        self.path = path
+        self.timeout = timeout
+        self._conn = None
+        self._lock = threading.RLock()
+        self._writes = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+
+    @contextmanager
+    def connection(self):
+        started = time.perf_counter()
+        if not self._lock.acquire(timeout=self.timeout):
+            raise PoolTimeout(f"Ligação de escrita ocupada há mais de {self.timeout}s")
+        try:
+            wait = time.perf_counter() - started
+            self._writes += 1
+            if wait > 0.001:
+                self._waits += 1
+                self._wait_time += wait
+                self._max_wait = max(self._max_wait, wait)
+            if self._conn is None:
+                self._conn = _sqlite_connect()
+            _record_connect(time.perf_counter() - started)
+            try:
+                yield self._conn
+            finally:
+                if self._conn.in_transaction and not in_transaction():
+                    self._conn.rollback()
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        return {
+            'writes': self._writes,
+            'waits': self._waits,
+            'wait_time_total': round(self._wait_time, 6),
+            'wait_time_max': round(self._max_wait, 6),
+        }
+
+
+_sqlite_writer = None
+_sqlite_readers = threading.local()
+_sqlite_readers_opened = 0
+
+def get_sqlite_writer():
+    global _sqlite_writer
+    writer = _sqlite_writer
+    if writer is None or (writer.pid, writer.path) != (os.getpid(), DB_PATH):
+        with _pool_lock:
+            if _sqlite_writer is None or (_sqlite_writer.pid, _sqlite_writer.path) != (os.getpid(), DB_PATH):
+                # como no pool: a ligação herdada do processo pai não é fechada aqui
+                _sqlite_writer = SqliteWriter(DB_PATH, DB_POOL_TIMEOUT)
+            writer = _sqlite_writer
+    return writer
+
+def _sqlite_reader():
+    """Ligação só de leitura desta thread (aberta na primeira leitura)."""
+    global _sqlite_readers_opened
+    key = (os.getpid(), DB_PATH)
+    if getattr(_sqlite_readers, 'key', None) != key:
+        started = time.perf_counter()
+        _sqlite_readers.conn = _sqlite_connect(readonly=True)
+        _sqlite_readers.key = key
+        _sqlite_readers_opened += 1
+        _record_connect(time.perf_counter() - started)
+    return _sqlite_readers.conn
+
+def sqlite_stats():
+    return dict(get_sqlite_writer().stats(), profile=SQLITE_PROFILE, readers_opened=_sqlite_readers_opened)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    pool = _pool
+    if pool is None or pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid():
+                # Após fork não fechamos as ligações herdadas: pertencem ao processo pai
+                _pool = ConnectionPool(_connect, DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_POOL_PING_AFTER)
+            pool = _pool
+    return pool
+
+def pool_stats():
+    return get_pool().stats()
+
+# -----------------------------------------------------------------------------
+# Instrumentação das queries (por request): contagem, tempos, fingerprints
+# -----------------------------------------------------------------------------
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '200'))
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', '10'))
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '1') == '1'
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.connect = 0.0      # segundos à espera de / a abrir ligações
+        self.execute = 0.0
+        self.fetch = 0.0
+        self.fingerprints = {}  # fingerprint -> nº de execuções
+
+    def add_query(self, fingerprint, execute, fetch):
+        self.count += 1
+        self.execute += execute
+        self.fetch += fetch
+        self.fingerprints[fingerprint] = self.fingerprints.get(fingerprint, 0) + 1
+
+    def repeated(self, threshold):
+        return {fp: n for fp, n in self.fingerprints.items() if n > threshold}
+
+
+_FINGERPRINT_SUBS = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),           # strings
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),         # números
+    (re.compile(r"%s"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)"), "(...)"),  # IN (?, ?, ...)
+    (re.compile(r"\s+"), " "),
+]
+
+@functools.lru_cache(maxsize=1024)
+def query_fingerprint(query):
+    """Query normalizada (sem literais) para agrupar execuções da mesma instrução."""
+    for pattern, repl in _FINGERPRINT_SUBS:
+        query = pattern.sub(repl, query)
+    return query.strip()
+
+_collectors = threading.local()
+
+def _active_query_stats():
+    stats = list(getattr(_collectors, 'stack', ()))
+    if has_app_context():
+        request_stats = g.get('query_stats')
+        if request_stats is not None:
+            stats.append(request_stats)
+    return stats
+
+def _record_connect(elapsed):
+    for stats in _active_query_stats():
+        stats.connect += elapsed
+
+def _record_query(query, execute, fetch):
+    fingerprint = query_fingerprint(query)
+    for stats in _active_query_stats():
+        stats.add_query(fingerprint, execute, fetch)
+    elapsed_ms = (execute + fetch) * 1000
+    if elapsed_ms >= SLOW_QUERY_MS:
+        app.logger.warning('Query lenta (%.1f ms): %s', elapsed_ms, fingerprint)
+
+@contextmanager
+def capture_queries():
+    """Recolhe as queries executadas nesta thread dentro do bloco (útil em testes)."""
+    stats = QueryStats()
+    stack = _collectors.__dict__.setdefault('stack', [])
+    stack.append(stats)
+    try:
+        yield stats
+    finally:
+        stack.remove(stats)
+
+@contextmanager
+def max_queries(limit):
+    """Falha (AssertionError) se o bloco fizer mais de `limit` queries.
+
+        with max_queries(3):
+            client.get('/dashboard/discover')
+    """
+    with capture_queries() as stats:
+        yield stats
+    assert stats.count <= limit, (
+        f"{stats.count} queries (máximo {limit}):\n" +
+        "\n".join(f"  {n}x {fp}" for fp, n in stats.fingerprints.items())
+    )
+
+@app.before_request
+def start_query_stats():
+    g.query_stats = QueryStats()
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def report_query_stats(response):
+    stats = g.get('query_stats')
+    if stats is None:
+        return response
+
+    for fingerprint, n in stats.repeated(N_PLUS_ONE_THRESHOLD).items():
+        app.logger.warning('Possível N+1 em %s: %dx %s', request.endpoint, n, fingerprint)
+
+    if SERVER_TIMING:
+        total = time.perf_counter() - g.request_started
+        response.headers.add('Server-Timing', ', '.join([
+            f'db;desc="{stats.count} queries";dur={(stats.execute + stats.fetch) * 1000:.2f}',
+            f'db-connect;dur={stats.connect * 1000:.2f}',
+            f'db-exec;dur={stats.execute * 1000:.2f}',
+            f'db-fetch;dur={stats.fetch * 1000:.2f}',
+            f'total;dur={total * 1000:.2f}',
+        ]))
+    return response
+
+
+def _checkout():
+    started = time.perf_counter()
+    conn = get_pool().getconn()
+    _record_connect(time.perf_counter() - started)
+    return conn
+
+def get_db():
+    # Uma ligação por request, guardada em g e devolvida no teardown
+    if 'db' not in g:
+        g.db = _checkout()
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exception):
+    conn = g.pop('db', None)
+    if conn is not None:
+        get_pool().putconn(conn)
+
+# Transação em curso nesta thread (ver transaction())
+_tx_state = threading.local()
+
+def in_transaction():
+    return getattr(_tx_state, 'conn', None) is not None
+
+@contextmanager
+def db_connection(write=False):
+    """Ligação da transação/request atual ou, fora de um request (CLI, threads), uma do pool.
+
+    No perfil SQLite de produção: a ligação de escrita (write=True) ou a de
+    leitura desta thread.
+    """
+    tx_conn = getattr(_tx_state, 'conn', None)
+    if tx_conn is not None:
+        yield tx_conn
+        return
+    if sqlite_production():
+        if write:
+            with get_sqlite_writer().connection() as conn:
+                yield conn
+        else:
+            yield _sqlite_reader()
+        return
+    if has_app_context():
+        yield get_db()
+        return
+    conn = _checkout()
     try:
+        yield conn
+    finally:
+        get_pool().putconn(conn)
+
+def execute_query(query, params=(), fetchone=False, fetchall=False, commit=False, rowcount=False):
+    # commit=True marca a query como escrita (vai para a ligação de escrita)
+    with db_connection(write=commit) as conn:
         if USE_POSTGRES:
             cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
             # PostgreSQL usa %s como placeholder
@@ -81,33 +530,114 @@ def execute_query(query, params=(), fetchone=False, fetchall=False, commit=False
         else:
             cur = conn.cursor()
 
-        cur.execute(query, params)
+        try:
+            started = time.perf_counter()
+            cur.execute(query, params)
+            executed = time.perf_counter()
 
-        data = None
-        if fetchone:
-            row = cur.fetchone()
-            if row:
-                data = dict(row) if not USE_POSTGRES else row
-        elif fetchall:
-            rows = cur.fetchall()
-            if rows:
-                if USE_POSTGRES:
-                    data = rows
-                else:
-                    data = [dict(r) for r in rows]
+            data = None
+            if fetchone:
+                row = cur.fetchone()
+                if row:
+                    data = dict(row) if not USE_POSTGRES else row
+            elif fetchall:
+                rows = cur.fetchall()
+                if rows:
+                    if USE_POSTGRES:
+                        data = rows
+                    else:
+                        data = [dict(r) for r in rows]
+            elif rowcount:
+                # linhas realmente inseridas/alteradas/apagadas (0 num INSERT ignorado)
+                data = cur.rowcount
+            _record_query(query, executed - started, time.perf_counter() - executed)
+
+            # dentro de transaction() quem faz commit é a transação
+            if commit and not in_transaction():
+                conn.commit()
+
+            return data
+        except Exception:
+            if not USE_POSTGRES and conn.in_transaction and not in_transaction():
+                conn.rollback()
+            raise
+        finally:
+            cur.close()
 
-        if commit:
+@contextmanager
+def transaction():
+    """Unidade de trabalho: as queries dentro do bloco usam a mesma ligação e
+    um único commit no fim (rollback se houver exceção).
+
+        with transaction():
+            execute_query("DELETE ...", (...,), commit=True)
+            execute_query("DELETE ...", (...,), commit=True)
+
+    Transações aninhadas juntam-se à exterior.
+    """
+    if in_transaction():
+        yield _tx_state.conn
+        return
+    with db_connection(write=True) as conn:
+        if USE_POSTGRES:
+            # as ligações do pool estão em autocommit; desliga durante o bloco
+            conn.autocommit = False
+        elif not conn.in_transaction:
+            # IMMEDIATE: o lock de escrita é pedido logo (e espera pelo busy_timeout)
+            # em vez de falhar a meio ao passar de leitura a escrita
+            conn.execute("BEGIN IMMEDIATE" if sqlite_production() else "BEGIN")
+        _tx_state.conn = conn
+        try:
+            yield conn
             conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            _tx_state.conn = None
+            if USE_POSTGRES:
+                conn.autocommit = True
 
-        return data
+# RETURNING existe no SQLite desde a 3.35; antes disso usamos lastrowid
+SQLITE_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
 
-    finally:
-        conn.close()
+def insert_returning(table, values):
+    """INSERT de uma linha que devolve a linha inserida (dict) na mesma ida à base de dados."""
+    columns = ", ".join(values)
+    placeholders = ", ".join("?" for _ in values)
+    query = f"INSERT INTO {table} ({columns}) VALUES ({placeholders})"
+    params = tuple(values.values())
+    if USE_POSTGRES or SQLITE_HAS_RETURNING:
+        return execute_query(query + " RETURNING *", params, fetchone=True, commit=True)
+
+    with transaction() as conn:
+        cur = conn.cursor()
+        cur.execute(query, params)
+        row_id = cur.lastrowid
+        cur.close()
+        return execute_query(f"SELECT * FROM {table} WHERE id = ?", (row_id,), fetchone=True)
+
+def execute_many(query, seq_of_params):
+    """Executa a mesma instrução para várias linhas numa só transação."""
+    with transaction() as conn:
+        cur = conn.cursor()
+        try:
+            started = time.perf_counter()
+            if USE_POSTGRES:
+                psycopg2.extras.execute_batch(cur, query.replace("?", "%s"), seq_of_params, page_size=500)
+            else:
+                cur.executemany(query, seq_of_params)
+            _record_query(query, time.perf_counter() - started, 0.0)
+        finally:
+            cur.close()
 
 
 def init_db():
     # Criação das tabelas (usado apenas localmente)
-    conn = get_db()
+    with db_connection(write=True) as conn:
+        _create_tables(conn)
+
+def _create_tables(conn):
     c = conn.cursor()
     # users / avatars etc... (sem alteração)
     if USE_POSTGRES:
@@ -206,215 +736,3399 @@ def init_db():
             FOREIGN KEY(quiz_id) REFERENCES quizzes(id) ON DELETE CASCADE
         )''')
 
-    conn.commit()
-    conn.close()
+    # Tentativas (resultados dos quizzes), escritas em lote pelo AttemptRecorder
+    if USE_POSTGRES:
+        c.execute('''
+        CREATE TABLE IF NOT EXISTS attempts (
+            id SERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            quiz_id INTEGER NOT NULL,
+            score INTEGER NOT NULL,
+            total INTEGER NOT NULL,
+            answers TEXT,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY(quiz_id) REFERENCES quizzes(id) ON DELETE CASCADE
+        )''')
+    else:
+        c.execute('''
+        CREATE TABLE IF NOT EXISTS attempts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            quiz_id INTEGER NOT NULL,
+            score INTEGER NOT NULL,
+            total INTEGER NOT NULL,
+            answers TEXT,
+            created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY(quiz_id) REFERENCES quizzes(id) ON DELETE CASCADE
+        )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_attempts_quiz_user ON attempts(quiz_id, user_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_attempts_user ON attempts(user_id, id)")
+
+    # Melhor resultado de cada utilizador em cada quiz (classificações),
+    # atualizado por store_attempts na mesma transação que grava as tentativas
+    if USE_POSTGRES:
+        c.execute('''
+        CREATE TABLE IF NOT EXISTS best_scores (
+            user_id INTEGER NOT NULL,
+            quiz_id INTEGER NOT NULL,
+            score INTEGER NOT NULL,
+            total INTEGER NOT NULL,
+            achieved_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (user_id, quiz_id),
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY(quiz_id) REFERENCES quizzes(id) ON DELETE CASCADE
+        )''')
+    else:
+        c.execute('''
+        CREATE TABLE IF NOT EXISTS best_scores (
+            user_id INTEGER NOT NULL,
+            quiz_id INTEGER NOT NULL,
+            score INTEGER NOT NULL,
+            total INTEGER NOT NULL,
+            achieved_at TEXT NOT NULL,
+            PRIMARY KEY (user_id, quiz_id),
+            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY(quiz_id) REFERENCES quizzes(id) ON DELETE CASCADE
+        )''')
+    # mesma ordem da classificação: o top-K é o início do índice
+    c.execute("CREATE INDEX IF NOT EXISTS idx_best_scores_rank ON best_scores(quiz_id, score DESC, achieved_at, user_id)")
+
+    # Caixa de saída de e-mail (enviada em background pelo MailSender).
+    # Tempos em segundos epoch para comparar igual nos dois backends.
+    if USE_POSTGRES:
+        c.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id SERIAL PRIMARY KEY,
+            recipient TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            dedupe_key TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            claim TEXT,
+            created_at DOUBLE PRECISION NOT NULL,
+            next_attempt_at DOUBLE PRECISION NOT NULL,
+            sent_at DOUBLE PRECISION
+        )''')
+    else:
+        c.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            recipient TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            dedupe_key TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            claim TEXT,
+            created_at REAL NOT NULL,
+            next_attempt_at REAL NOT NULL,
+            sent_at REAL
+        )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_outbox_dedupe ON outbox(dedupe_key, created_at)")
+
+    # Pesquisa full-text: tsvector + GIN em Postgres, FTS5 em SQLite (rowid = quiz id)
+    if USE_POSTGRES:
+        c.execute('''
+        CREATE TABLE IF NOT EXISTS quiz_search (
+            quiz_id INTEGER PRIMARY KEY,
+            document TSVECTOR NOT NULL,
+            FOREIGN KEY(quiz_id) REFERENCES quizzes(id) ON DELETE CASCADE
+        )''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_quiz_search_document ON quiz_search USING GIN(document)")
+    else:
+        c.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS quiz_search USING fts5(
+            title, description, questions,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )''')
+
+    # Índices (iguais nos dois backends) para a paginação por cursor e os JOINs
+    c.execute("CREATE INDEX IF NOT EXISTS idx_quizzes_public_id ON quizzes(is_public, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_quizzes_created_by ON quizzes(created_by, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_questions_quiz_id ON questions(quiz_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_favorites_user_id ON favorites(user_id, id)")
+
+    # Colunas acrescentadas depois da criação inicial das tabelas
+    _add_column_if_missing(c, 'quizzes', 'version', 'INTEGER NOT NULL DEFAULT 1')
+    _add_column_if_missing(c, 'quizzes', 'cover_bytes', 'INTEGER NOT NULL DEFAULT 0')
+
+    # Contadores desnormalizados (mantidos por create_question/import_questions e
+    # add/remove_favorite); na primeira vez são preenchidos a partir das tabelas
+    added = _add_column_if_missing(c, 'quizzes', 'question_count', 'INTEGER NOT NULL DEFAULT 0')
+    added |= _add_column_if_missing(c, 'quizzes', 'favorite_count', 'INTEGER NOT NULL DEFAULT 0')
+    if added:
+        c.execute(f"UPDATE quizzes SET question_count = ({QUESTION_COUNT_SQL}), "
+                  f"favorite_count = ({FAVORITE_COUNT_SQL})")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_quizzes_public_favorites ON quizzes(is_public, favorite_count, id)")
+
+    # Pontos da classificação geral (soma dos melhores resultados); na primeira
+    # vez best_scores e points são calculados a partir das tentativas existentes
+    if _add_column_if_missing(c, 'users', 'points', 'INTEGER NOT NULL DEFAULT 0'):
+        c.execute(BEST_SCORES_BACKFILL_SQL)
+        c.execute(f"UPDATE users SET points = ({USER_POINTS_SQL})")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_points ON users(points DESC, id)")
+
+    conn.commit()
+
+def _add_column_if_missing(c, table, column, ddl):
+    """Acrescenta a coluna se ainda não existir; devolve True se a criou."""
+    if USE_POSTGRES:
+        c.execute("SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = %s",
+                  (table, column))
+        if c.fetchone():
+            return False
+    else:
+        c.execute(f"PRAGMA table_info({table})")
+        if column in {row[1] for row in c.fetchall()}:
+            return False
+    c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+    return True
+
+# -----------------------------------------------------------------------------
+# Palavras-passe: hash num pool limitado + throttling por token bucket
+# -----------------------------------------------------------------------------
+# O scrypt é propositadamente caro (CPU e ~32 MB por hash). Corremos os hashes
+# num pool pequeno por processo: no máximo PASSWORD_HASH_WORKERS em paralelo e
+# PASSWORD_HASH_QUEUE_MAX à espera; acima disso o pedido falha logo (503) em vez
+# de acumular threads e memória. O método é configurável (formato do Werkzeug,
+# ex. "scrypt:32768:8:1" ou "pbkdf2:sha256:600000"); hashes antigos são
+# refeitos no login seguinte.
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '2'))
+PASSWORD_HASH_QUEUE_MAX = int(os.environ.get('PASSWORD_HASH_QUEUE_MAX', '16'))
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', '10'))
+
+
+class PasswordHashBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self, workers, queue_max, timeout):
+        self.workers = workers
+        self.queue_max = queue_max
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._pending = 0
+        self.hashed = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            # as threads do executor não sobrevivem ao fork do gunicorn
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._pending = 0
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='password-hash')
+            if self._pending >= self.workers + self.queue_max:
+                self.rejected += 1
+                raise PasswordHashBusy()
+            self._pending += 1
+            future = self._executor.submit(fn, *args)
+        # conta como pendente até acabar mesmo que quem pediu desista (timeout)
+        future.add_done_callback(self._done)
+        try:
+            return future.result(self.timeout)
+        except FutureTimeoutError:
+            # fila lenta: o mesmo 503 + Retry-After de quando está cheia
+            with self._lock:
+                self.timeouts += 1
+            raise PasswordHashBusy()
+
+    def _done(self, future):
+        with self._lock:
+            self._pending -= 1
+            self.hashed += 1
+
+    def hash(self, password):
+        return self._submit(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+    def verify(self, password_hash, password):
+        return self._submit(check_password_hash, password_hash, password)
+
+    def stats(self):
+        with self._lock:
+            return {'workers': self.workers, 'pending': self._pending,
+                    'hashed': self.hashed, 'rejected': self.rejected, 'timeouts': self.timeouts}
+
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_MAX, PASSWORD_HASH_TIMEOUT)
+
+@functools.lru_cache(maxsize=None)
+def _password_hash_prefix(method):
+    # o Werkzeug expande "scrypt" para "scrypt:32768:8:1", etc.; o hash guarda a forma completa
+    return generate_password_hash('', method=method, salt_length=1).split('$', 1)[0]
+
+def password_needs_rehash(password_hash):
+    return password_hash.split('$', 1)[0] != _password_hash_prefix(PASSWORD_HASH_METHOD)
+
+
+# Os limites por IP só fazem sentido com o IP real do cliente: por omissão só
+# ficam ativos com PROXY_HOPS configurado (sem proxy, AUTH_THROTTLE=1 explícito)
+AUTH_THROTTLE = os.environ.get('AUTH_THROTTLE', '1' if PROXY_HOPS else '0') == '1'
+LOGIN_IDENTIFIER_BURST = int(os.environ.get('LOGIN_IDENTIFIER_BURST', '5'))
+LOGIN_IDENTIFIER_RATE = float(os.environ.get('LOGIN_IDENTIFIER_RATE', '0.05'))   # tokens/s (1 a cada 20 s)
+AUTH_IP_BURST = int(os.environ.get('AUTH_IP_BURST', '20'))
+AUTH_IP_RATE = float(os.environ.get('AUTH_IP_RATE', '0.5'))
+THROTTLE_MAX_KEYS = 10000
+
+
+class TokenBucket:
+    """Limite por chave: `burst` pedidos seguidos e depois `rate` por segundo (por processo)."""
+
+    def __init__(self, burst, rate, max_keys=THROTTLE_MAX_KEYS):
+        self.burst = burst
+        self.rate = rate
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()   # key -> (tokens, atualizado_em)
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return allowed
+
+    def retry_after(self, key):
+        with self._lock:
+            tokens, _ = self._buckets.get(key, (self.burst, 0))
+        return max(1, int((1 - tokens) / self.rate) + 1) if self.rate else 60
+
+
+login_throttle = TokenBucket(LOGIN_IDENTIFIER_BURST, LOGIN_IDENTIFIER_RATE)
+ip_throttle = TokenBucket(AUTH_IP_BURST, AUTH_IP_RATE)
+
+def throttled(identifier=None):
+    """Segundos a esperar se este IP (ou identificador) excedeu o limite; None se pode avançar."""
+    if not AUTH_THROTTLE:
+        return None
+    ip = request.remote_addr or '-'
+    if not ip_throttle.allow(ip):
+        return ip_throttle.retry_after(ip)
+    if identifier is not None:
+        key = identifier.lower()
+        if not login_throttle.allow(key):
+            return login_throttle.retry_after(key)
+    return None
+
+
+# -----------------------------------------------------------------------------
+# Simple row -> object wrapper
+# -----------------------------------------------------------------------------
+class DBObject:
+    def __init__(self, row):
+        if not row:
+            return
+        for k in row.keys():
+            setattr(self, k, row[k])
+
+# -----------------------------------------------------------------------------
+# CRUD Functions (Compatíveis com SQLite + PostgreSQL)
+# -----------------------------------------------------------------------------
+def get_user_by_id(user_id):
+    row = execute_query("SELECT * FROM users WHERE id = ?", (user_id,), fetchone=True)
+    return DBObject(row) if row else None
+
+def get_user_by_username(username):
+    row = execute_query("SELECT * FROM users WHERE username = ?", (username,), fetchone=True)
+    return DBObject(row) if row else None
+
+def get_user_by_email(email):
+    row = execute_query("SELECT * FROM users WHERE email = ?", (email,), fetchone=True)
+    return DBObject(row) if row else None
+
+def create_user(username, email, password):
+    password_hash = password_hasher.hash(password)
+    row = insert_returning('users', {'username': username, 'email': email, 'password_hash': password_hash})
+    return DBObject(row)
+
+def update_user_password(user_id, new_password):
+    password_hash = password_hasher.hash(new_password)
+    execute_query("UPDATE users SET password_hash = ? WHERE id = ?", (password_hash, user_id), commit=True)
+    invalidate_user_cache(user_id)
+
+def get_avatar_by_user_id(user_id):
+    row = execute_query("SELECT * FROM avatars WHERE user_id = ?", (user_id,), fetchone=True)
+    return DBObject(row) if row else None
+
+def create_avatar_for_user(user_id):
+    if USE_POSTGRES:
+        execute_query(
+            "INSERT INTO avatars (user_id, outfit, accessory) VALUES (%s, NULL, NULL) ON CONFLICT (user_id) DO NOTHING",
+            (user_id,),
+            commit=True
+        )
+    else:
+        execute_query(
+            "INSERT OR IGNORE INTO avatars (user_id, outfit, accessory) VALUES (?, NULL, NULL)",
+            (user_id,),
+            commit=True
+        )
+    invalidate_user_cache(user_id)
+    return get_avatar_by_user_id(user_id)
+
+def update_avatar(user_id, outfit=None, accessory=None):
+    # garante que exista
+    create_avatar_for_user(user_id)
+    
+    # build dynamic query
+    updates = []
+    params = []
+
+    if outfit is not None:
+        updates.append("outfit = %s" if USE_POSTGRES else "outfit = ?")
+        params.append(outfit)
+    if accessory is not None:
+        updates.append("accessory = %s" if USE_POSTGRES else "accessory = ?")
+        params.append(accessory)
+
+    if updates:
+        query = f"UPDATE avatars SET {', '.join(updates)} WHERE user_id = %s" if USE_POSTGRES else f"UPDATE avatars SET {', '.join(updates)} WHERE user_id = ?"
+        params.append(user_id)
+        execute_query(query, tuple(params), commit=True)
+        invalidate_user_cache(user_id)
+
+    return get_avatar_by_user_id(user_id)
+
+
+def create_quiz(title, description, is_public, created_by, cover_image_url, cover_bytes=0):
+    with transaction():
+        row = insert_returning('quizzes', {
+            'title': title,
+            'description': description,
+            'is_public': bool(is_public),
+            'created_by': created_by,
+            'cover_image_url': cover_image_url,
+            'cover_bytes': cover_bytes,
+        })
+        index_quiz(row['id'])
+    quiz_changed(row['id'])
+    return DBObject(row)
+
+def get_quiz_by_id(quiz_id, with_questions=True):
+    row = execute_query("SELECT * FROM quizzes WHERE id = ?", (quiz_id,), fetchone=True)
+    if not row:
+        return None
+    quiz = DBObject(row)
+    if with_questions:
+        quiz.questions = get_questions_for_quiz(quiz.id)
+    return quiz
+
+# Listagens: question_count e favorite_count são colunas de quizzes, por isso
+# as páginas não tocam em questions nem em favorites.
+QUIZ_SUMMARY_SELECT = """
+    SELECT q.*
+    FROM quizzes q
+"""
+
+QUIZ_PAGE_SIZE = 24
+
+def _keyset_page(query, params, after, limit, cursor_column, cursor_key='id'):
+    """Paginação por cursor: devolve (itens, próximo cursor ou None).
+
+    `query` já tem o WHERE; acrescenta `cursor_column < after`, ordena por
+    ordem decrescente e pede limit + 1 linhas para saber se há mais páginas.
+    """
+    params = list(params)
+    if after is not None:
+        query += f" AND {cursor_column} < ?"
+        params.append(after)
+    query += f" ORDER BY {cursor_column} DESC"
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit + 1)
+    rows = execute_query(query, tuple(params), fetchall=True)
+    items = [DBObject(r) for r in rows or []]
+    next_cursor = None
+    if limit and len(items) > limit:
+        items = items[:limit]
+        next_cursor = getattr(items[-1], cursor_key)
+    return items, next_cursor
+
+def get_quizzes_by_user(user_id, after=None, limit=QUIZ_PAGE_SIZE):
+    return _keyset_page(
+        QUIZ_SUMMARY_SELECT + " WHERE q.created_by = ?", (user_id,),
+        after, limit, "q.id"
+    )
+
+def get_public_quizzes(after=None, limit=QUIZ_PAGE_SIZE):
+    # Usa placeholder e passa um booleano; execute_query converte ? -> %s em Postgres
+    return _keyset_page(
+        QUIZ_SUMMARY_SELECT + " WHERE q.is_public = ?", (True,),
+        after, limit, "q.id"
+    )
+
+def get_popular_quizzes(after=None, limit=QUIZ_PAGE_SIZE):
+    """Quizzes públicos mais favoritados; o cursor é "favorite_count:id" da última linha."""
+    query = QUIZ_SUMMARY_SELECT + " WHERE q.is_public = ?"
+    params = [True]
+    match = re.fullmatch(r'(\d+):(\d+)', after or '')
+    if match:
+        # comparação de tuplos: segue o índice (is_public, favorite_count, id)
+        query += " AND (q.favorite_count, q.id) < (?, ?)"
+        params += [int(match.group(1)), int(match.group(2))]
+    query += " ORDER BY q.favorite_count DESC, q.id DESC LIMIT ?"
+    params.append(limit + 1)
+    rows = execute_query(query, tuple(params), fetchall=True)
+    items = [DBObject(r) for r in rows or []]
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = f'{items[-1].favorite_count}:{items[-1].id}'
+    return items, next_cursor
+
+def update_quiz(quiz_id, title=None, description=None, is_public=None, cover_image_url=None, cover_bytes=None):
+    # Só os campos indicados, num único UPDATE
+    changes = {
+        'title': title,
+        'description': description,
+        'is_public': bool(is_public) if is_public is not None else None,
+        'cover_image_url': cover_image_url,
+        'cover_bytes': cover_bytes,
+    }
+    changes = {k: v for k, v in changes.items() if v is not None}
+    if not changes:
+        return get_quiz_by_id(quiz_id, with_questions=False)
+
+    # version = versão do conteúdo (ETag do /play e do detalhe)
+    assignments = ", ".join([f"{column} = ?" for column in changes] + ["version = version + 1"])
+    with transaction():
+        row = execute_query(
+            f"UPDATE quizzes SET {assignments} WHERE id = ? RETURNING *"
+            if USE_POSTGRES or SQLITE_HAS_RETURNING else
+            f"UPDATE quizzes SET {assignments} WHERE id = ?",
+            tuple(changes.values()) + (quiz_id,), fetchone=True, commit=True
+        )
+        if 'title' in changes or 'description' in changes:
+            index_quiz(quiz_id)
+    quiz_changed(quiz_id)
+    if row is None:
+        return get_quiz_by_id(quiz_id, with_questions=False)
+    return DBObject(row)
+
+def delete_quiz_by_id(quiz_id):
+    # Tudo ou nada: perguntas, favoritos, tentativas, classificação, índice de pesquisa e o quiz
+    with transaction():
+        execute_query("DELETE FROM questions WHERE quiz_id = ?", (quiz_id,), commit=True)
+        execute_query("DELETE FROM favorites WHERE quiz_id = ?", (quiz_id,), commit=True)
+        execute_query("DELETE FROM attempts WHERE quiz_id = ?", (quiz_id,), commit=True)
+        # o resultado neste quiz deixa de contar nos pontos de quem o jogou
+        execute_query(
+            "UPDATE users SET points = points - (SELECT b.score FROM best_scores b "
+            "WHERE b.user_id = users.id AND b.quiz_id = ?) "
+            "WHERE id IN (SELECT user_id FROM best_scores WHERE quiz_id = ?)",
+            (quiz_id, quiz_id), commit=True
+        )
+        execute_query("DELETE FROM best_scores WHERE quiz_id = ?", (quiz_id,), commit=True)
+        unindex_quiz(quiz_id)
+        execute_query("DELETE FROM quizzes WHERE id = ?", (quiz_id,), commit=True)
+    quiz_changed(quiz_id)
+    leaderboards_changed(drop=[quiz_id], overall=True)
+
+def create_question(quiz_id, question_text, option_a, option_b, option_c, option_d, correct_option):
+    with transaction():
+        row = insert_returning('questions', {
+            'quiz_id': quiz_id,
+            'question_text': question_text,
+            'option_a': option_a,
+            'option_b': option_b,
+            'option_c': option_c,
+            'option_d': option_d,
+            'correct_option': correct_option,
+        })
+        # versão e contador no mesmo UPDATE atómico da transação do INSERT
+        execute_query(
+            "UPDATE quizzes SET version = version + 1, question_count = question_count + 1 WHERE id = ?",
+            (quiz_id,), commit=True
+        )
+        index_question(quiz_id, question_text)
+    quiz_changed(quiz_id)
+    return DBObject(row)
+
+def get_question_by_id(qid):
+    row = execute_query("SELECT * FROM questions WHERE id = ?", (qid,), fetchone=True)
+    return DBObject(row) if row else None
+
+def get_questions_for_quiz(quiz_id):
+    rows = execute_query("SELECT * FROM questions WHERE quiz_id = ? ORDER BY id", (quiz_id,), fetchall=True)
+    return [DBObject(r) for r in rows or []]
+
+def get_answer_key(quiz_id):
+    """{question_id: correct_option} — só o necessário para corrigir."""
+    rows = execute_query("SELECT id, correct_option FROM questions WHERE quiz_id = ?", (quiz_id,), fetchall=True)
+    return {r['id']: r['correct_option'] for r in rows or []}
+
+def grade_answers(answer_key, answers):
+    # answers vem do cliente no formato {"q<id>": "A"}
+    return sum(1 for qid, correct in answer_key.items()
+               if correct and answers.get(f"q{qid}") == correct)
+
+def get_favorite(user_id, quiz_id):
+    row = execute_query("SELECT * FROM favorites WHERE user_id = ? AND quiz_id = ?", (user_id, quiz_id), fetchone=True)
+    return DBObject(row) if row else None
+
+def add_favorite(user_id, quiz_id):
+    # O contador só sobe se a linha foi mesmo inserida (um duplo clique não conta duas vezes)
+    with transaction():
+        if USE_POSTGRES:
+            inserted = execute_query(
+                "INSERT INTO favorites (user_id, quiz_id) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+                (user_id, quiz_id),
+                commit=True, rowcount=True
+            )
+        else:
+            inserted = execute_query(
+                "INSERT OR IGNORE INTO favorites (user_id, quiz_id) VALUES (?, ?)",
+                (user_id, quiz_id),
+                commit=True, rowcount=True
+            )
+        if inserted:
+            execute_query("UPDATE quizzes SET favorite_count = favorite_count + ? WHERE id = ?",
+                          (inserted, quiz_id), commit=True)
+    fragment_cache.bump(f'favorites:{user_id}', 'popular')
+
+def remove_favorite(user_id, quiz_id):
+    with transaction():
+        deleted = execute_query("DELETE FROM favorites WHERE user_id = ? AND quiz_id = ?",
+                                (user_id, quiz_id), commit=True, rowcount=True)
+        if deleted:
+            execute_query("UPDATE quizzes SET favorite_count = favorite_count - ? WHERE id = ?",
+                          (deleted, quiz_id), commit=True)
+    fragment_cache.bump(f'favorites:{user_id}', 'popular')
+
+def get_favorites_for_user(user_id, after=None, limit=QUIZ_PAGE_SIZE):
+    # Cursor sobre favorites.id: os favoritos mais recentes primeiro
+    return _keyset_page("""
+        SELECT q.*, f.id AS favorite_id
+        FROM quizzes q
+        JOIN favorites f ON q.id = f.quiz_id
+        WHERE f.user_id = ?""", (user_id,),
+        after, limit, "f.id", cursor_key='favorite_id'
+    )
+
+# Reconciliação dos contadores: recalcula por lotes de ids e só escreve as linhas
+# que divergem. Não devia haver deriva (tudo é mantido na mesma transação), mas
+# escritas diretas na base ou restauros parciais podem criá-la. Correr
+# periodicamente (`flask reconcile-counters`, ex. a partir do cron).
+QUESTION_COUNT_SQL = "SELECT COUNT(*) FROM questions qs WHERE qs.quiz_id = quizzes.id"
+FAVORITE_COUNT_SQL = "SELECT COUNT(*) FROM favorites f WHERE f.quiz_id = quizzes.id"
+COUNTER_RECONCILE_BATCH = int(os.environ.get('COUNTER_RECONCILE_BATCH', '500'))
+
+def reconcile_quiz_counters(batch_size=COUNTER_RECONCILE_BATCH):
+    """Corrige question_count/favorite_count; devolve {'scanned', 'repaired'}."""
+    stats = {'scanned': 0, 'repaired': 0}
+    last_id = 0
+    while True:
+        row = execute_query(
+            "SELECT MAX(id) AS upper, COUNT(*) AS total FROM "
+            "(SELECT id FROM quizzes WHERE id > ? ORDER BY id LIMIT ?) batch",
+            (last_id, batch_size), fetchone=True
+        )
+        if not row or row['upper'] is None:
+            break
+        # um lote por transação: os locks duram pouco
+        with transaction():
+            stats['repaired'] += execute_query(
+                f"UPDATE quizzes SET question_count = ({QUESTION_COUNT_SQL}), "
+                f"favorite_count = ({FAVORITE_COUNT_SQL}) "
+                f"WHERE id > ? AND id <= ? AND (question_count <> ({QUESTION_COUNT_SQL}) "
+                f"OR favorite_count <> ({FAVORITE_COUNT_SQL}))",
+                (last_id, row['upper']), commit=True, rowcount=True
+            )
+        stats['scanned'] += row['total']
+        last_id = row['upper']
+    if stats['repaired']:
+        fragment_cache.bump('quizzes', 'popular')
+    return stats
+
+
+# -----------------------------------------------------------------------------
+# Pesquisa (FTS5 em SQLite / tsvector em PostgreSQL)
+# -----------------------------------------------------------------------------
+SEARCH_TS_CONFIG = 'simple'
+SEARCH_MAX_OFFSET = 1000
+
+def _index_quizzes_sql(where):
+    if USE_POSTGRES:
+        return f"""
+            INSERT INTO quiz_search (quiz_id, document)
+            SELECT q.id,
+                   setweight(to_tsvector('{SEARCH_TS_CONFIG}', coalesce(q.title, '')), 'A') ||
+                   setweight(to_tsvector('{SEARCH_TS_CONFIG}', coalesce(q.description, '')), 'B') ||
+                   setweight(to_tsvector('{SEARCH_TS_CONFIG}', coalesce(
+                       (SELECT string_agg(question_text, ' ') FROM questions WHERE quiz_id = q.id), '')), 'C')
+            FROM quizzes q {where}
+            ON CONFLICT (quiz_id) DO UPDATE SET document = EXCLUDED.document
+        """
+    return f"""
+        INSERT INTO quiz_search (rowid, title, description, questions)
+        SELECT q.id, q.title, coalesce(q.description, ''),
+               coalesce((SELECT group_concat(question_text, ' ') FROM questions WHERE quiz_id = q.id), '')
+        FROM quizzes q {where}
+    """
+
+def index_quiz(quiz_id):
+    """(Re)indexa título, descrição e texto das perguntas de um quiz."""
+    if not USE_POSTGRES:
+        # FTS5 não tem upsert: apaga e volta a inserir
+        unindex_quiz(quiz_id)
+    execute_query(_index_quizzes_sql("WHERE q.id = ?"), (quiz_id,), commit=True)
+
+def index_question(quiz_id, question_text):
+    """Acrescenta o texto de uma pergunta nova ao documento do quiz (sem reler as outras)."""
+    if USE_POSTGRES:
+        updated = execute_query(
+            f"UPDATE quiz_search SET document = document || "
+            f"setweight(to_tsvector('{SEARCH_TS_CONFIG}', ?), 'C') WHERE quiz_id = ?",
+            (question_text, quiz_id), commit=True, rowcount=True)
+    else:
+        updated = execute_query(
+            "UPDATE quiz_search SET questions = questions || ' ' || ? WHERE rowid = ?",
+            (question_text, quiz_id), commit=True, rowcount=True)
+    if not updated:
+        index_quiz(quiz_id)   # o quiz ainda não estava no índice
+
+def unindex_quiz(quiz_id):
+    if USE_POSTGRES:
+        execute_query("DELETE FROM quiz_search WHERE quiz_id = ?", (quiz_id,), commit=True)
+    else:
+        execute_query("DELETE FROM quiz_search WHERE rowid = ?", (quiz_id,), commit=True)
+
+def reindex_all_quizzes():
+    """Reconstrói o índice inteiro com um único INSERT ... SELECT."""
+    execute_query("DELETE FROM quiz_search", commit=True)
+    execute_query(_index_quizzes_sql(""), commit=True)
+    row = execute_query("SELECT COUNT(*) AS total FROM quizzes", fetchone=True)
+    return row['total']
+
+def _search_terms(text):
+    # Só palavras: o input do utilizador nunca chega à sintaxe de MATCH / tsquery
+    return re.findall(r"\w+", text or "")[:10]
+
+def search_quizzes(text, offset=0, limit=QUIZ_PAGE_SIZE):
+    """Quizzes públicos ordenados por relevância; devolve (itens, próximo offset ou None).
+
+    Cada termo é pesquisado como prefixo e todos têm de aparecer (AND).
+    O título pesa mais do que a descrição, que pesa mais do que as perguntas.
+    """
+    terms = _search_terms(text)
+    if not terms:
+        return [], None
+    offset = min(max(offset or 0, 0), SEARCH_MAX_OFFSET)
+
+    if USE_POSTGRES:
+        rows = execute_query(f"""
+            SELECT q.*, ts_rank(s.document, query) AS rank
+            FROM quiz_search s
+            JOIN quizzes q ON q.id = s.quiz_id,
+                 to_tsquery('{SEARCH_TS_CONFIG}', ?) query
+            WHERE s.document @@ query AND q.is_public = ?
+            ORDER BY rank DESC, q.id DESC
+            LIMIT ? OFFSET ?
+        """, (" & ".join(f"{t}:*" for t in terms), True, limit + 1, offset), fetchall=True)
+    else:
+        rows = execute_query("""
+            SELECT q.*, bm25(quiz_search, 10.0, 5.0, 1.0) AS rank
+            FROM quiz_search
+            JOIN quizzes q ON q.id = quiz_search.rowid
+            WHERE quiz_search MATCH ? AND q.is_public = ?
+            ORDER BY rank, q.id DESC
+            LIMIT ? OFFSET ?
+        """, (" ".join(f'"{t}"*' for t in terms), True, limit + 1, offset), fetchall=True)
+
+    items = [DBObject(r) for r in rows or []]
+    next_offset = None
+    if len(items) > limit:
+        items = items[:limit]
+        if offset + limit <= SEARCH_MAX_OFFSET:
+            next_offset = offset + limit
+    return items, next_offset
+
+
+# -----------------------------------------------------------------------------
+# Tentativas: gravação em lote (write-behind)
+# -----------------------------------------------------------------------------
+# submit_quiz só põe a tentativa numa fila em memória; uma thread grava-as em
+# lote (executemany + melhores resultados das classificações, um commit) quando
+# há ATTEMPT_BATCH_SIZE pendentes ou a cada ATTEMPT_FLUSH_INTERVAL segundos. À
+# saída do processo (atexit) a fila é esvaziada. Compromisso: se o worker morrer sem sair (SIGKILL, OOM) perdem-se
+# no máximo as tentativas desse intervalo. ATTEMPT_WRITE_BEHIND=0 grava cada
+# tentativa de imediato.
+ATTEMPT_WRITE_BEHIND = os.environ.get('ATTEMPT_WRITE_BEHIND', '1') == '1'
+ATTEMPT_BATCH_SIZE = int(os.environ.get('ATTEMPT_BATCH_SIZE', '100'))
+ATTEMPT_FLUSH_INTERVAL = float(os.environ.get('ATTEMPT_FLUSH_INTERVAL', '2'))
+ATTEMPT_QUEUE_MAX = int(os.environ.get('ATTEMPT_QUEUE_MAX', '5000'))
+
+INSERT_ATTEMPT_SQL = (
+    "INSERT INTO attempts (user_id, quiz_id, score, total, answers, created_at) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+
+# Melhor resultado por (utilizador, quiz): só substitui se for maior, por isso
+# reaplicar a mesma linha (ou aplicá-la fora de ordem) não muda nada
+UPSERT_BEST_SCORE_SQL = (
+    "INSERT INTO best_scores (user_id, quiz_id, score, total, achieved_at) VALUES (?, ?, ?, ?, ?) "
+    "ON CONFLICT (user_id, quiz_id) DO UPDATE SET score = excluded.score, total = excluded.total, "
+    "achieved_at = excluded.achieved_at WHERE excluded.score > best_scores.score"
+)
+USER_POINTS_SQL = "SELECT COALESCE(SUM(b.score), 0) FROM best_scores b WHERE b.user_id = users.id"
+# a primeira tentativa com a pontuação máxima de cada (utilizador, quiz)
+BEST_SCORES_BACKFILL_SQL = """
+    INSERT INTO best_scores (user_id, quiz_id, score, total, achieved_at)
+    SELECT a.user_id, a.quiz_id, a.score, MAX(a.total), MIN(a.created_at)
+    FROM attempts a
+    WHERE a.score = (SELECT MAX(b.score) FROM attempts b WHERE b.user_id = a.user_id AND b.quiz_id = a.quiz_id)
+    GROUP BY a.user_id, a.quiz_id, a.score"""
+
+
+def _update_best_scores(rows):
+    """Atualiza best_scores e users.points para as tentativas `rows` (dentro de uma transação).
+
+    Devolve (melhorias [(user_id, quiz_id, score, achieved_at)], [(user_id, pontos)]).
+    """
+    best = {}   # (user_id, quiz_id) -> melhor do lote; em empate fica a mais antiga
+    for user_id, quiz_id, score, total, _, created_at in rows:
+        current = best.get((user_id, quiz_id))
+        if current is None or score > current[0]:
+            best[(user_id, quiz_id)] = (score, total, created_at)
+
+    by_quiz = {}
+    for (user_id, quiz_id), entry in best.items():
+        by_quiz.setdefault(quiz_id, {})[user_id] = entry
+    improved = []
+    for quiz_id, entries in by_quiz.items():
+        placeholders = ", ".join("?" for _ in entries)
+        current = {row['user_id']: row['score'] for row in execute_query(
+            f"SELECT user_id, score FROM best_scores WHERE quiz_id = ? AND user_id IN ({placeholders})",
+            (quiz_id, *entries), fetchall=True) or []}
+        improved += [(user_id, quiz_id, score, total, created_at)
+                     for user_id, (score, total, created_at) in entries.items()
+                     if user_id not in current or score > current[user_id]]
+    if not improved:
+        return [], []
+
+    execute_many(UPSERT_BEST_SCORE_SQL, improved)
+    user_ids = sorted({row[0] for row in improved})
+    placeholders = ", ".join("?" for _ in user_ids)
+    # recalculado pela chave primária de best_scores: não deriva com escritas concorrentes
+    execute_query(f"UPDATE users SET points = ({USER_POINTS_SQL}) WHERE id IN ({placeholders})",
+                  tuple(user_ids), commit=True)
+    points = [(row['id'], row['points']) for row in execute_query(
+        f"SELECT id, points FROM users WHERE id IN ({placeholders})", tuple(user_ids), fetchall=True) or []]
+    return [(user_id, quiz_id, score, created_at) for user_id, quiz_id, score, _, created_at in improved], points
+
+def store_attempts(rows):
+    """Grava tentativas e atualiza as classificações (uma transação para o lote)."""
+    with transaction():
+        execute_many(INSERT_ATTEMPT_SQL, rows)
+        scores, points = _update_best_scores(rows)
+    if scores:
+        leaderboards_changed(scores=scores, points=points)
+
+
+class AttemptRecorder:
+    def __init__(self, batch_size, flush_interval, queue_max):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_max = queue_max
+        self._buffer = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+        self.flushed = 0
+        self.batches = 0
+        self.errors = 0
+        self.dropped = 0
+
+    def _ensure_thread(self):
+        # a thread não sobrevive ao fork do gunicorn: arranca uma por processo
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._buffer = []
+            self._thread = threading.Thread(target=self._run, name='attempt-recorder', daemon=True)
+            self._thread.start()
+
+    def record(self, row):
+        with self._cond:
+            self._ensure_thread()
+            self._buffer.append(row)
+            pending = len(self._buffer)
+            if pending >= self.batch_size:
+                self._cond.notify()
+        if pending >= self.queue_max:
+            # a base de dados não está a acompanhar: quem submete ajuda a escoar
+            self.flush()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and len(self._buffer) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                # a thread não pode morrer: não volta a arrancar enquanto o pid for o mesmo
+                app.logger.exception('Erro no flush das tentativas')
+
+    def flush(self):
+        with self._flush_lock:
+            with self._cond:
+                batch, self._buffer = self._buffer, []
+            if not batch:
+                return 0
+            try:
+                store_attempts(batch)
+            except (sqlite3.IntegrityError, psycopg2.IntegrityError):
+                # p.ex. o quiz foi apagado antes do flush: grava as restantes uma a uma
+                return self._flush_one_by_one(batch)
+            except Exception:
+                self.errors += 1
+                app.logger.exception('Erro ao gravar %d tentativas (voltam para a fila)', len(batch))
+                with self._cond:
+                    # volta a pôr na fila (as mais antigas primeiro), sem crescer sem limite
+                    self._buffer = (batch + self._buffer)[-self.queue_max:]
+                return 0
+            self.flushed += len(batch)
+            self.batches += 1
+            return len(batch)
+
+    def _flush_one_by_one(self, batch):
+        written = 0
+        for i, row in enumerate(batch):
+            try:
+                store_attempts([row])
+                written += 1
+            except (sqlite3.IntegrityError, psycopg2.IntegrityError):
+                self.dropped += 1
+            except Exception:
+                # p.ex. base de dados bloqueada: as que faltam voltam para a fila
+                self.errors += 1
+                app.logger.exception('Erro ao gravar %d tentativas (voltam para a fila)', len(batch) - i)
+                with self._cond:
+                    self._buffer = (batch[i:] + self._buffer)[-self.queue_max:]
+                break
+        self.flushed += written
+        self.batches += 1
+        return written
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self.flush()
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._buffer)
+        return {'pending': pending, 'flushed': self.flushed, 'batches': self.batches,
+                'errors': self.errors, 'dropped': self.dropped}
+
+
+attempt_recorder = AttemptRecorder(ATTEMPT_BATCH_SIZE, ATTEMPT_FLUSH_INTERVAL, ATTEMPT_QUEUE_MAX)
+atexit.register(attempt_recorder.close)
+
+def record_attempt(user_id, quiz_id, score, total, answers):
+    row = (
+        user_id, quiz_id, score, total, json.dumps(answers),
+        datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+    )
+    if ATTEMPT_WRITE_BEHIND:
+        attempt_recorder.record(row)
+    else:
+        store_attempts([row])
+
+
+# -----------------------------------------------------------------------------
+# Importação de perguntas em massa (CSV / JSON)
+# -----------------------------------------------------------------------------
+QUESTION_FIELDS = ('question_text', 'option_a', 'option_b', 'option_c', 'option_d', 'correct_option')
+IMPORT_BATCH_SIZE = 1000
+IMPORT_MAX_ERRORS = 100
+
+def parse_question_rows(stream, fmt):
+    """Gera (nº da linha, dict) a partir de um ficheiro binário, sem o ler todo.
+
+    fmt: 'csv' (com cabeçalho), 'jsonl' (um objeto por linha) ou 'json'
+    (uma lista; esta é carregada inteira, por isso convém jsonl para ficheiros grandes).
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'jsonl':
+        for line_no, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_no, json.loads(line)
+            except ValueError as e:
+                yield line_no, ValueError(f'JSON inválido: {e}')
+    elif fmt == 'json':
+        try:
+            data = json.load(text)
+        except ValueError as e:
+            yield 1, ValueError(f'JSON inválido: {e}')
+            return
+        if not isinstance(data, list):
+            data = data.get('questions') if isinstance(data, dict) else None
+        if not isinstance(data, list):
+            yield 1, ValueError('Esperava uma lista de perguntas.')
+            return
+        for i, row in enumerate(data, start=1):
+            yield i, row
+    else:
+        raise ValueError(f'Formato desconhecido: {fmt}')
+
+def import_format_for(filename):
+    ext = (filename or '').rsplit('.', 1)[-1].lower()
+    return {'csv': 'csv', 'json': 'json', 'jsonl': 'jsonl', 'ndjson': 'jsonl'}.get(ext)
+
+def validate_question_row(row):
+    """Devolve (tuplo pronto a inserir sem o quiz_id, None) ou (None, erro)."""
+    if isinstance(row, Exception):
+        return None, str(row)
+    if not isinstance(row, dict):
+        return None, 'Linha não é um objeto.'
+    values = {f: (str(row.get(f) or '')).strip() for f in QUESTION_FIELDS}
+    values['correct_option'] = values['correct_option'].upper()
+    if not values['question_text']:
+        return None, 'Falta question_text.'
+    if not values['option_a'] or not values['option_b']:
+        return None, 'São precisas pelo menos as opções A e B.'
+    if values['correct_option'] not in ('A', 'B', 'C', 'D'):
+        return None, 'correct_option tem de ser A, B, C ou D.'
+    if not values[f"option_{values['correct_option'].lower()}"]:
+        return None, 'A opção correta está vazia.'
+    return tuple(values[f] or None for f in QUESTION_FIELDS), None
+
+def _insert_question_batch(cur, quiz_id, batch):
+    if USE_POSTGRES:
+        # COPY: uma ida ao servidor por lote
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for values in batch:
+            writer.writerow((quiz_id,) + tuple('' if v is None else v for v in values))
+        buf.seek(0)
+        cur.copy_expert(
+            "COPY questions (quiz_id, question_text, option_a, option_b, option_c, option_d, correct_option) "
+            "FROM STDIN WITH (FORMAT csv)", buf
+        )
+    else:
+        cur.executemany(
+            "INSERT INTO questions (quiz_id, question_text, option_a, option_b, option_c, option_d, correct_option) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(quiz_id,) + values for values in batch]
+        )
+
+class _ImportAborted(Exception):
+    pass
+
+def import_questions(quiz_id, rows, strict=False):
+    """Valida e insere as perguntas numa única transação, em lotes.
+
+    Linhas inválidas são reportadas e ignoradas; com strict=True basta uma
+    para cancelar a importação inteira.
+    """
+    imported = 0
+    error_count = 0
+    errors = []
+    try:
+        with transaction() as conn:
+            cur = conn.cursor()
+            batch = []
+            for line_no, row in rows:
+                values, error = validate_question_row(row)
+                if error:
+                    error_count += 1
+                    if len(errors) < IMPORT_MAX_ERRORS:
+                        errors.append({'row': line_no, 'error': error})
+                    continue
+                batch.append(values)
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    _insert_question_batch(cur, quiz_id, batch)
+                    imported += len(batch)
+                    batch = []
+            if batch:
+                _insert_question_batch(cur, quiz_id, batch)
+                imported += len(batch)
+            cur.close()
+
+            if strict and error_count:
+                raise _ImportAborted()
+            if imported:
+                execute_query(
+                    "UPDATE quizzes SET version = version + 1, question_count = question_count + ? WHERE id = ?",
+                    (imported, quiz_id), commit=True
+                )
+                index_quiz(quiz_id)
+    except _ImportAborted:
+        imported = 0
+    if imported:
+        quiz_changed(quiz_id)
+
+    return {'imported': imported, 'error_count': error_count, 'errors': errors}
+
+
+# -----------------------------------------------------------------------------
+# Exportação / restauro completo (NDJSON)
+# -----------------------------------------------------------------------------
+# Um objeto JSON por linha: um cabeçalho e depois users, avatars, quizzes,
+# questions e favorites, por esta ordem (as chaves estrangeiras vêm sempre
+# antes de quem as usa) e com os ids originais. Serve de backup e para passar
+# de SQLite para Postgres (ou o contrário). A leitura é feita numa ligação
+# própria, numa só transação (o mesmo snapshot para todas as tabelas), com um
+# cursor com nome no servidor em Postgres e fetchmany em SQLite: a memória não
+# cresce com o tamanho da base. O restauro insere por lotes (COPY em
+# Postgres, executemany em SQLite) numa única transação e só aceita uma base
+# vazia. Contadores, índice de pesquisa e classificações são derivados e são
+# recalculados no fim; tentativas, e-mails e sessões não são exportados.
+EXPORT_FORMAT = 'sabio-export'
+EXPORT_VERSION = 1
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '1000'))
+EXPORT_TOKEN = os.environ.get('EXPORT_TOKEN')   # sem token, /admin/export não existe
+EXPORT_TABLES = (
+    ('user', 'users', ('id', 'username', 'email', 'password_hash')),
+    ('avatar', 'avatars', ('id', 'user_id', 'outfit', 'accessory')),
+    ('quiz', 'quizzes', ('id', 'title', 'description', 'is_public', 'created_by', 'cover_image_url',
+                         'cover_bytes', 'version')),
+    ('question', 'questions', ('id', 'quiz_id', 'question_text', 'option_a', 'option_b', 'option_c',
+                               'option_d', 'correct_option')),
+    ('favorite', 'favorites', ('id', 'user_id', 'quiz_id')),
+)
+
+
+class RestoreError(Exception):
+    pass
+
+
+@contextmanager
+def _export_connection():
+    # não é a ligação do request: o stream continua depois de a view retornar (e pode demorar minutos)
+    if USE_POSTGRES:
+        conn = _checkout()
+        try:
+            conn.autocommit = False
+            # cursores com nome só existem dentro de uma transação
+            conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+            yield conn
+        finally:
+            conn.rollback()
+            conn.set_session(isolation_level='DEFAULT', readonly='DEFAULT')
+            conn.autocommit = True
+            get_pool().putconn(conn)
+    else:
+        conn = _sqlite_connect(readonly=True)
+        try:
+            conn.execute("BEGIN")
+            yield conn
+        finally:
+            conn.rollback()
+            conn.close()
+
+def export_records(counts=None, batch_size=EXPORT_BATCH_SIZE):
+    """Gera os registos (dicts) da exportação, tabela a tabela; conta-os por tipo em `counts`."""
+    yield {'type': EXPORT_FORMAT, 'version': EXPORT_VERSION,
+           'exported_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+           'backend': 'postgres' if USE_POSTGRES else 'sqlite'}
+    with _export_connection() as conn:
+        for kind, table, columns in EXPORT_TABLES:
+            query = f"SELECT {', '.join(columns)} FROM {table} ORDER BY id"
+            if USE_POSTGRES:
+                cur = conn.cursor(name=f'export_{table}')
+                cur.itersize = batch_size
+            else:
+                cur = conn.cursor()
+            try:
+                cur.execute(query)
+                while True:
+                    rows = cur.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        record = dict(zip(columns, row))
+                        if 'is_public' in record:
+                            record['is_public'] = bool(record['is_public'])
+                        record['type'] = kind
+                        yield record
+                    if counts is not None:
+                        counts[kind] = counts.get(kind, 0) + len(rows)
+            finally:
+                cur.close()
+
+_export_encoder = json.JSONEncoder(ensure_ascii=False, default=str)
+
+def export_ndjson(counts=None, chunk_size=64 * 1024):
+    """Linhas NDJSON juntas em blocos de ~chunk_size (menos escritas no socket/ficheiro)."""
+    chunk, size = [], 0
+    for record in export_records(counts):
+        line = _export_encoder.encode(record) + '\n'
+        chunk.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield ''.join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield ''.join(chunk)
+
+def _copy_text(value):
+    # formato text do COPY: \N é NULL; barra, tab e mudanças de linha escapados
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+def _restore_batch(cur, table, columns, batch):
+    if USE_POSTGRES:
+        buf = io.StringIO()
+        for values in batch:
+            buf.write('\t'.join(_copy_text(v) for v in values) + '\n')
+        buf.seek(0)
+        cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buf)
+    else:
+        placeholders = ', '.join('?' for _ in columns)
+        cur.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", batch)
+
+def restore_ndjson(lines, batch_size=EXPORT_BATCH_SIZE):
+    """Restaura uma exportação (iterável de linhas) numa base vazia; devolve {tipo: linhas}.
+
+    Tudo ou nada: qualquer linha inválida cancela o restauro (RestoreError).
+    """
+    tables = {kind: (table, columns) for kind, table, columns in EXPORT_TABLES}
+    order = [kind for kind, _, _ in EXPORT_TABLES]
+    counts = {}
+    lines = iter(lines)
+    try:
+        header = json.loads(next(lines))
+    except (StopIteration, ValueError):
+        raise RestoreError('Ficheiro vazio ou sem cabeçalho.')
+    if not isinstance(header, dict) or header.get('type') != EXPORT_FORMAT:
+        raise RestoreError('Não é uma exportação do Sábio.')
+    if header.get('version') != EXPORT_VERSION:
+        raise RestoreError(f"Versão {header.get('version')} não suportada.")
+
+    with transaction() as conn:
+        if execute_query("SELECT 1 AS found FROM users LIMIT 1", fetchone=True):
+            raise RestoreError('A base de destino não está vazia.')
+        cur = conn.cursor()
+        current, batch = None, []
+        for line_no, line in enumerate(lines, 2):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                kind = record.pop('type')
+                table, columns = tables[kind]
+                values = tuple(record[column] for column in columns)
+            except (ValueError, KeyError, TypeError, AttributeError):
+                raise RestoreError(f'Linha {line_no}: registo inválido.')
+            if kind != current:
+                # as tabelas chegam por ordem; voltar atrás partiria as chaves estrangeiras
+                if current is not None and order.index(kind) < order.index(current):
+                    raise RestoreError(f'Linha {line_no}: {kind} depois de {current}.')
+                if batch:
+                    _restore_batch(cur, tables[current][0], tables[current][1], batch)
+                current, batch = kind, []
+            batch.append(values)
+            counts[kind] = counts.get(kind, 0) + 1
+            if len(batch) >= batch_size:
+                _restore_batch(cur, table, columns, batch)
+                batch = []
+        if batch:
+            _restore_batch(cur, tables[current][0], tables[current][1], batch)
+        cur.close()
+
+        if USE_POSTGRES:
+            # ids explícitos não avançam as sequências SERIAL
+            for _, table, _ in EXPORT_TABLES:
+                execute_query(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                              f"COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)")
+
+    # derivados: recalculados a partir do que foi restaurado
+    reconcile_quiz_counters()
+    reindex_all_quizzes()
+    rebuild_leaderboards()
+    fragment_cache.bump('quizzes', 'popular')
+    return counts
+
+
+# -----------------------------------------------------------------------------
+# E-mail: caixa de saída persistente + envio em background
+# -----------------------------------------------------------------------------
+# Os pedidos só inserem na tabela outbox; o MailSender (uma thread por
+# processo) reclama lotes, envia-os numa única ligação SMTP e volta a tentar
+# com backoff exponencial. Reclamar uma linha é adiar o next_attempt_at por
+# MAIL_LEASE segundos: se o processo morrer a meio, outro worker apanha-a
+# quando o prazo expirar. A thread arranca no primeiro pedido de cada worker,
+# por isso o que ficou na outbox sai depois de um restart (ver
+# bench/mail_restart_check.py). Para testar localmente basta apontar
+# MAIL_SERVER / MAIL_PORT para um servidor SMTP de teste (com MAIL_USE_TLS=0).
+MAIL_BATCH_SIZE = int(os.environ.get('MAIL_BATCH_SIZE', '20'))
+MAIL_POLL_INTERVAL = float(os.environ.get('MAIL_POLL_INTERVAL', '5'))
+MAIL_LEASE = float(os.environ.get('MAIL_LEASE', '120'))
+MAIL_RETRY_BASE = float(os.environ.get('MAIL_RETRY_BASE', '30'))
+MAIL_RETRY_MAX = float(os.environ.get('MAIL_RETRY_MAX', '3600'))
+MAIL_MAX_ATTEMPTS = int(os.environ.get('MAIL_MAX_ATTEMPTS', '6'))
+MAIL_DEDUPE_WINDOW = float(os.environ.get('MAIL_DEDUPE_WINDOW', '300'))
+
+
+def enqueue_mail(recipient, subject, body, dedupe_key=None):
+    """Guarda o e-mail para envio; devolve False se um igual (dedupe_key) já saiu há pouco."""
+    now = time.time()
+    if dedupe_key:
+        recent = execute_query(
+            "SELECT 1 FROM outbox WHERE dedupe_key = ? AND created_at > ? AND status != 'failed' LIMIT 1",
+            (dedupe_key, now - MAIL_DEDUPE_WINDOW), fetchone=True,
+        )
+        if recent:
+            mail_sender.deduped += 1
+            return False
+    execute_query(
+        "INSERT INTO outbox (recipient, subject, body, dedupe_key, created_at, next_attempt_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (recipient, subject, body, dedupe_key, now, now), commit=True,
+    )
+    mail_sender.wake()
+    return True
+
+def mail_retry_delay(attempts):
+    return min(MAIL_RETRY_MAX, MAIL_RETRY_BASE * 2 ** (attempts - 1))
+
+
+class MailSender:
+    def __init__(self, batch_size, poll_interval):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self._cond = threading.Condition()
+        self._pid = None
+        self._woken = False
+        self._closed = False
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.deduped = 0
+
+    def ensure_running(self):
+        # a thread não sobrevive ao fork do gunicorn: arranca uma por processo
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name='mail-sender', daemon=True).start()
+
+    def wake(self):
+        self.ensure_running()
+        with self._cond:
+            self._woken = True
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._woken and not self._closed:
+                    self._cond.wait(self.poll_interval)
+                self._woken = False
+                if self._closed:
+                    return
+            try:
+                while self.send_due():
+                    pass
+            except Exception:
+                app.logger.exception('Erro no envio de e-mails')
+
+    def close(self):
+        """Para a thread deste processo (o que está pendente fica na outbox)."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def _claim(self):
+        now = time.time()
+        claim = uuid.uuid4().hex
+        execute_query(
+            "UPDATE outbox SET claim = ?, next_attempt_at = ? "
+            "WHERE status = 'pending' AND next_attempt_at <= ? AND id IN ("
+            "  SELECT id FROM outbox WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY id LIMIT ?)",
+            (claim, now + MAIL_LEASE, now, now, self.batch_size), commit=True,
+        )
+        rows = execute_query("SELECT * FROM outbox WHERE claim = ? ORDER BY id", (claim,), fetchall=True) or []
+        return [DBObject(r) for r in rows]
+
+    def send_due(self):
+        """Envia um lote do que está em atraso; devolve quantas linhas tratou."""
+        items = self._claim()
+        if not items:
+            return 0
+        results = []   # (item, erro ou None)
+        with app.app_context():
+            try:
+                with mail.connect() as conn:
+                    for item in items:
+                        try:
+                            conn.send(Message(item.subject, recipients=[item.recipient], body=item.body))
+                            results.append((item, None))
+                        except Exception as e:
+                            results.append((item, e))
+            except Exception as e:
+                # falhou a ligação (ou caiu a meio): o que ficou por enviar volta a tentar
+                done = {item.id for item, _ in results}
+                results += [(item, e) for item in items if item.id not in done]
+        self._record(results)
+        return len(items)
+
+    def _record(self, results):
+        now = time.time()
+        with transaction():
+            for item, error in results:
+                if error is None:
+                    self.sent += 1
+                    execute_query("UPDATE outbox SET status = 'sent', sent_at = ?, attempts = attempts + 1, "
+                                  "claim = NULL WHERE id = ?", (now, item.id))
+                    continue
+                attempts = item.attempts + 1
+                if attempts >= MAIL_MAX_ATTEMPTS:
+                    self.failed += 1
+                    status, next_attempt = 'failed', now
+                else:
+                    self.retried += 1
+                    status, next_attempt = 'pending', now + mail_retry_delay(attempts)
+                execute_query(
+                    "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, "
+                    "claim = NULL WHERE id = ?",
+                    (status, attempts, next_attempt, str(error)[:500], item.id),
+                )
+
+    def stats(self):
+        return {'sent': self.sent, 'retried': self.retried, 'failed': self.failed, 'deduped': self.deduped}
+
+
+mail_sender = MailSender(MAIL_BATCH_SIZE, MAIL_POLL_INTERVAL)
+
+@app.before_request
+def start_mail_sender():
+    # no primeiro pedido de cada worker: o que ficou pendente (ou em backoff)
+    # antes de um deploy/restart sai sem esperar por um novo enqueue_mail
+    mail_sender.ensure_running()
+
+
+# -----------------------------------------------------------------------------
+# Backends de cache: memória do processo, servidor local ou Redis
+# -----------------------------------------------------------------------------
+# CACHE_BACKEND=memory (omissão) guarda tudo neste processo, como sempre.
+# Com vários workers, CACHE_BACKEND=local usa o servidor de `flask cache-server`
+# (um processo por máquina, num socket Unix) e CACHE_BACKEND=redis um Redis em
+# CACHE_URL. Os dois falam o mesmo protocolo (RESP), por isso o servidor local
+# também serve de substituto do Redis em desenvolvimento. Nos backends
+# partilhados as invalidações são publicadas em CACHE_CHANNEL e cada worker
+# aplica-as logo (ver CacheBus).
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+CACHE_SOCKET = os.environ.get('CACHE_SOCKET', os.path.join(INSTANCE_DIR, 'cache.sock'))
+CACHE_URL = os.environ.get('CACHE_URL', f'unix://{CACHE_SOCKET}' if CACHE_BACKEND == 'local'
+                           else 'redis://localhost:6379/0')
+CACHE_PREFIX = os.environ.get('CACHE_PREFIX', 'sabio:')
+CACHE_CHANNEL = CACHE_PREFIX + 'invalidate'
+CACHE_TIMEOUT = float(os.environ.get('CACHE_TIMEOUT', '0.5'))
+CACHE_RETRY_AFTER = float(os.environ.get('CACHE_RETRY_AFTER', '5'))
+CACHE_SERVER_MAX = int(os.environ.get('CACHE_SERVER_MAX', '20000'))
+
+
+class CacheError(Exception):
+    pass
+
+
+class MemoryCacheBackend:
+    """LRU com TTL só deste processo (guarda os objetos tal como são)."""
+
+    shared = False
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()   # key -> (expires_at ou None, value)
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _live(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] is not None and entry[0] <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(key, time.monotonic())
+            return entry[1] if entry else None
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl if ttl else None, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._entries.pop(key, None) is not None for key in keys)
+
+    def incr(self, key):
+        with self._lock:
+            entry = self._live(key, time.monotonic())
+            value = int(entry[1] if entry else 0) + 1
+            self._entries[key] = (entry[0] if entry else None, value)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _resp_encode(*args):
+    out = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        out.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+    return b''.join(out)
+
+def _resp_read(f):
+    """Lê uma resposta RESP de um ficheiro binário; erros do servidor -> CacheError."""
+    line = f.readline()
+    if not line.endswith(b'\r\n'):
+        raise ConnectionError('ligação à cache fechada')
+    kind, payload = line[:1], line[1:-2]
+    if kind == b'+':
+        return payload.decode()
+    if kind == b'-':
+        raise CacheError(payload.decode())
+    if kind == b':':
+        return int(payload)
+    if kind == b'$':
+        n = int(payload)
+        if n < 0:
+            return None
+        data = f.read(n + 2)
+        if len(data) != n + 2:
+            raise ConnectionError('ligação à cache fechada')
+        return data[:-2]
+    if kind == b'*':
+        n = int(payload)
+        return None if n < 0 else [_resp_read(f) for _ in range(n)]
+    raise CacheError(f'resposta RESP inválida: {line[:20]!r}')
+
+
+class RespCacheBackend:
+    """Cliente mínimo do protocolo do Redis (GET/SET/DEL/INCR/MGET/PUBLISH/SUBSCRIBE).
+
+    CACHE_URL: redis://[:password@]host:port/db ou unix:///caminho/do.sock.
+    Ligações reutilizadas por processo; uma ligação com erro é descartada.
+    """
+
+    shared = True
+
+    def __init__(self, url, timeout):
+        parsed = urlparse(url)
+        self.url = url
+        self.timeout = timeout
+        if parsed.scheme == 'unix':
+            self.address = (socket.AF_UNIX, parsed.path)
+        else:
+            self.address = (socket.AF_INET, (parsed.hostname or 'localhost', parsed.port or 6379))
+        self.password = parsed.password
+        self.db = int(parsed.path.strip('/') or 0) if parsed.scheme != 'unix' else 0
+        self.pid = os.getpid()
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _open(self, timeout):
+        family, address = self.address
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(address)
+            f = sock.makefile('rb')
+            setup = []
+            if self.password:
+                setup.append(('AUTH', self.password))
+            if self.db:
+                setup.append(('SELECT', self.db))
+            for command in setup:
+                sock.sendall(_resp_encode(*command))
+                _resp_read(f)
+        except Exception:
+            sock.close()
+            raise
+        return sock, f
+
+    def execute(self, *args):
+        with self._lock:
+            if self.pid != os.getpid():
+                # após fork as ligações herdadas pertencem ao processo pai
+                self.pid, self._idle = os.getpid(), []
+            conn = self._idle.pop() if self._idle else None
+        try:
+            if conn is None:
+                conn = self._open(self.timeout)
+            conn[0].sendall(_resp_encode(*args))
+            reply = _resp_read(conn[1])
+        except CacheError:
+            if conn is not None:
+                self._release(conn)
+            raise
+        except (OSError, ValueError) as e:
+            if conn is not None:
+                conn[0].close()
+            raise CacheError(f'cache indisponível ({self.url}): {e}') from e
+        self._release(conn)
+        return reply
+
+    def _release(self, conn):
+        with self._lock:
+            if self.pid == os.getpid():
+                self._idle.append(conn)
+
+    def get(self, key):
+        return self.execute('GET', key)
+
+    def get_many(self, keys):
+        return self.execute('MGET', *keys) if keys else []
+
+    def set(self, key, value, ttl=None):
+        if ttl:
+            self.execute('SET', key, value, 'PX', int(ttl * 1000))
+        else:
+            self.execute('SET', key, value)
+
+    def delete(self, *keys):
+        return self.execute('DEL', *keys) if keys else 0
+
+    def incr(self, key):
+        return self.execute('INCR', key)
+
+    def publish(self, channel, message):
+        return self.execute('PUBLISH', channel, message)
+
+    def listen(self, channel):
+        """Gera None assim que a subscrição está ativa e depois cada mensagem (bytes)."""
+        sock, f = self._open(self.timeout)
+        try:
+            sock.sendall(_resp_encode('SUBSCRIBE', channel))
+            _resp_read(f)
+            sock.settimeout(None)
+            yield None
+            while True:
+                reply = _resp_read(f)
+                if isinstance(reply, list) and reply and reply[0] == b'message':
+                    yield reply[2]
+        finally:
+            sock.close()
+
+
+def make_cache_backend(name=None):
+    name = name or CACHE_BACKEND
+    if name == 'memory':
+        return MemoryCacheBackend(FRAGMENT_CACHE_MAX)
+    if name in ('local', 'redis'):
+        return RespCacheBackend(CACHE_URL, CACHE_TIMEOUT)
+    raise ValueError(f'CACHE_BACKEND desconhecido: {name}')
+
+
+class CacheBus:
+    """Invalidações difundidas a todos os workers via pub/sub do backend partilhado.
+
+    Cada processo tem uma thread subscrita em CACHE_CHANNEL. Os handlers
+    recebem o dict publicado ou None quando a subscrição (re)começa, sinal de
+    que podem ter perdido mensagens e devem descartar o que têm em memória.
+    """
+
+    def __init__(self, backend, channel):
+        self.backend = backend
+        self.channel = channel
+        self._handlers = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self.published = 0
+        self.received = 0
+        self.reconnects = 0
+
+    def on_message(self, handler):
+        self._handlers.append(handler)
+        return handler
+
+    def publish(self, message):
+        if not self.backend.shared:
+            return
+        self.ensure_listening()
+        self.backend.publish(self.channel, json.dumps(message))
+        self.published += 1
+
+    def ensure_listening(self):
+        if not self.backend.shared or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name='cache-bus', daemon=True).start()
+
+    def _dispatch(self, message):
+        for handler in self._handlers:
+            try:
+                handler(message)
+            except Exception:
+                app.logger.exception('Erro a aplicar invalidação da cache')
+
+    def _run(self):
+        delay = 0.1
+        while True:
+            try:
+                for raw in self.backend.listen(self.channel):
+                    if raw is None:
+                        self.reconnects += 1
+                        delay = 0.1
+                        self._dispatch(None)
+                        continue
+                    self.received += 1
+                    self._dispatch(json.loads(raw))
+            except Exception as e:
+                app.logger.warning('Subscrição da cache perdida (%s); a tentar de novo', e)
+            # enquanto não há subscrição, descartamos também o que possa estar desatualizado
+            self._dispatch(None)
+            time.sleep(delay)
+            delay = min(delay * 2, 5.0)
+
+    def stats(self):
+        return {'published': self.published, 'received': self.received, 'reconnects': self.reconnects}
+
+
+class _CacheServerHandler(socketserver.StreamRequestHandler):
+    """Subconjunto do Redis servido por `flask cache-server`."""
+
+    def handle(self):
+        server = self.server
+        self.write_lock = threading.Lock()
+        try:
+            while True:
+                try:
+                    command = _resp_read(self.rfile)
+                except (ConnectionError, OSError):
+                    return
+                if not isinstance(command, list) or not command:
+                    self._reply(CacheError('comando inválido'))
+                    continue
+                self._reply(server.run(self, [command[0].decode().upper()] + command[1:]))
+        finally:
+            server.unsubscribe(self)
+
+    def _reply(self, value):
+        with self.write_lock:
+            self.wfile.write(_resp_reply(value))
+            self.wfile.flush()
+
+def _resp_reply(value):
+    if isinstance(value, CacheError):
+        return b'-ERR %s\r\n' % str(value).encode()
+    if value is True:
+        return b'+OK\r\n'
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, list):
+        return b'*%d\r\n' % len(value) + b''.join(_resp_reply(v) for v in value)
+    if not isinstance(value, bytes):
+        value = str(value).encode()
+    return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+def _as_bulk(value):
+    # como no Redis, um contador (INCR) lê-se como string
+    return str(value).encode() if isinstance(value, int) else value
+
+
+class LocalCacheServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, maxsize):
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(path, _CacheServerHandler)
+        self.store = MemoryCacheBackend(maxsize)
+        self.subscribers = {}   # canal -> {handler}
+        self._sub_lock = threading.Lock()
+
+    def unsubscribe(self, handler):
+        with self._sub_lock:
+            for handlers in self.subscribers.values():
+                handlers.discard(handler)
+
+    def run(self, handler, command):
+        name, args = command[0], command[1:]
+        try:
+            if name == 'GET':
+                return _as_bulk(self.store.get(args[0]))
+            if name == 'MGET':
+                return [_as_bulk(value) for value in self.store.get_many(args)]
+            if name == 'SET':
+                ttl = None
+                if len(args) >= 4 and args[2].upper() == b'PX':
+                    ttl = int(args[3]) / 1000
+                self.store.set(args[0], args[1], ttl)
+                return True
+            if name == 'DEL':
+                return self.store.delete(*args)
+            if name == 'INCR':
+                return self.store.incr(args[0])
+            if name == 'PUBLISH':
+                with self._sub_lock:
+                    targets = list(self.subscribers.get(args[0], ()))
+                for target in targets:
+                    try:
+                        target._reply([b'message', args[0], args[1]])
+                    except OSError:
+                        self.unsubscribe(target)
+                return len(targets)
+            if name == 'SUBSCRIBE':
+                with self._sub_lock:
+                    self.subscribers.setdefault(args[0], set()).add(handler)
+                return [b'subscribe', args[0], 1]
+            if name == 'PING':
+                return b'PONG'
+            if name in ('SELECT', 'AUTH'):
+                return True
+            if name == 'FLUSHDB':
+                self.store.clear()
+                return True
+            if name == 'DBSIZE':
+                return len(self.store)
+        except (IndexError, ValueError):
+            return CacheError(f"argumentos inválidos para '{name}'")
+        return CacheError(f"comando não suportado '{name}'")
+
+
+# -----------------------------------------------------------------------------
+# Cache de páginas renderizadas (Descobrir, Favoritos, detalhe do quiz)
+# -----------------------------------------------------------------------------
+# As chaves incluem números de versão que as mutações incrementam
+# ('quizzes' para listas, 'quiz:<id>' para um quiz, 'favorites:<uid>'), por
+# isso uma escrita invalida logo as entradas afetadas. Com um backend
+# partilhado as versões vivem lá (INCR) e cada incremento é publicado no
+# CacheBus, pelo que os outros workers deixam de usar a versão antiga no mesmo
+# instante; as páginas ficam no backend (JSON) com uma pequena cache local à
+# frente (FRAGMENT_CACHE_NEAR_MAX). Se o backend falhar, cada worker volta a
+# ter só a cache local e o TTL limita quanto tempo serve uma versão antiga.
+FRAGMENT_CACHE_MAX = int(os.environ.get('FRAGMENT_CACHE_MAX', '500'))
+FRAGMENT_CACHE_NEAR_MAX = int(os.environ.get('FRAGMENT_CACHE_NEAR_MAX', '50'))
+FRAGMENT_CACHE_TTL = float(os.environ.get('FRAGMENT_CACHE_TTL', '30'))
+
+
+class FragmentCache:
+    def __init__(self, backend, bus, maxsize, ttl):
+        self.remote = backend if backend.shared else None
+        self.bus = bus
+        self.ttl = ttl
+        self._local = backend if self.remote is None else MemoryCacheBackend(maxsize)
+        self._lock = threading.Lock()
+        self._building = {}             # key -> Lock de quem está a reconstruir
+        self._versions = {}
+        self.hits = 0
+        self.remote_hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.errors = 0
+        self._down_until = 0.0
+        bus.on_message(self._on_invalidate)
+
+    def _on_invalidate(self, message):
+        with self._lock:
+            if message is None:
+                # versões voltam a ser lidas do backend; as entradas locais
+                # com versões antigas deixam de ser alcançáveis
+                self._versions.clear()
+                self._local.clear()
+                return
+            for name, value in message.get('versions', {}).items():
+                self._versions[name] = max(self._versions.get(name, 0), value)
+
+    def _remote_ok(self):
+        # depois de um erro não voltamos a tentar durante CACHE_RETRY_AFTER segundos
+        return self.remote is not None and time.monotonic() >= self._down_until
+
+    def _remote_error(self, e):
+        self.errors += 1
+        if time.monotonic() >= self._down_until:
+            app.logger.warning('Cache partilhada indisponível: %s', e)
+        self._down_until = time.monotonic() + CACHE_RETRY_AFTER
+
+    def version(self, name):
+        version = self._versions.get(name)
+        if version is not None or not self._remote_ok():
+            return version or 0
+        self.bus.ensure_listening()
+        try:
+            version = int(self.remote.get(CACHE_PREFIX + 'v:' + name) or 0)
+        except CacheError as e:
+            self._remote_error(e)
+            return 0
+        with self._lock:
+            version = self._versions[name] = max(self._versions.get(name, 0), version)
+        return version
+
+    def bump(self, *names):
+        bumped = {}
+        if self._remote_ok():
+            try:
+                for name in names:
+                    bumped[name] = self.remote.incr(CACHE_PREFIX + 'v:' + name)
+                self.bus.publish({'versions': bumped})
+            except CacheError as e:
+                self._remote_error(e)
+        with self._lock:
+            for name in names:
+                current = self._versions.get(name, 0)
+                # sem backend (ou se falhou) a versão só avança neste processo
+                self._versions[name] = max(current, bumped[name]) if name in bumped else current + 1
+
+    def _remote_key(self, key):
+        return CACHE_PREFIX + 'f:' + hashlib.sha1(repr(key).encode()).hexdigest()
+
+    def _lookup(self, key):
+        value = self._local.get(key)
+        if value is not None:
+            return value
+        if not self._remote_ok():
+            return None
+        try:
+            raw = self.remote.get(self._remote_key(key))
+        except CacheError as e:
+            self._remote_error(e)
+            return None
+        if raw is None:
+            return None
+        # o valor vem embrulhado numa lista para distinguir "não há" de None
+        value = json.loads(raw)
+        self._local.set(key, value, self.ttl)
+        with self._lock:
+            self.remote_hits += 1
+        return value
+
+    def get_or_build(self, key, build, ttl=None):
+        """Valor em cache ou build(); só um pedido por processo reconstrói cada chave."""
+        cached = self._lookup(key)
+        if cached is not None:
+            with self._lock:
+                self.hits += 1
+            return cached[0]
+        with self._lock:
+            self.misses += 1
+            build_lock = self._building.get(key)
+            if build_lock is None:
+                build_lock = self._building[key] = threading.Lock()
+
+        with build_lock:
+            cached = self._local.get(key)
+            if cached is not None:
+                # outro pedido reconstruiu enquanto esperávamos
+                with self._lock:
+                    self.waits += 1
+                return cached[0]
+            try:
+                wrapped = [build()]
+                self._local.set(key, wrapped, ttl or self.ttl)
+                if self._remote_ok():
+                    try:
+                        self.remote.set(self._remote_key(key), json.dumps(wrapped), ttl or self.ttl)
+                    except CacheError as e:
+                        self._remote_error(e)
+            finally:
+                with self._lock:
+                    self._building.pop(key, None)
+        return wrapped[0]
+
+    def clear(self):
+        self._local.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': CACHE_BACKEND,
+                'entries': len(self._local),
+                'hits': self.hits,
+                'remote_hits': self.remote_hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self._local.evictions,
+                'stampede_waits': self.waits,
+                'errors': self.errors,
+                'bus': self.bus.stats(),
+            }
+
+
+cache_backend = make_cache_backend()
+cache_bus = CacheBus(cache_backend, CACHE_CHANNEL)
+fragment_cache = FragmentCache(cache_backend, cache_bus, FRAGMENT_CACHE_NEAR_MAX, FRAGMENT_CACHE_TTL)
+
+def quiz_changed(quiz_id):
+    fragment_cache.bump('quizzes', f'quiz:{quiz_id}')
+
+
+# -----------------------------------------------------------------------------
+# Authentication helpers (session & current_user)
+# -----------------------------------------------------------------------------
+# Cache de identidade (user + avatar) por user id, com TTL; invalidada
+# explicitamente quando a password ou o avatar mudam (em todos os workers,
+# através do CacheBus, quando o backend é partilhado).
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '60'))
+USER_CACHE_MAX = int(os.environ.get('USER_CACHE_MAX', '10000'))
+_user_cache = {}    # user_id -> (expires_at, user)
+_user_cache_lock = threading.Lock()
+_user_cache_hits = 0
+_user_cache_misses = 0
+
+def invalidate_user_cache(user_id):
+    with _user_cache_lock:
+        _user_cache.pop(user_id, None)
+    try:
+        cache_bus.publish({'users': [user_id]})
+    except CacheError as e:
+        app.logger.warning('Invalidação do utilizador %s não difundida: %s', user_id, e)
+
+@cache_bus.on_message
+def _drop_invalidated_users(message):
+    with _user_cache_lock:
+        if message is None:
+            _user_cache.clear()
+            return
+        for user_id in message.get('users', ()):
+            _user_cache.pop(user_id, None)
+
+def current_user():
+    global _user_cache_hits, _user_cache_misses
+    uid = session.get('user_id')
+    if uid is None:
+        return None
+
+    cache_bus.ensure_listening()
+    now = time.monotonic()
+    with _user_cache_lock:
+        entry = _user_cache.get(uid)
+        if entry and entry[0] > now:
+            _user_cache_hits += 1
+            return entry[1]
+        _user_cache_misses += 1
+
+    user = get_user_by_id(uid)
+    if not user:
+        invalidate_user_cache(uid)
+        return None
+    # Attach avatar object for compatibility with previous code expectations
+    avatar = get_avatar_by_user_id(user.id)
+    user.avatar = avatar
+
+    with _user_cache_lock:
+        if len(_user_cache) >= USER_CACHE_MAX:
+            # descarta a entrada mais antiga (ordem de inserção)
+            _user_cache.pop(next(iter(_user_cache)))
+        _user_cache[uid] = (now + USER_CACHE_TTL, user)
+    return user
+
+# Endpoints que nunca precisam do utilizador (inclui as imagens do avatar, em /static)
+SKIP_USER_ENDPOINTS = {'static', 'favicon', 'health', 'metrics', 'export_data'}
+
+@app.before_request
+def load_user_into_global():
+    if request.endpoint in SKIP_USER_ENDPOINTS:
+        g.user = None
+        return
+    g.user = current_user()
+
+# -----------------------------------------------------------------------------
+# Conditional GET (ETag)
+# -----------------------------------------------------------------------------
+def _templates_digest():
+    # Igual em todos os workers; muda quando um template muda (deploy)
+    h = hashlib.sha1()
+    folder = os.path.join(app.root_path, app.template_folder)
+    for name in sorted(os.listdir(folder)):
+        with open(os.path.join(folder, name), 'rb') as f:
+            h.update(name.encode())
+            h.update(f.read())
+    return h.hexdigest()[:10]
+
+TEMPLATES_DIGEST = _templates_digest()
+
+def conditional_response(body, etag, mimetype='text/html'):
+    """Resposta com ETag forte; 304 sem corpo se o cliente já tiver esta versão."""
+    resp = make_response(body)
+    resp.mimetype = mimetype
+    resp.set_etag(etag)
+    # private: depende do utilizador autenticado; no-cache: revalida sempre (barato)
+    resp.cache_control.private = True
+    resp.cache_control.no_cache = True
+    return resp.make_conditional(request)
+
+
+# -----------------------------------------------------------------------------
+# Capas dos quizzes: ficheiros pelo hash do conteúdo + variantes WebP
+# -----------------------------------------------------------------------------
+# O upload é lido aos bocados e guardado como uploads/covers/<sha256>.<ext>, por
+# isso uploads iguais partilham o mesmo ficheiro. As variantes redimensionadas
+# (<hash>_card.webp para as grelhas, <hash>_large.webp para o detalhe) são
+# geradas numa thread à parte; até estarem prontas os templates usam o original.
+COVERS_FOLDER = os.path.join(UPLOAD_FOLDER, 'covers')
+os.makedirs(COVERS_FOLDER, exist_ok=True)
+COVER_VARIANTS = {'large': (1200, 900), 'card': (480, 360)}
+COVER_WEBP_QUALITY = int(os.environ.get('COVER_WEBP_QUALITY', '80'))
+COVER_PROCESSED_EXTENSIONS = {'png', 'jpg', 'jpeg'}   # GIFs ficam como estão (animação)
+Image.MAX_IMAGE_PIXELS = 40_000_000   # proteção contra "decompression bombs"
+
+
+class UploadQuotaExceeded(Exception):
+    pass
+
+
+def save_cover_upload(file_storage, max_bytes=None):
+    """Guarda o ficheiro pelo hash do conteúdo e agenda as variantes; devolve (URL público, bytes).
+
+    Com max_bytes, desiste (UploadQuotaExceeded) assim que o ficheiro passar do limite.
+    """
+    ext = file_storage.filename.rsplit('.', 1)[1].lower()
+    ext = 'jpg' if ext == 'jpeg' else ext
+    digest = hashlib.sha256()
+    size = 0
+    tmp_path = os.path.join(COVERS_FOLDER, f'.upload-{uuid.uuid4().hex}')
+    try:
+        with open(tmp_path, 'wb') as f:
+            for chunk in iter(lambda: file_storage.stream.read(64 * 1024), b''):
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise UploadQuotaExceeded()
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    filename = f'{digest.hexdigest()[:32]}.{ext}'
+    path = os.path.join(COVERS_FOLDER, filename)
+    if os.path.exists(path):
+        # já temos esta imagem; o mtime novo protege-a de uma recolha de órfãos a decorrer
+        os.remove(tmp_path)
+        os.utime(path)
+    else:
+        os.replace(tmp_path, path)
+    cover_processor.submit(path)
+    return f'/static/uploads/covers/{filename}', size
+
+def cover_variant_path(path, variant):
+    return f'{os.path.splitext(path)[0]}_{variant}.webp'
+
+def make_cover_variants(path):
+    """Gera as variantes em falta; devolve quantas criou."""
+    if path.rsplit('.', 1)[-1].lower() not in COVER_PROCESSED_EXTENSIONS:
+        return 0
+    missing = {v: size for v, size in COVER_VARIANTS.items() if not os.path.exists(cover_variant_path(path, v))}
+    if not missing:
+        return 0
+    with Image.open(path) as im:
+        im.draft('RGB', max(missing.values()))   # JPEG: descodifica já reduzido
+        im = ImageOps.exif_transpose(im)
+        if im.mode not in ('RGB', 'RGBA'):
+            im = im.convert('RGBA' if im.mode in ('LA', 'P', 'PA') else 'RGB')
+        for variant, size in missing.items():
+            out = cover_variant_path(path, variant)
+            resized = im.copy()
+            resized.thumbnail(size, Image.LANCZOS)
+            resized.save(f'{out}.tmp', 'WEBP', quality=COVER_WEBP_QUALITY, method=4)
+            os.replace(f'{out}.tmp', out)
+    return len(missing)
+
+
+class CoverProcessor:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._queued = set()
+        self.processed = 0
+        self.errors = 0
+
+    def submit(self, path):
+        with self._lock:
+            # as threads do executor não sobrevivem ao fork do gunicorn
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queued = set()
+                self._executor = ThreadPoolExecutor(1, thread_name_prefix='cover-processor')
+            if path in self._queued:
+                return
+            self._queued.add(path)
+            self._executor.submit(self._process, path)
+
+    def _process(self, path):
+        try:
+            make_cover_variants(path)
+            self.processed += 1
+        except Exception:
+            self.errors += 1
+            app.logger.exception('Erro ao processar a capa %s', path)
+        finally:
+            with self._lock:
+                self._queued.discard(path)
+
+    def stats(self):
+        with self._lock:
+            return {'queued': len(self._queued), 'processed': self.processed, 'errors': self.errors}
+
+
+cover_processor = CoverProcessor()
+
+@app.template_global()
+def cover_url(url, variant='card'):
+    """Variante WebP da capa se já existir; senão o original (ou o placeholder)."""
+    if not url:
+        return url_for('static', filename='img/placeholder.png')
+    if url.startswith('/static/uploads/'):
+        variant_url = cover_variant_path(url, variant)
+        if os.path.exists(os.path.join(app.static_folder, variant_url[len('/static/'):])):
+            return variant_url
+    return url
+
+
+# -----------------------------------------------------------------------------
+# Avatares: imagem final por (roupa, acessório) + sprite sheet do editor
+# -----------------------------------------------------------------------------
+# O perfil mostra uma só imagem já composta (static/img/avatars/<roupa>-<acessório>.webp,
+# gerada na primeira vez que é pedida ou com `flask build-avatars`) e o editor
+# recorta todas as opções de um único sprite sheet descrito por sprite.json.
+# Tudo passa por url_for('static'), por isso leva ?v=<hash> e fica em cache.
+AVATAR_PARTS_FOLDER = os.path.join(app.static_folder, 'img', 'avatareditor')
+AVATAR_BASE_IMAGE = os.path.join(app.static_folder, 'img', 'avatar.png')
+AVATAR_FOLDER = os.path.join(app.static_folder, 'img', 'avatars')
+AVATAR_SIZE = (360, 540)        # 2x o tamanho mostrado (180 px de largura)
+AVATAR_SPRITE_COLUMNS = 6
+DEFAULT_AVATAR_OPTION = '001'
+_avatar_lock = threading.Lock()
+
+
+def avatar_options(kind):
+    """Opções disponíveis ('clothes' ou 'accessories'), pelos ficheiros em avatareditor/."""
+    folder = os.path.join(AVATAR_PARTS_FOLDER, kind)
+    return sorted(name[:-4] for name in os.listdir(folder) if name.endswith('.png'))
+
+def _avatar_layer(path):
+    return _avatar_layer_cached(path, os.path.getmtime(path))
+
+@functools.lru_cache(maxsize=32)
+def _avatar_layer_cached(path, mtime):
+    # cada peça (1024x1536) é descodificada e reduzida uma vez, não por combinação
+    with Image.open(path) as im:
+        return im.convert('RGBA').resize(AVATAR_SIZE, Image.LANCZOS)
+
+def _write_webp(image, path):
+    image.save(f'{path}.tmp', 'WEBP', quality=90, method=4)
+    os.replace(f'{path}.tmp', path)
+
+def _is_fresh(target, sources):
+    try:
+        built = os.path.getmtime(target)
+    except OSError:
+        return False
+    return all(os.path.getmtime(source) <= built for source in sources)
+
+def build_avatar(outfit, accessory):
+    """Gera (se faltar ou estiver desatualizada) a imagem composta; devolve o nome do ficheiro."""
+    filename = f'{outfit}-{accessory}.webp'
+    target = os.path.join(AVATAR_FOLDER, filename)
+    # mesma ordem de camadas do editor: corpo, acessório, roupa por cima
+    sources = [AVATAR_BASE_IMAGE,
+               os.path.join(AVATAR_PARTS_FOLDER, 'accessories', f'{accessory}.png'),
+               os.path.join(AVATAR_PARTS_FOLDER, 'clothes', f'{outfit}.png')]
+    if _is_fresh(target, sources):
+        return filename
+    with _avatar_lock:
+        if not _is_fresh(target, sources):
+            os.makedirs(AVATAR_FOLDER, exist_ok=True)
+            image = _avatar_layer(sources[0])
+            for source in sources[1:]:
+                image = Image.alpha_composite(image, _avatar_layer(source))
+            _write_webp(image, target)
+    return filename
+
+def build_avatar_sprite():
+    """Sprite sheet com o corpo e todas as roupas/acessórios + manifesto com as posições."""
+    sheet_path = os.path.join(AVATAR_FOLDER, 'sprite.webp')
+    manifest_path = os.path.join(AVATAR_FOLDER, 'sprite.json')
+    cells = [('base', None, AVATAR_BASE_IMAGE)]
+    for kind in ('accessories', 'clothes'):
+        cells += [(kind, option, os.path.join(AVATAR_PARTS_FOLDER, kind, f'{option}.png'))
+                  for option in avatar_options(kind)]
+    if _is_fresh(sheet_path, [path for _, _, path in cells]) and _is_fresh(manifest_path, [sheet_path]):
+        return manifest_path
+
+    width, height = AVATAR_SIZE
+    columns = min(AVATAR_SPRITE_COLUMNS, len(cells))
+    rows = -(-len(cells) // columns)
+    sheet = Image.new('RGBA', (columns * width, rows * height), (0, 0, 0, 0))
+    manifest = {'cell': [width, height], 'size': list(sheet.size), 'accessories': {}, 'clothes': {}}
+    for i, (kind, option, path) in enumerate(cells):
+        x, y = (i % columns) * width, (i // columns) * height
+        sheet.paste(_avatar_layer(path), (x, y))
+        if kind == 'base':
+            manifest['base'] = [x, y]
+        else:
+            manifest[kind][option] = [x, y]
+
+    with _avatar_lock:
+        os.makedirs(AVATAR_FOLDER, exist_ok=True)
+        _write_webp(sheet, sheet_path)
+        with open(f'{manifest_path}.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(f'{manifest_path}.tmp', manifest_path)
+    return manifest_path
+
+def avatar_sprite_manifest():
+    with open(build_avatar_sprite()) as f:
+        manifest = json.load(f)
+    manifest['sheet'] = url_for('static', filename='img/avatars/sprite.webp')
+    return manifest
+
+def valid_avatar_option(kind, option):
+    return bool(option) and re.fullmatch(r'\d{3}', option) is not None and \
+        os.path.exists(os.path.join(AVATAR_PARTS_FOLDER, kind, f'{option}.png'))
+
+@app.template_global()
+def avatar_url(outfit=None, accessory=None):
+    outfit = outfit if valid_avatar_option('clothes', outfit) else DEFAULT_AVATAR_OPTION
+    accessory = accessory if valid_avatar_option('accessories', accessory) else DEFAULT_AVATAR_OPTION
+    return url_for('static', filename=f'img/avatars/{build_avatar(outfit, accessory)}')
+
+
+# -----------------------------------------------------------------------------
+# Uploads: espaço por utilizador e recolha de ficheiros órfãos
+# -----------------------------------------------------------------------------
+# quizzes.cover_bytes guarda o tamanho da capa de cada quiz, por isso o espaço
+# de um utilizador é um SUM sobre os seus quizzes (índice created_by). A mesma
+# imagem em dois quizzes conta duas vezes.
+UPLOAD_QUOTA_BYTES = int(os.environ.get('UPLOAD_QUOTA_BYTES', str(50 * 1024 * 1024)))   # 0 = sem limite
+UPLOAD_GC_GRACE = int(os.environ.get('UPLOAD_GC_GRACE', '3600'))
+UPLOAD_GC_BATCH = int(os.environ.get('UPLOAD_GC_BATCH', '500'))
+
+
+def user_storage_bytes(user_id, exclude_quiz_id=None):
+    row = execute_query(
+        "SELECT COALESCE(SUM(cover_bytes), 0) AS total FROM quizzes WHERE created_by = ? AND id != ?",
+        (user_id, exclude_quiz_id or 0), fetchone=True,
+    )
+    return int(row['total'])
+
+def upload_allowance(user_id, exclude_quiz_id=None):
+    """Bytes que o utilizador ainda pode carregar (None se não houver quota)."""
+    if not UPLOAD_QUOTA_BYTES:
+        return None
+    return max(0, UPLOAD_QUOTA_BYTES - user_storage_bytes(user_id, exclude_quiz_id))
+
+def storage_usage_by_user(limit=20):
+    return execute_query(
+        "SELECT u.id, u.username, COUNT(q.id) AS covers, SUM(q.cover_bytes) AS bytes "
+        "FROM quizzes q JOIN users u ON u.id = q.created_by WHERE q.cover_image_url IS NOT NULL "
+        "GROUP BY u.id, u.username ORDER BY bytes DESC LIMIT ?",
+        (limit,), fetchall=True,
+    ) or []
+
+def _upload_path(url):
+    if url and url.startswith('/static/uploads/'):
+        return os.path.join(app.static_folder, url[len('/static/'):])
+    return None
+
+def _variant_base(path):
+    """Para <stem>_card.webp devolve <stem>; None se não for uma variante."""
+    stem, ext = os.path.splitext(path)
+    base, _, suffix = stem.rpartition('_')
+    return base if ext == '.webp' and suffix in COVER_VARIANTS else None
+
+def _mark_referenced_uploads(batch_size):
+    """Caminhos (sem extensão) das capas em uso; acerta cover_bytes em falta pelo caminho.
+
+    Lê os quizzes por cursor, em lotes curtos, para não prender a base de dados.
+    """
+    referenced = set()
+    refreshed = 0
+    after = 0
+    while True:
+        rows = execute_query(
+            "SELECT id, cover_image_url, cover_bytes FROM quizzes "
+            "WHERE id > ? AND cover_image_url IS NOT NULL ORDER BY id LIMIT ?",
+            (after, batch_size), fetchall=True,
+        ) or []
+        if not rows:
+            return referenced, refreshed
+        sizes = []
+        for row in rows:
+            path = _upload_path(row['cover_image_url'])
+            if path:
+                referenced.add(os.path.splitext(path)[0])
+                if not row['cover_bytes'] and os.path.exists(path):
+                    sizes.append((os.path.getsize(path), row['id']))
+        if sizes:
+            execute_many("UPDATE quizzes SET cover_bytes = ? WHERE id = ?", sizes)
+            refreshed += len(sizes)
+        after = rows[-1]['id']
+
+def collect_orphaned_uploads(grace=UPLOAD_GC_GRACE, batch_size=UPLOAD_GC_BATCH, dry_run=False):
+    """Mark-and-sweep de static/uploads contra quizzes.cover_image_url.
+
+    Ficheiros mais recentes do que `grace` segundos ficam (uploads a meio, antes
+    de o quiz existir). Cada lote de candidatos é confirmado outra vez na base
+    de dados antes de apagar; as variantes só saem depois do original.
+    """
+    started = time.time()
+    referenced, refreshed = _mark_referenced_uploads(batch_size)
+    stats = {'scanned': 0, 'recent': 0, 'orphans': 0, 'deleted': 0, 'bytes_freed': 0,
+             'cover_bytes_refreshed': refreshed}
+
+    candidates = []
+    for root, _, files in os.walk(UPLOAD_FOLDER):
+        for name in files:
+            path = os.path.join(root, name)
+            stats['scanned'] += 1
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if st.st_mtime > started - grace:
+                stats['recent'] += 1
+                continue
+            if (_variant_base(path) or os.path.splitext(path)[0]) not in referenced:
+                candidates.append(path)
+    # originais primeiro: uma variante só é órfã se o original já não existir
+    candidates.sort(key=lambda p: _variant_base(p) is not None)
+    stats['orphans'] = len(candidates)
+
+    for i in range(0, len(candidates), batch_size):
+        batch = candidates[i:i + batch_size]
+        urls = ['/static/' + os.path.relpath(p, app.static_folder).replace(os.sep, '/') for p in batch]
+        placeholders = ', '.join('?' for _ in urls)
+        still_used = {row['cover_image_url'] for row in execute_query(
+            f"SELECT cover_image_url FROM quizzes WHERE cover_image_url IN ({placeholders})",
+            tuple(urls), fetchall=True) or []}
+        for path, url in zip(batch, urls):
+            if url in still_used:
+                continue
+            base = _variant_base(path)
+            if base and any(os.path.exists(f'{base}.{ext}') for ext in ALLOWED_EXTENSIONS | {'jpg'}):
+                continue
+            try:
+                if os.stat(path).st_mtime > started - grace:
+                    continue   # reaproveitado entretanto (ver save_cover_upload)
+                size = os.path.getsize(path)
+                if not dry_run:
+                    os.remove(path)
+            except FileNotFoundError:
+                continue
+            stats['deleted'] += 1
+            stats['bytes_freed'] += size
+    return stats
+
+
+# -----------------------------------------------------------------------------
+# Classificações: melhor resultado por quiz + top-K em memória
+# -----------------------------------------------------------------------------
+# best_scores guarda o melhor resultado de cada utilizador em cada quiz e
+# users.points a soma desses resultados (classificação geral); ambos são
+# atualizados por store_attempts à medida que as tentativas chegam. Para não
+# ordenar a tabela a cada visita, cada processo mantém em memória a geral e a
+# dos LEADERBOARD_HOT_QUIZZES quizzes mais vistos (LRU): uma lista ordenada de
+# chaves (-pontos, desempate, user_id) com as primeiras LEADERBOARD_CAPACITY
+# entradas. "Top 10" é um slice e "a minha posição" um bisect; só quem fica
+# abaixo do que está em memória leva a um COUNT pelo índice. Os resultados só
+# melhoram, por isso cada melhoria é remover a chave antiga + insort.
+# Na primeira utilização em cada processo carregamos a geral e os
+# LEADERBOARD_WARM quizzes com mais jogadores a partir das tabelas; as
+# melhorias chegam aos outros workers pelo CacheBus (sem backend partilhado,
+# cada classificação é relida ao fim de LEADERBOARD_REFRESH segundos).
+LEADERBOARD_CAPACITY = int(os.environ.get('LEADERBOARD_CAPACITY', '5000'))
+LEADERBOARD_HOT_QUIZZES = int(os.environ.get('LEADERBOARD_HOT_QUIZZES', '256'))
+LEADERBOARD_WARM = int(os.environ.get('LEADERBOARD_WARM', '32'))
+LEADERBOARD_REFRESH = float(os.environ.get('LEADERBOARD_REFRESH', '60'))
+LEADERBOARD_TOP = 10
+
+def _leaderboard_ts(value):
+    # TIMESTAMP em Postgres, TEXT em SQLite: a mesma string para comparar em memória
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return str(value)
+
+
+class Leaderboard:
+    """Uma classificação: as primeiras `capacity` chaves (-pontos, desempate, user_id), ordenadas."""
+
+    def __init__(self, rows, capacity):
+        # rows: (user_id, pontos, desempate) pela ordem da classificação, até capacity + 1
+        self.capacity = capacity
+        self.keys = sorted((-score, tiebreak, user_id) for user_id, score, tiebreak in rows)[:capacity]
+        self.by_user = {key[2]: key for key in self.keys}
+        self.complete = len(rows) <= capacity
+        self.loaded_at = time.monotonic()
+
+    def update(self, user_id, score, tiebreak):
+        """Aplica um resultado; só conta se for melhor do que o que o utilizador já tem."""
+        key = (-score, tiebreak, user_id)
+        old = self.by_user.get(user_id)
+        if old is not None:
+            if key >= old:
+                return False
+            del self.keys[bisect.bisect_left(self.keys, old)]
+        elif not self.complete and self.keys and key > self.keys[-1]:
+            return False    # abaixo do que temos em memória: fica só na tabela
+        bisect.insort(self.keys, key)
+        self.by_user[user_id] = key
+        if len(self.keys) > self.capacity:
+            del self.by_user[self.keys.pop()[2]]
+            self.complete = False
+        return True
+
+    def top(self, n):
+        return [(key[2], -key[0]) for key in self.keys[:n]]
+
+    def rank(self, user_id):
+        key = self.by_user.get(user_id)
+        if key is None:
+            return None
+        return bisect.bisect_left(self.keys, key) + 1, -key[0]
+
+
+class LeaderboardRegistry:
+    """Classificações em memória deste processo; quiz_id=None é a geral."""
+
+    def __init__(self, capacity, hot_quizzes):
+        self.capacity = capacity
+        self.hot_quizzes = hot_quizzes
+        self._lock = threading.Lock()
+        self._boards = OrderedDict()   # quiz_id -> Leaderboard (LRU)
+        self._overall = None
+        self._pid = None
+        self.hits = 0
+        self.loads = 0
+        self.table_ranks = 0
+
+    def _fresh(self, board):
+        if board is None:
+            return False
+        return cache_backend.shared or time.monotonic() - board.loaded_at < LEADERBOARD_REFRESH
+
+    def _load(self, quiz_id):
+        if quiz_id is None:
+            rows = execute_query(
+                "SELECT id, points FROM users WHERE points > 0 ORDER BY points DESC, id LIMIT ?",
+                (self.capacity + 1,), fetchall=True) or []
+            return Leaderboard([(row['id'], row['points'], '') for row in rows], self.capacity)
+        rows = execute_query(
+            "SELECT user_id, score, achieved_at FROM best_scores WHERE quiz_id = ? "
+            "ORDER BY score DESC, achieved_at, user_id LIMIT ?",
+            (quiz_id, self.capacity + 1), fetchall=True) or []
+        return Leaderboard([(row['user_id'], row['score'], _leaderboard_ts(row['achieved_at'])) for row in rows],
+                           self.capacity)
+
+    def _board(self, quiz_id):
+        with self._lock:
+            starting = self._pid != os.getpid()
+            if starting:
+                # o que veio do processo pai (fork) pode já estar desatualizado
+                self._pid = os.getpid()
+                self._boards.clear()
+                self._overall = None
+            board = self._overall if quiz_id is None else self._boards.get(quiz_id)
+            if self._fresh(board):
+                self.hits += 1
+                if quiz_id is not None:
+                    self._boards.move_to_end(quiz_id)
+                return board
+        if starting:
+            cache_bus.ensure_listening()
+            self.warm()
+            return self._board(quiz_id)
+        # carregada sem o lock: o índice devolve só as primeiras capacity + 1 linhas
+        board = self._load(quiz_id)
+        with self._lock:
+            self.loads += 1
+            if quiz_id is None:
+                self._overall = board
+            else:
+                self._boards[quiz_id] = board
+                while len(self._boards) > self.hot_quizzes:
+                    self._boards.popitem(last=False)
+        return board
+
+    def warm(self, count=LEADERBOARD_WARM):
+        """Carrega a geral e as classificações dos `count` quizzes com mais jogadores."""
+        rows = execute_query(
+            "SELECT quiz_id, COUNT(*) AS players FROM best_scores GROUP BY quiz_id "
+            "ORDER BY players DESC LIMIT ?", (count,), fetchall=True) or []
+        for quiz_id in [None] + [row['quiz_id'] for row in rows]:
+            board = self._load(quiz_id)
+            with self._lock:
+                self.loads += 1
+                if quiz_id is None:
+                    self._overall = board
+                else:
+                    self._boards[quiz_id] = board
+
+    def top(self, quiz_id, n=LEADERBOARD_TOP):
+        """[(user_id, pontos)] dos n primeiros."""
+        board = self._board(quiz_id)
+        with self._lock:
+            return board.top(n)
+
+    def rank(self, quiz_id, user_id):
+        """(posição, pontos) do utilizador, ou None se ainda não tiver resultado."""
+        board = self._board(quiz_id)
+        with self._lock:
+            found = board.rank(user_id)
+            if found is not None or board.complete:
+                return found
+            self.table_ranks += 1
+        return _rank_from_table(quiz_id, user_id)
+
+    def apply(self, scores=(), points=()):
+        """Melhorias [(user_id, quiz_id, score, achieved_at)] e totais [(user_id, pontos)]."""
+        with self._lock:
+            for user_id, quiz_id, score, achieved_at in scores:
+                board = self._boards.get(quiz_id)
+                if board is not None:
+                    board.update(user_id, score, _leaderboard_ts(achieved_at))
+            if self._overall is not None:
+                for user_id, total in points:
+                    if total > 0:
+                        self._overall.update(user_id, total, '')
+
+    def drop(self, quiz_ids=(), overall=False):
+        with self._lock:
+            for quiz_id in quiz_ids:
+                self._boards.pop(quiz_id, None)
+            if overall:
+                self._overall = None
+
+    def clear(self):
+        with self._lock:
+            self._boards.clear()
+            self._overall = None
+
+    def stats(self):
+        with self._lock:
+            return {'quizzes': len(self._boards), 'overall': self._overall is not None,
+                    'hits': self.hits, 'loads': self.loads, 'table_ranks': self.table_ranks}
+
+
+leaderboards = LeaderboardRegistry(LEADERBOARD_CAPACITY, LEADERBOARD_HOT_QUIZZES)
+
+def _rank_from_table(quiz_id, user_id):
+    # posição = quantos estão à frente + 1, contados pelo índice da classificação
+    if quiz_id is None:
+        row = execute_query("SELECT points FROM users WHERE id = ?", (user_id,), fetchone=True)
+        if not row or row['points'] <= 0:
+            return None
+        ahead = execute_query(
+            "SELECT COUNT(*) AS n FROM users WHERE points > ? OR (points = ? AND id < ?)",
+            (row['points'], row['points'], user_id), fetchone=True)
+        return ahead['n'] + 1, row['points']
+    row = execute_query("SELECT score, achieved_at FROM best_scores WHERE user_id = ? AND quiz_id = ?",
+                        (user_id, quiz_id), fetchone=True)
+    if not row:
+        return None
+    ahead = execute_query(
+        "SELECT COUNT(*) AS n FROM best_scores WHERE quiz_id = ? AND (score > ? OR (score = ? AND "
+        "(achieved_at < ? OR (achieved_at = ? AND user_id < ?))))",
+        (quiz_id, row['score'], row['score'], row['achieved_at'], row['achieved_at'], user_id), fetchone=True)
+    return ahead['n'] + 1, row['score']
+
+def leaderboards_changed(scores=(), points=(), drop=(), overall=False):
+    """Aplica neste processo e difunde aos outros workers."""
+    leaderboards.apply(scores, points)
+    leaderboards.drop(drop, overall)
+    try:
+        cache_bus.publish({'leaderboards': {'scores': [list(s) for s in scores], 'points': [list(p) for p in points],
+                                            'drop': list(drop), 'overall': overall}})
+    except CacheError as e:
+        app.logger.warning('Alteração das classificações não difundida: %s', e)
+
+@cache_bus.on_message
+def _apply_leaderboard_message(message):
+    if message is None:
+        leaderboards.clear()
+        return
+    changes = message.get('leaderboards')
+    if not changes:
+        return
+    if changes.get('reset'):
+        leaderboards.clear()
+        return
+    leaderboards.apply(changes.get('scores', ()), changes.get('points', ()))
+    leaderboards.drop(changes.get('drop', ()), changes.get('overall', False))
+
+def get_leaderboard(quiz_id=None, user_id=None, limit=LEADERBOARD_TOP):
+    """Top `limit` (com nomes) e, com user_id, a posição desse utilizador: {'top', 'me'}."""
+    entries = leaderboards.top(quiz_id, limit)
+    names = {}
+    if entries:
+        placeholders = ", ".join("?" for _ in entries)
+        names = {row['id']: row['username'] for row in execute_query(
+            f"SELECT id, username FROM users WHERE id IN ({placeholders})",
+            tuple(user_id for user_id, _ in entries), fetchall=True) or []}
+    top = [{'position': position, 'user_id': uid, 'username': names[uid], 'score': score}
+           for position, (uid, score) in enumerate(entries, 1) if uid in names]
+    me = None
+    if user_id is not None:
+        found = leaderboards.rank(quiz_id, user_id)
+        if found:
+            me = {'position': found[0], 'score': found[1]}
+    return {'top': top, 'me': me}
+
+def rebuild_leaderboards():
+    """Recalcula best_scores e users.points a partir das tentativas; devolve quantos resultados há."""
+    with transaction():
+        execute_query("DELETE FROM best_scores", commit=True)
+        execute_query(BEST_SCORES_BACKFILL_SQL, commit=True)
+        execute_query(f"UPDATE users SET points = ({USER_POINTS_SQL})", commit=True)
+        row = execute_query("SELECT COUNT(*) AS n FROM best_scores", fetchone=True)
+    leaderboards.clear()
+    try:
+        cache_bus.publish({'leaderboards': {'reset': True}})
+    except CacheError as e:
+        app.logger.warning('Alteração das classificações não difundida: %s', e)
+    return row['n']
+
+
+# -----------------------------------------------------------------------------
+# Salas ao vivo: um anfitrião, muitos jogadores, eventos por SSE
+# -----------------------------------------------------------------------------
+# O anfitrião abre uma sala para um quiz e os jogadores entram com o código.
+# Cada cliente tem um único stream SSE (/live/<código>/events). A sala guarda
+# os últimos LIVE_EVENT_LOG eventos numa deque com números de sequência e um
+# Condition: publicar é acrescentar à deque + notify_all, e cada stream lê o
+# que ainda não enviou (nada de uma fila por cliente). Um cliente que volta a
+# ligar (Last-Event-ID) recebe o que perdeu ou, se já saiu da deque, um
+# snapshot. Respostas e entradas na sala só atualizam contadores; o "progress"
+# é enviado no máximo a cada LIVE_PROGRESS_INTERVAL segundos, por isso 300
+# respostas não são 300 x 300 mensagens. As salas vivem em memória no processo
+# que as criou: com vários workers, /live/ tem de ir sempre para o mesmo (um
+# worker gthread com muitas threads, ou encaminhamento por código no proxy).
+LIVE_CODE_ALPHABET = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'
+LIVE_CODE_LENGTH = 6
+LIVE_QUESTION_SECONDS = int(os.environ.get('LIVE_QUESTION_SECONDS', '20'))
+LIVE_PROGRESS_INTERVAL = float(os.environ.get('LIVE_PROGRESS_INTERVAL', '0.5'))
+LIVE_HEARTBEAT = float(os.environ.get('LIVE_HEARTBEAT', '15'))
+LIVE_ROOM_TTL = float(os.environ.get('LIVE_ROOM_TTL', str(3 * 3600)))
+LIVE_MAX_STREAMS = int(os.environ.get('LIVE_MAX_STREAMS', '1000'))
+LIVE_MAX_PLAYERS = int(os.environ.get('LIVE_MAX_PLAYERS', '500'))
+LIVE_EVENT_LOG = 64
+LIVE_LEADERBOARD_SIZE = 10
+
+
+class LiveRoom:
+    def __init__(self, code, quiz, questions, host_id):
+        self.code = code
+        self.quiz_id = quiz.id
+        self.title = quiz.title
+        self.host_id = host_id
+        self.questions = [(q.id, q.question_text,
+                           {k: v for k, v in (('A', q.option_a), ('B', q.option_b),
+                                              ('C', q.option_c), ('D', q.option_d)) if v},
+                           q.correct_option) for q in questions]
+        self.state = 'lobby'            # lobby -> question <-> reveal -> finished
+        self.index = -1
+        self.question_started = None
+        self.players = {}               # user_id -> {'name', 'score', 'correct', 'answers'}
+        self.counts = {}                # opção -> nº de respostas à pergunta atual
+        self.answered = 0
+        self.ranks = {}                 # user_id -> {'score', 'rank'} na última revelação
+        self.last_reveal = None
+        self.events = deque(maxlen=LIVE_EVENT_LOG)   # (seq, evento, JSON)
+        self.seq = 0
+        self.progress = 0               # muda a cada entrada / resposta
+        self.cond = threading.Condition()
+        self.closed = False
+        self.touched = time.monotonic()
+        self._last_notify = 0.0
+        self._flush_timer = None
+
+    # -- chamados com self.cond ----------------------------------------------
+    def _emit(self, name, data):
+        self.seq += 1
+        self.events.append((self.seq, name, json.dumps(data, ensure_ascii=False, separators=(',', ':'))))
+        self._last_notify = time.monotonic()
+        self.cond.notify_all()
+
+    def _progress_changed(self):
+        self.progress += 1
+        self.touched = time.monotonic()
+        wait = LIVE_PROGRESS_INTERVAL - (self.touched - self._last_notify)
+        if wait <= 0:
+            self._last_notify = self.touched
+            self.cond.notify_all()
+        elif self._flush_timer is None:
+            # a última alteração do intervalo chega com este timer
+            self._flush_timer = threading.Timer(wait, self._flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _flush(self):
+        with self.cond:
+            self._flush_timer = None
+            self._last_notify = time.monotonic()
+            self.cond.notify_all()
+
+    def _question(self):
+        qid, text, options, _ = self.questions[self.index]
+        return {'index': self.index, 'total': len(self.questions), 'text': text,
+                'options': options, 'seconds': LIVE_QUESTION_SECONDS}
+
+    def _rank(self):
+        ordered = sorted(self.players.items(), key=lambda item: (-item[1]['score'], item[1]['name']))
+        self.ranks = {}
+        previous, rank = None, 0
+        for position, (user_id, player) in enumerate(ordered, 1):
+            if player['score'] != previous:
+                previous, rank = player['score'], position
+            self.ranks[user_id] = {'score': player['score'], 'rank': rank}
+        return [{'name': p['name'], 'score': p['score'], 'rank': self.ranks[uid]['rank']}
+                for uid, p in ordered[:LIVE_LEADERBOARD_SIZE]]
+
+    def _progress(self, is_host):
+        data = {'players': len(self.players), 'answered': self.answered}
+        if is_host and self.state == 'question':
+            data['counts'] = self.counts
+        return data
+
+    def snapshot(self, user_id):
+        data = {'state': self.state, 'title': self.title, 'code': self.code,
+                'total': len(self.questions), 'progress': self._progress(user_id == self.host_id)}
+        if self.state == 'question':
+            data['question'] = self._question()
+            data['elapsed'] = round(time.monotonic() - self.question_started, 1)
+            player = self.players.get(user_id)
+            data['answered'] = bool(player) and player['answers'].get(self.index) is not None
+        elif self.state in ('reveal', 'finished'):
+            data['reveal'] = self.last_reveal
+        if user_id in self.ranks:
+            data['you'] = self.ranks[user_id]
+        return data
+
+    # -- API ------------------------------------------------------------------
+    def join(self, user):
+        with self.cond:
+            if user.id == self.host_id or user.id in self.players:
+                return True
+            if len(self.players) >= LIVE_MAX_PLAYERS:
+                return False
+            self.players[user.id] = {'name': user.username, 'score': 0, 'correct': 0, 'answers': {}}
+            self._progress_changed()
+            return True
+
+    def is_member(self, user_id):
+        return user_id == self.host_id or user_id in self.players
+
+    def answer(self, user_id, index, option):
+        """'ok' ou o motivo da recusa ('closed', 'duplicate', 'late', 'invalid')."""
+        with self.cond:
+            player = self.players[user_id]
+            if self.state != 'question' or index != self.index:
+                return 'closed'
+            if player['answers'].get(index) is not None:
+                return 'duplicate'
+            qid, _, options, correct = self.questions[index]
+            if option not in options:
+                return 'invalid'
+            elapsed = time.monotonic() - self.question_started
+            if elapsed > LIVE_QUESTION_SECONDS + 1:   # 1 s de tolerância para a rede
+                return 'late'
+            player['answers'][index] = option
+            self.counts[option] = self.counts.get(option, 0) + 1
+            self.answered += 1
+            if option == correct:
+                # entre 500 e 1000 pontos, conforme a rapidez
+                player['score'] += 500 + int(500 * max(0.0, 1 - elapsed / LIVE_QUESTION_SECONDS))
+                player['correct'] += 1
+            self._progress_changed()
+            return 'ok'
+
+    def advance(self):
+        """Passo do anfitrião: abre a pergunta seguinte, revela a atual ou termina.
+
+        Devolve True só na passagem a 'finished'.
+        """
+        with self.cond:
+            self.touched = time.monotonic()
+            if self.state == 'question':
+                qid, _, _, correct = self.questions[self.index]
+                self.state = 'reveal'
+                self.last_reveal = {'index': self.index, 'correct': correct, 'counts': self.counts,
+                                    'answered': self.answered, 'leaderboard': self._rank()}
+                self._emit('reveal', self.last_reveal)
+            elif self.state in ('lobby', 'reveal') and self.index + 1 < len(self.questions):
+                self.state = 'question'
+                self.index += 1
+                self.counts = {}
+                self.answered = 0
+                self.question_started = time.monotonic()
+                self._emit('question', self._question())
+            elif self.state != 'finished':
+                self.state = 'finished'
+                self.last_reveal = {'leaderboard': self._rank()}
+                self._emit('finished', self.last_reveal)
+                return True
+            return False
+
+    def results(self):
+        """(user_id, certas, respostas) de cada jogador, para gravar como tentativas."""
+        with self.cond:
+            return [(user_id, p['correct'], {f'q{self.questions[i][0]}': option
+                                             for i, option in p['answers'].items()})
+                    for user_id, p in self.players.items()]
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def stream(self, user_id, last_seq=None):
+        """Gerador de eventos SSE para um cliente."""
+        is_host = user_id == self.host_id
+        yield 'retry: 3000\n\n'
+        sent_progress = None
+        with self.cond:
+            oldest = self.events[0][0] if self.events else self.seq + 1
+            if last_seq is None or last_seq > self.seq or last_seq + 1 < oldest:
+                seq = self.seq
+                sent_progress = self.progress
+                initial = json.dumps(self.snapshot(user_id), ensure_ascii=False, separators=(',', ':'))
+            else:
+                seq, initial = last_seq, None
+        if initial:
+            yield f'id: {seq}\nevent: snapshot\ndata: {initial}\n\n'
+            if self.state == 'finished':
+                return
+
+        while True:
+            with self.cond:
+                if self.seq == seq and self.progress == sent_progress and not self.closed:
+                    self.cond.wait(LIVE_HEARTBEAT)
+                if self.events and self.events[0][0] > seq + 1:
+                    # ficou para trás (cliente lento): recomeça de um snapshot
+                    seq = self.seq
+                    pending = [(seq, 'snapshot', json.dumps(self.snapshot(user_id), ensure_ascii=False,
+                                                            separators=(',', ':')))]
+                else:
+                    pending = [event for event in self.events if event[0] > seq]
+                progress = None
+                if self.progress != sent_progress:
+                    sent_progress = self.progress
+                    progress = json.dumps(self._progress(is_host))
+                you = self.ranks.get(user_id)
+                finished = self.state == 'finished'
+                closed = self.closed
+
+            chunks = []
+            for event_seq, name, data in pending:
+                seq = event_seq
+                chunks.append(f'id: {event_seq}\nevent: {name}\ndata: {data}\n\n')
+                if name in ('reveal', 'finished') and you:
+                    chunks.append(f'event: score\ndata: {json.dumps(you)}\n\n')
+            if progress:
+                chunks.append(f'event: progress\ndata: {progress}\n\n')
+            yield ''.join(chunks) or ': ping\n\n'
+            if closed or finished:
+                return
+
+
+class LiveRoomRegistry:
+    def __init__(self, max_streams):
+        self.max_streams = max_streams
+        self._rooms = {}
+        self._lock = threading.Lock()
+        self.streams = 0
+        self.rejected = 0
+
+    def _purge(self, now):
+        for code, room in list(self._rooms.items()):
+            if now - room.touched > LIVE_ROOM_TTL:
+                del self._rooms[code]
+                room.close()
+
+    def create(self, quiz, questions, host_id):
+        with self._lock:
+            self._purge(time.monotonic())
+            while True:
+                code = ''.join(secrets.choice(LIVE_CODE_ALPHABET) for _ in range(LIVE_CODE_LENGTH))
+                if code not in self._rooms:
+                    break
+            room = self._rooms[code] = LiveRoom(code, quiz, questions, host_id)
+            return room
+
+    def get(self, code):
+        room = self._rooms.get((code or '').strip().upper())
+        if room is None or time.monotonic() - room.touched > LIVE_ROOM_TTL:
+            return None
+        return room
+
+    def remove(self, room):
+        with self._lock:
+            self._rooms.pop(room.code, None)
+        room.close()
+
+    def acquire_stream(self):
+        with self._lock:
+            if self.streams >= self.max_streams:
+                self.rejected += 1
+                return False
+            self.streams += 1
+            return True
+
+    def release_stream(self):
+        with self._lock:
+            self.streams -= 1
+
+    def stats(self):
+        with self._lock:
+            return {'rooms': len(self._rooms), 'streams': self.streams, 'rejected': self.rejected,
+                    'players': sum(len(room.players) for room in self._rooms.values())}
+
+
+live_rooms = LiveRoomRegistry(LIVE_MAX_STREAMS)
+
 
 # -----------------------------------------------------------------------------
-# Simple row -> object wrapper
+# Métricas (formato de texto Prometheus)
 # -----------------------------------------------------------------------------
-class DBObject:
-    def __init__(self, row):
-        if not row:
-            return
-        for k in row.keys():
-            setattr(self, k, row[k])
+# Cada worker acumula em memória (um lock e umas somas por request). Com
+# METRICS_DIR definido, cada processo escreve periodicamente um snapshot em
+# METRICS_DIR/<master>-<pid>.json (master = pid do processo pai, o master do
+# gunicorn) e o /metrics junta os ficheiros desse master. Quando um worker sai
+# (atexit; ou, se foi morto, no /metrics seguinte) os seus contadores passam
+# para <master>-dead.json e o ficheiro dele é apagado: os contadores nunca
+# diminuem enquanto o master vive e as gauges só contam workers vivos. Os
+# ficheiros de masters que já não existem (execuções anteriores) são apagados,
+# por isso depois de um restart os contadores recomeçam do zero.
+METRICS_DIR = os.environ.get('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '5'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
 
-# -----------------------------------------------------------------------------
-# CRUD Functions (Compatíveis com SQLite + PostgreSQL)
-# -----------------------------------------------------------------------------
-def get_user_by_id(user_id):
-    row = execute_query("SELECT * FROM users WHERE id = ?", (user_id,), fetchone=True)
-    return DBObject(row) if row else None
+METRIC_HELP = {
+    'sabio_http_request_duration_seconds': ('histogram', 'Duração dos requests por endpoint.'),
+    'sabio_http_requests_total': ('counter', 'Requests por endpoint e código de estado.'),
+    'sabio_db_queries_total': ('counter', 'Queries executadas por endpoint.'),
+    'sabio_db_time_seconds_total': ('counter', 'Tempo na base de dados por endpoint e fase.'),
+    'sabio_cache_requests_total': ('counter', 'Consultas às caches por resultado.'),
+    'sabio_cache_hit_ratio': ('gauge', 'Hits / consultas, por cache (todos os workers).'),
+    'sabio_db_pool_connections': ('gauge', 'Ligações do pool por estado.'),
+    'sabio_db_pool_size': ('gauge', 'Tamanho máximo do pool por worker.'),
+    'sabio_db_pool_checkouts_total': ('counter', 'Ligações pedidas ao pool.'),
+    'sabio_db_pool_wait_seconds_total': ('counter', 'Tempo à espera de uma ligação livre.'),
+    'sabio_db_pool_timeouts_total': ('counter', 'Pedidos ao pool que esgotaram o tempo.'),
+    'sabio_attempts_pending': ('gauge', 'Tentativas à espera de serem gravadas.'),
+    'sabio_worker_processes': ('gauge', 'Workers com métricas ativas.'),
+}
 
-def get_user_by_username(username):
-    row = execute_query("SELECT * FROM users WHERE username = ?", (username,), fetchone=True)
-    return DBObject(row) if row else None
 
-def get_user_by_email(email):
-    row = execute_query("SELECT * FROM users WHERE email = ?", (email,), fetchone=True)
-    return DBObject(row) if row else None
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}      # (name, labels) -> valor
+        self.histograms = {}    # (name, labels) -> [contagem por bucket..., +Inf, soma]
+        self._pid = None
 
-def create_user(username, email, password):
-    password_hash = generate_password_hash(password)
-    execute_query(
-        "INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)",
-        (username, email, password_hash),
-        commit=True
-    )
-    row = execute_query("SELECT * FROM users WHERE username = ?", (username,), fetchone=True)
-    return DBObject(row)
+    def inc(self, name, labels, value=1.0):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0.0) + value
 
-def update_user_password(user_id, new_password):
-    password_hash = generate_password_hash(new_password)
-    execute_query("UPDATE users SET password_hash = ? WHERE id = ?", (password_hash, user_id), commit=True)
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        index = bisect.bisect_left(LATENCY_BUCKETS, value)
+        with self._lock:
+            h = self.histograms.get(key)
+            if h is None:
+                h = self.histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+            h[index] += 1
+            h[-1] += value
 
-def get_avatar_by_user_id(user_id):
-    row = execute_query("SELECT * FROM avatars WHERE user_id = ?", (user_id,), fetchone=True)
-    return DBObject(row) if row else None
+    def snapshot(self):
+        """Estado deste processo; contadores de fontes externas (pool, caches) são lidos aqui."""
+        with self._lock:
+            counters = [[n, list(l), v] for (n, l), v in self.counters.items()]
+            histograms = [[n, list(l), list(h)] for (n, l), h in self.histograms.items()]
 
-def create_avatar_for_user(user_id):
-    if USE_POSTGRES:
-        execute_query(
-            "INSERT INTO avatars (user_id, outfit, accessory) VALUES (%s, NULL, NULL) ON CONFLICT (user_id) DO NOTHING",
-            (user_id,),
-            commit=True
-        )
-    else:
-        execute_query(
-            "INSERT OR IGNORE INTO avatars (user_id, outfit, accessory) VALUES (?, NULL, NULL)",
-            (user_id,),
-            commit=True
-        )
-    return get_avatar_by_user_id(user_id)
+        pool = pool_stats()
+        counters += [
+            ['sabio_db_pool_checkouts_total', [], pool['checkouts']],
+            ['sabio_db_pool_wait_seconds_total', [], pool['wait_time_total']],
+            ['sabio_db_pool_timeouts_total', [], pool['timeouts']],
+        ]
+        for cache, hits, misses in (
+            ('fragment', fragment_cache.hits, fragment_cache.misses),
+            ('user', _user_cache_hits, _user_cache_misses),
+        ):
+            counters.append(['sabio_cache_requests_total', [['cache', cache], ['result', 'hit']], hits])
+            counters.append(['sabio_cache_requests_total', [['cache', cache], ['result', 'miss']], misses])
 
-def update_avatar(user_id, outfit=None, accessory=None):
-    # garante que exista
-    create_avatar_for_user(user_id)
-    
-    # build dynamic query
-    updates = []
-    params = []
+        gauges = [
+            ['sabio_db_pool_connections', [['state', 'in_use']], pool['in_use']],
+            ['sabio_db_pool_connections', [['state', 'idle']], pool['idle']],
+            ['sabio_db_pool_size', [], pool['size']],
+            ['sabio_attempts_pending', [], attempt_recorder.stats()['pending']],
+            ['sabio_worker_processes', [], 1],
+        ]
+        return {'pid': os.getpid(), 'counters': counters, 'histograms': histograms, 'gauges': gauges}
 
-    if outfit is not None:
-        updates.append("outfit = %s" if USE_POSTGRES else "outfit = ?")
-        params.append(outfit)
-    if accessory is not None:
-        updates.append("accessory = %s" if USE_POSTGRES else "accessory = ?")
-        params.append(accessory)
+    def _ensure_flusher(self):
+        if METRICS_DIR and self._pid != os.getpid():
+            self._pid = os.getpid()
+            threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
 
-    if updates:
-        query = f"UPDATE avatars SET {', '.join(updates)} WHERE user_id = %s" if USE_POSTGRES else f"UPDATE avatars SET {', '.join(updates)} WHERE user_id = ?"
-        params.append(user_id)
-        execute_query(query, tuple(params), commit=True)
+    def _flush_loop(self):
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            try:
+                self.dump()
+            except Exception:
+                app.logger.exception('Erro ao gravar métricas em %s', METRICS_DIR)
 
-    return get_avatar_by_user_id(user_id)
+    def dump(self):
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        _write_snapshot(_metrics_path(os.getppid(), os.getpid()), self.snapshot())
+
+    def retire(self):
+        """À saída do worker: os contadores passam para o agregado dos que já saíram."""
+        if not METRICS_DIR or self._pid != os.getpid():
+            return
+        self.dump()
+        _retire_metrics_files(os.getppid(), [_metrics_path(os.getppid(), os.getpid())])
 
 
-def create_quiz(title, description, is_public, created_by, cover_image_url):
-    execute_query(
-        "INSERT INTO quizzes (title, description, is_public, created_by, cover_image_url) VALUES (?, ?, ?, ?, ?)",
-        (title, description, bool(is_public), created_by, cover_image_url),
-        commit=True
-    )
-    row = execute_query(
-        "SELECT * FROM quizzes WHERE title = ? AND created_by = ? ORDER BY id DESC LIMIT 1",
-        (title, created_by),
-        fetchone=True
-    )
-    return DBObject(row) if row else None
+metrics = Metrics()
+atexit.register(metrics.retire)
 
-def get_quiz_by_id(quiz_id):
-    row = execute_query("SELECT * FROM quizzes WHERE id = ?", (quiz_id,), fetchone=True)
-    if not row:
-        return None
-    quiz = DBObject(row)
-    quiz.questions = get_questions_for_quiz(quiz.id)
-    return quiz
+def _metrics_path(master, name):
+    return os.path.join(METRICS_DIR, f'{master}-{name}.json')
 
-def get_quizzes_by_user(user_id):
-    rows = execute_query("SELECT * FROM quizzes WHERE created_by = ?", (user_id,), fetchall=True)
-    quizzes = []
-    for r in rows or []:
-        q = DBObject(r)
-        q.questions = get_questions_for_quiz(q.id)
-        quizzes.append(q)
-    return quizzes
+def _read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
 
-def get_public_quizzes():
-    # Usa placeholder e passa um booleano; execute_query converte ? -> %s em Postgres
-    rows = execute_query("SELECT * FROM quizzes WHERE is_public = ?", (True,), fetchall=True)
-    quizzes = []
-    for r in rows or []:
-        q = DBObject(r)
-        q.questions = get_questions_for_quiz(q.id)
-        quizzes.append(q)
-    return quizzes
-
-def update_quiz(quiz_id, title=None, description=None, is_public=None, cover_image_url=None):
-    if title is not None:
-        execute_query("UPDATE quizzes SET title = ? WHERE id = ?", (title, quiz_id), commit=True)
-    if description is not None:
-        execute_query("UPDATE quizzes SET description = ? WHERE id = ?", (description, quiz_id), commit=True)
-    if is_public is not None:
-        execute_query("UPDATE quizzes SET is_public = ? WHERE id = ?", (bool(is_public), quiz_id), commit=True)
-    if cover_image_url is not None:
-        execute_query("UPDATE quizzes SET cover_image_url = ? WHERE id = ?", (cover_image_url, quiz_id), commit=True)
-    return get_quiz_by_id(quiz_id)
+def _write_snapshot(path, snapshot):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp, path)
 
-def delete_quiz_by_id(quiz_id):
-    execute_query("DELETE FROM questions WHERE quiz_id = ?", (quiz_id,), commit=True)
-    execute_query("DELETE FROM favorites WHERE quiz_id = ?", (quiz_id,), commit=True)
-    execute_query("DELETE FROM quizzes WHERE id = ?", (quiz_id,), commit=True)
+@contextmanager
+def _metrics_dir_lock():
+    with open(os.path.join(METRICS_DIR, '.lock'), 'w') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
 
-def create_question(quiz_id, question_text, option_a, option_b, option_c, option_d, correct_option):
-    execute_query(
-        "INSERT INTO questions (quiz_id, question_text, option_a, option_b, option_c, option_d, correct_option) VALUES (?, ?, ?, ?, ?, ?, ?)",
-        (quiz_id, question_text, option_a, option_b, option_c, option_d, correct_option),
-        commit=True
-    )
-    row = execute_query(
-        "SELECT * FROM questions WHERE quiz_id = ? AND question_text = ?",
-        (quiz_id, question_text),
-        fetchone=True
-    )
-    return DBObject(row)
+def _merge_snapshots(snapshots):
+    counters, histograms, gauges = {}, {}, {}
+    for snap in snapshots:
+        for name, labels, value in snap['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in snap['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            merged = histograms.get(key)
+            histograms[key] = values if merged is None else [a + b for a, b in zip(merged, values)]
+        for name, labels, value in snap['gauges']:
+            key = (name, tuple(map(tuple, labels)))
+            gauges[key] = gauges.get(key, 0) + value
+    return counters, histograms, gauges
 
-def get_question_by_id(qid):
-    row = execute_query("SELECT * FROM questions WHERE id = ?", (qid,), fetchone=True)
-    return DBObject(row) if row else None
+def _retire_metrics_files(master, paths):
+    """Junta os snapshots `paths` (workers que saíram) a <master>-dead.json e apaga-os."""
+    dead_path = _metrics_path(master, 'dead')
+    with _metrics_dir_lock():
+        # relidos dentro do lock: dois /metrics ao mesmo tempo não os somam duas vezes
+        retired = [snap for snap in map(_read_snapshot, paths) if snap]
+        if not retired:
+            return
+        dead = _read_snapshot(dead_path) or {'counters': [], 'histograms': []}
+        counters, histograms, _ = _merge_snapshots([dict(snap, gauges=[]) for snap in [dead] + retired])
+        _write_snapshot(dead_path, {
+            'pid': None,
+            'counters': [[n, list(l), v] for (n, l), v in counters.items()],
+            'histograms': [[n, list(l), h] for (n, l), h in histograms.items()],
+            'gauges': [],
+        })
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
 
-def get_questions_for_quiz(quiz_id):
-    rows = execute_query("SELECT * FROM questions WHERE quiz_id = ?", (quiz_id,), fetchall=True)
-    return [DBObject(r) for r in rows or []]
+def _sweep_metrics_dir(master):
+    """Retira os workers mortos deste master e apaga os ficheiros de masters que já não existem."""
+    dead_workers = []
+    for name in os.listdir(METRICS_DIR):
+        match = re.fullmatch(r'(\d+)-(\d+|dead)\.json', name)
+        if not match:
+            continue
+        owner, worker = int(match[1]), match[2]
+        if owner != master:
+            if not _pid_alive(owner):
+                try:
+                    os.remove(os.path.join(METRICS_DIR, name))
+                except FileNotFoundError:
+                    pass
+        elif worker != 'dead' and int(worker) != os.getpid() and not _pid_alive(int(worker)):
+            dead_workers.append(os.path.join(METRICS_DIR, name))
+    if dead_workers:
+        _retire_metrics_files(master, dead_workers)
 
-def get_favorite(user_id, quiz_id):
-    row = execute_query("SELECT * FROM favorites WHERE user_id = ? AND quiz_id = ?", (user_id, quiz_id), fetchone=True)
-    return DBObject(row) if row else None
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
 
-def add_favorite(user_id, quiz_id):
-    if USE_POSTGRES:
-        execute_query(
-            "INSERT INTO favorites (user_id, quiz_id) VALUES (%s, %s) ON CONFLICT DO NOTHING",
-            (user_id, quiz_id),
-            commit=True
-        )
+def collect_metrics():
+    """Snapshots de todos os workers (ou só deste, sem METRICS_DIR) já somados."""
+    if METRICS_DIR:
+        metrics.dump()
+        master = os.getppid()
+        _sweep_metrics_dir(master)
+        prefix = f'{master}-'
+        snapshots = [snap for snap in (_read_snapshot(os.path.join(METRICS_DIR, name))
+                                       for name in os.listdir(METRICS_DIR)
+                                       if name.startswith(prefix) and name.endswith('.json')) if snap]
     else:
-        execute_query(
-            "INSERT OR IGNORE INTO favorites (user_id, quiz_id) VALUES (?, ?)",
-            (user_id, quiz_id),
-            commit=True
-        )
+        snapshots = [metrics.snapshot()]
 
-def remove_favorite(user_id, quiz_id):
-    execute_query("DELETE FROM favorites WHERE user_id = ? AND quiz_id = ?", (user_id, quiz_id), commit=True)
+    counters, histograms, gauges = _merge_snapshots(snapshots)
 
-def get_favorites_for_user(user_id):
-    rows = execute_query("""
-        SELECT q.* FROM quizzes q
-        JOIN favorites f ON q.id = f.quiz_id
-        WHERE f.user_id = ?
-    """, (user_id,), fetchall=True)
-    return [DBObject(r) for r in rows or []]
+    for cache in ('fragment', 'user'):
+        hits = counters.get(('sabio_cache_requests_total', (('cache', cache), ('result', 'hit'))), 0)
+        misses = counters.get(('sabio_cache_requests_total', (('cache', cache), ('result', 'miss'))), 0)
+        if hits + misses:
+            gauges[('sabio_cache_hit_ratio', (('cache', cache),))] = hits / (hits + misses)
+    return counters, histograms, gauges
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        f'{k}="' + str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for k, v in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+def render_metrics():
+    counters, histograms, gauges = collect_metrics()
+    by_name = {}
+    for (name, labels), value in list(counters.items()) + list(gauges.items()):
+        by_name.setdefault(name, []).append(f'{name}{_format_labels(labels)} {value}')
+    for (name, labels), values in histograms.items():
+        lines = by_name.setdefault(name, [])
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), values[:-1]):
+            cumulative += count
+            lines.append(f'{name}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+        lines.append(f'{name}_sum{_format_labels(labels)} {values[-1]}')
+        lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+
+    out = []
+    for name in sorted(by_name):
+        kind, help_text = METRIC_HELP.get(name, ('untyped', ''))
+        out.append(f'# HELP {name} {help_text}')
+        out.append(f'# TYPE {name} {kind}')
+        out.extend(by_name[name])
+    return '\n'.join(out) + '\n'
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is None or request.endpoint == 'metrics':
+        return response
+    metrics._ensure_flusher()
+    endpoint = (('endpoint', request.endpoint or 'unmatched'),)
+    metrics.observe('sabio_http_request_duration_seconds', endpoint, time.perf_counter() - started)
+    metrics.inc('sabio_http_requests_total', endpoint + (('status', str(response.status_code)),))
+    stats = g.get('query_stats')
+    if stats is not None and stats.count:
+        metrics.inc('sabio_db_queries_total', endpoint, stats.count)
+        metrics.inc('sabio_db_time_seconds_total', endpoint + (('phase', 'connect'),), stats.connect)
+        metrics.inc('sabio_db_time_seconds_total', endpoint + (('phase', 'execute'),), stats.execute)
+        metrics.inc('sabio_db_time_seconds_total', endpoint + (('phase', 'fetch'),), stats.fetch)
+    return response
 
 
 # -----------------------------------------------------------------------------
-# Authentication helpers (session & current_user)
+# Ficheiros estáticos: URLs com impressão digital + pré-compressão
 # -----------------------------------------------------------------------------
-def current_user():
-    uid = session.get('user_id')
-    if uid is None:
-        return None
-    user = get_user_by_id(uid)
-    if not user:
-        return None
-    # Attach avatar object for compatibility with previous code expectations
-    avatar = get_avatar_by_user_id(user.id)
-    user.avatar = avatar
-    return user
+# url_for('static', ...) acrescenta ?v=<hash do conteúdo>; um pedido com o hash
+# atual é servido com cache "immutable" de um ano, sem ele volta a validar
+# (ETag). `flask compress-static` gera .gz (e .br, com o módulo brotli) ao lado
+# dos originais e servimo-los consoante o Accept-Encoding. Com
+# STATIC_SENDFILE=x-sendfile (Apache/lighttpd) ou x-accel (nginx, com uma
+# location internal em STATIC_ACCEL_PREFIX a apontar para static/) o envio do
+# ficheiro fica para o servidor web.
+STATIC_FINGERPRINT = os.environ.get('STATIC_FINGERPRINT', '1') == '1'
+STATIC_SENDFILE = os.environ.get('STATIC_SENDFILE', '')
+STATIC_ACCEL_PREFIX = os.environ.get('STATIC_ACCEL_PREFIX', '/_static/')
+STATIC_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+STATIC_COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.map', '.ico'}
+STATIC_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+app.config['USE_X_SENDFILE'] = STATIC_SENDFILE == 'x-sendfile'
+
+
+class StaticManifest:
+    """Hash do conteúdo de cada ficheiro estático, calculado uma vez (em debug, sempre que muda)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}   # filename -> (mtime_ns, size, hash)
+
+    def version(self, filename):
+        entry = self._entries.get(filename)
+        if entry is not None and not app.debug:
+            return entry[2]
+        path = safe_join(app.static_folder, filename) if filename else None
+        try:
+            st = os.stat(path) if path else None
+        except OSError:
+            st = None
+        if st is None:
+            return None
+        if entry is not None and entry[:2] == (st.st_mtime_ns, st.st_size):
+            return entry[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                digest.update(chunk)
+        version = digest.hexdigest()[:12]
+        with self._lock:
+            self._entries[filename] = (st.st_mtime_ns, st.st_size, version)
+        return version
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+static_manifest = StaticManifest()
+
+@app.url_defaults
+def fingerprint_static_url(endpoint, values):
+    if endpoint == 'static' and STATIC_FINGERPRINT and 'v' not in values:
+        version = static_manifest.version(values.get('filename'))
+        if version:
+            values['v'] = version
+
+def serve_static(filename):
+    path = safe_join(app.static_folder, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    compressible = os.path.splitext(path)[1] in STATIC_COMPRESSIBLE
+
+    # variante pré-comprimida, se existir, estiver atualizada e o cliente a aceitar
+    served, encoding = path, None
+    if compressible:
+        for name, suffix in STATIC_ENCODINGS:
+            candidate = path + suffix
+            if (name in request.accept_encodings and os.path.isfile(candidate)
+                    and os.path.getmtime(candidate) >= os.path.getmtime(path)):
+                served, encoding = candidate, name
+                break
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    if STATIC_SENDFILE == 'x-accel':
+        response = Response(mimetype=mimetype)
+        relative = os.path.relpath(served, app.static_folder).replace(os.sep, '/')
+        response.headers['X-Accel-Redirect'] = STATIC_ACCEL_PREFIX + relative
+    else:
+        response = send_file(served, mimetype=mimetype, conditional=True)
+
+    # as capas já têm o hash no nome (ver save_cover_upload)
+    version = request.args.get('v')
+    if filename.startswith('uploads/covers/') or (version and version == static_manifest.version(filename)):
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    else:
+        response.cache_control.no_cache = True
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if compressible:
+        response.vary.add('Accept-Encoding')
+    return response
+
+app.view_functions['static'] = serve_static
+
+def compress_static_files():
+    """Gera .gz (e .br) dos estáticos comprimíveis em falta ou desatualizados; devolve quantos escreveu."""
+    written = 0
+    for root, dirs, files in os.walk(app.static_folder):
+        if os.path.abspath(root) == os.path.abspath(UPLOAD_FOLDER):
+            dirs[:] = []   # conteúdo dos utilizadores, não é nosso
+            continue
+        for name in files:
+            path = os.path.join(root, name)
+            if os.path.splitext(name)[1] not in STATIC_COMPRESSIBLE:
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            for suffix, compress in (('.gz', lambda d: gzip.compress(d, 9, mtime=0)),
+                                     ('.br', brotli.compress if brotli else None)):
+                target = path + suffix
+                if compress is None or (os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path)):
+                    continue
+                with open(f'{target}.tmp', 'wb') as f:
+                    f.write(compress(data))
+                os.replace(f'{target}.tmp', target)
+                written += 1
+    return written
 
-@app.before_request
-def load_user_into_global():
-    g.user = current_user()
 
 # -----------------------------------------------------------------------------
 # Routes
@@ -430,16 +4144,37 @@ def favicon():
 @app.route('/health')
 def health():
     try:
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute("SELECT 1;")
-        cur.fetchone()
-        conn.close()
-        return {'ok': True}
+        execute_query("SELECT 1;", fetchone=True)
+        return {'ok': True, 'pool': pool_stats(), 'attempts': attempt_recorder.stats(),
+                'fragment_cache': fragment_cache.stats(), 'password_hasher': password_hasher.stats(),
+                'mail': mail_sender.stats(), 'covers': cover_processor.stats(),
+                'sqlite': sqlite_stats() if sqlite_production() else None,
+                'live': live_rooms.stats(), 'leaderboards': leaderboards.stats()}
     except Exception as e:
         return {'ok': False, 'error': str(e)}, 500
 
 
+@app.route('/metrics')
+def metrics_endpoint():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        abort(401)
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/export')
+def export_data():
+    # inclui os hashes das palavras-passe: só com EXPORT_TOKEN definido e enviado
+    if not EXPORT_TOKEN:
+        abort(404)
+    if not secrets.compare_digest(request.headers.get('Authorization', ''), f'Bearer {EXPORT_TOKEN}'):
+        abort(401)
+    filename = f"sabio-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}.ndjson"
+    response = Response(export_ndjson(), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.cache_control.no_store = True
+    return response
+
+
 # -----------------------------------------------------------------------------
 # Pages
 # -----------------------------------------------------------------------------
@@ -450,6 +4185,18 @@ def home():
 # -----------------------------------------------------------------------------
 # Login / Register / Logout
 # -----------------------------------------------------------------------------
+def too_many_attempts(template, retry_after):
+    response = make_response(render_template(
+        template, message='Demasiadas tentativas. Tenta outra vez daqui a pouco.'), 429)
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def server_busy(template):
+    response = make_response(render_template(
+        template, message='O servidor está ocupado. Tenta outra vez dentro de momentos.'), 503)
+    response.headers['Retry-After'] = '2'
+    return response
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     message = None
@@ -457,13 +4204,21 @@ def login():
         identifier = request.form.get('identifier', '').strip()
         password = request.form.get('password', '')
 
+        retry_after = throttled(identifier)
+        if retry_after:
+            return too_many_attempts('login.html', retry_after)
+
         # Try by username then email
         user = get_user_by_username(identifier) or get_user_by_email(identifier)
-        if user and check_password_hash(user.password_hash, password):
-            session['user_id'] = user.id
-            return redirect(url_for('dashboard_profile'))
-        else:
-            message = 'Login inválido. Tenta outra vez.'
+        try:
+            if user and password_hasher.verify(user.password_hash, password):
+                if password_needs_rehash(user.password_hash):
+                    update_user_password(user.id, password)
+                session['user_id'] = user.id
+                return redirect(url_for('dashboard_profile'))
+        except PasswordHashBusy:
+            return server_busy('login.html')
+        message = 'Login inválido. Tenta outra vez.'
     return render_template('login.html', message=message)
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -474,6 +4229,10 @@ def register():
         email = request.form.get('email', '').strip().lower()
         password = request.form.get('password', '')
 
+        retry_after = throttled()
+        if retry_after:
+            return too_many_attempts('register.html', retry_after)
+
         if not username or not email or not password:
             message = 'Preenche todos os campos.'
         elif get_user_by_username(username):
@@ -481,7 +4240,10 @@ def register():
         elif get_user_by_email(email):
             message = 'E-mail já registado.'
         else:
-            user = create_user(username, email, password)
+            try:
+                user = create_user(username, email, password)
+            except PasswordHashBusy:
+                return server_busy('register.html')
             return redirect(url_for('login'))
 
     return render_template('register.html', message=message)
@@ -499,21 +4261,21 @@ def forgot_password():
     message = None
     if request.method == 'POST':
         email_destino = request.form.get('email', '').strip().lower()
+        retry_after = throttled(email_destino)
+        if retry_after:
+            return too_many_attempts('forgot.html', retry_after)
         user = get_user_by_email(email_destino)
 
         # Send only if credentials configured and email exists
         if user and app.config['MAIL_USERNAME'] and app.config['MAIL_PASSWORD']:
             token = s.dumps(email_destino, salt='password-reset-salt')
             reset_url = url_for('reset_password', token=token, _external=True)
-            msg = Message('Recuperação de senha', recipients=[email_destino])
-            msg.body = (
+            body = (
                 f"Clique no link para redefinir a sua palavra-passe: {reset_url}\n"
                 f"Mensagem automática | SABIO."
             )
-            try:
-                mail.send(msg)
-            except Exception as e:
-                print('Erro ao enviar e-mail:', e)
+            # vários pedidos seguidos para o mesmo e-mail enviam só o primeiro link
+            enqueue_mail(email_destino, 'Recuperação de senha', body, dedupe_key=f'reset:{email_destino}')
         message = 'Se este email existir, enviámos um link para redefinir a palavra-passe.'
     return render_template('forgot.html', message=message)
 
@@ -531,11 +4293,18 @@ def reset_password(token):
         if not nova_senha:
             return render_template('reset.html', message='Indica uma nova palavra-passe.')
 
+        retry_after = throttled()
+        if retry_after:
+            return too_many_attempts('reset.html', retry_after)
+
         user = get_user_by_email(email)
         if not user:
             return 'Utilizador não encontrado.'
 
-        update_user_password(user.id, nova_senha)
+        try:
+            update_user_password(user.id, nova_senha)
+        except PasswordHashBusy:
+            return server_busy('reset.html')
         return redirect(url_for('login'))
 
     return render_template('reset.html')
@@ -567,7 +4336,8 @@ def dashboard_profile():
         },
     }
 
-    return render_template('profile.html', user=user_context, active_page='perfil')
+    return render_template('profile.html', user=user_context, avatar_sprite=avatar_sprite_manifest(),
+                           ranking=get_leaderboard(user_id=g.user.id), active_page='perfil')
 
 # -----------------------------------------------------------------------------
 # Quiz / Question / Favorite routes
@@ -577,8 +4347,8 @@ def my_sets():
     if not g.user:
         return redirect(url_for('login'))
 
-    quizzes = get_quizzes_by_user(g.user.id)
-    return render_template('my_sets.html', quizzes=quizzes, active_page='my_sets')
+    quizzes, next_cursor = get_quizzes_by_user(g.user.id, after=request.args.get('after', type=int))
+    return render_template('my_sets.html', quizzes=quizzes, next_cursor=next_cursor, active_page='my_sets')
 
 @app.route('/dashboard/create_quiz', methods=['GET', 'POST'])
 def create_quiz_route():
@@ -590,15 +4360,16 @@ def create_quiz_route():
         description = request.form.get('description')
         is_public = bool(request.form.get('is_public'))
         cover_image = request.files.get('cover_image')
-        cover_image_url = None
+        cover_image_url, cover_bytes = None, 0
 
         if cover_image and allowed_file(cover_image.filename):
-            filename = f"{uuid.uuid4().hex}_{secure_filename(cover_image.filename)}"
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            cover_image.save(filepath)
-            cover_image_url = f'/static/uploads/{filename}'
+            try:
+                cover_image_url, cover_bytes = save_cover_upload(cover_image, upload_allowance(g.user.id))
+            except UploadQuotaExceeded:
+                return render_template('create_quiz_form.html', active_page='my_sets',
+                                       message='Sem espaço para esta imagem: apaga capas antigas ou escolhe uma mais pequena.')
 
-        quiz = create_quiz(title, description, is_public, g.user.id, cover_image_url)
+        quiz = create_quiz(title, description, is_public, g.user.id, cover_image_url, cover_bytes)
         return redirect(url_for('add_questions', quiz_id=quiz.id))
 
     return render_template('create_quiz_form.html', active_page='my_sets')
@@ -608,7 +4379,7 @@ def add_questions(quiz_id):
     if not g.user:
         return redirect(url_for('login'))
 
-    quiz = get_quiz_by_id(quiz_id)
+    quiz = get_quiz_by_id(quiz_id, with_questions=False)
     if not quiz:
         return "Quiz não encontrado.", 404
     if quiz.created_by != g.user.id:
@@ -627,62 +4398,177 @@ def add_questions(quiz_id):
     quiz.questions = get_questions_for_quiz(quiz.id)
     return render_template('add_questions.html', quiz=quiz, active_page='my_sets')
 
+@app.route('/dashboard/import_questions/<int:quiz_id>', methods=['POST'])
+def import_questions_route(quiz_id):
+    if not g.user:
+        return jsonify({'error': 'Não autenticado'}), 401
+
+    quiz = get_quiz_by_id(quiz_id, with_questions=False)
+    if not quiz:
+        return jsonify({'error': 'Quiz não encontrado'}), 404
+    if quiz.created_by != g.user.id:
+        return jsonify({'error': 'Sem permissão'}), 403
+
+    upload = request.files.get('file')
+    fmt = request.form.get('format') or import_format_for(upload.filename if upload else None)
+    if not upload or fmt not in ('csv', 'json', 'jsonl'):
+        return jsonify({'error': 'Envia um ficheiro .csv, .json ou .jsonl'}), 400
+
+    report = import_questions(quiz.id, parse_question_rows(upload.stream, fmt),
+                              strict=bool(request.form.get('strict')))
+    return jsonify(report)
+
 @app.route('/dashboard/discover')
 def play_quiz_list():
     if not g.user:
         return redirect(url_for('login'))
 
-    quizzes = get_public_quizzes()
-    return render_template('discover.html', quizzes=quizzes, active_page='discover')
+    query = request.args.get('q', '').strip()
+    sort = 'popular' if request.args.get('sort') == 'popular' and not query else 'recent'
+    # "Mais favoritos" tem cursor composto (favorite_count:id); os outros são inteiros
+    after = request.args.get('after') if sort == 'popular' else request.args.get('after', type=int)
+
+    def build():
+        if query:
+            quizzes, next_cursor = search_quizzes(query, offset=after)
+        elif sort == 'popular':
+            quizzes, next_cursor = get_popular_quizzes(after=after)
+        else:
+            quizzes, next_cursor = get_public_quizzes(after=after)
+        return render_template('discover.html', quizzes=quizzes, next_cursor=next_cursor,
+                               query=query, sort=sort, active_page='discover')
+
+    key = ('discover', query, sort, after, fragment_cache.version('quizzes'),
+           fragment_cache.version('popular') if sort == 'popular' else None)
+    return fragment_cache.get_or_build(key, build)
+
+def quiz_card_json(quiz):
+    return {
+        'id': quiz.id,
+        'title': quiz.title,
+        'description': quiz.description,
+        'cover_image_url': quiz.cover_image_url,
+        'cover_url': cover_url(quiz.cover_image_url),
+        'question_count': quiz.question_count,
+        'favorite_count': quiz.favorite_count,
+        'url': url_for('quiz_detail', quiz_id=quiz.id),
+    }
+
+@app.route('/dashboard/feed/<feed>')
+def quiz_feed(feed):
+    """Página seguinte (JSON) para o scroll infinito de Descobrir / Meus Sets / Favoritos."""
+    if not g.user:
+        return jsonify({'error': 'Não autenticado'}), 401
+
+    after = request.args.get('after', type=int)
+    limit = min(max(request.args.get('limit', QUIZ_PAGE_SIZE, type=int), 1), 100)
+    query = request.args.get('q', '').strip()
+    if feed == 'discover' and query:
+        # Na pesquisa o cursor é o offset dentro dos resultados ordenados por relevância
+        quizzes, next_cursor = search_quizzes(query, offset=after, limit=limit)
+    elif feed == 'discover' and request.args.get('sort') == 'popular':
+        quizzes, next_cursor = get_popular_quizzes(after=request.args.get('after'), limit=limit)
+    elif feed == 'discover':
+        quizzes, next_cursor = get_public_quizzes(after=after, limit=limit)
+    elif feed == 'my_sets':
+        quizzes, next_cursor = get_quizzes_by_user(g.user.id, after=after, limit=limit)
+    elif feed == 'favorites':
+        quizzes, next_cursor = get_favorites_for_user(g.user.id, after=after, limit=limit)
+    else:
+        abort(404)
+
+    return jsonify({'quizzes': [quiz_card_json(q) for q in quizzes], 'next': next_cursor})
 
 @app.route('/play/<int:quiz_id>')
 def play_quiz(quiz_id):
     if not g.user:
         return redirect(url_for('login'))
 
-    quiz = get_quiz_by_id(quiz_id)
-    if not quiz:
+    # A página não traz as perguntas: carrega-as de questions_json (URL com a versão)
+    def build():
+        quiz = get_quiz_by_id(quiz_id, with_questions=False)
+        if not quiz:
+            return None
+        etag = f"play-{quiz.id}-v{quiz.version}-{TEMPLATES_DIGEST}"
+        return etag, render_template('play_quiz_form.html', quiz=quiz)
+
+    cached = fragment_cache.get_or_build(('play', quiz_id, fragment_cache.version(f'quiz:{quiz_id}')), build)
+    if cached is None:
         return "Quiz não encontrado.", 404
+    etag, html = cached
+    return conditional_response(html, etag)
 
-    # questions already attached in get_quiz_by_id
-    questions = []
-    for q in quiz.questions:
-        questions.append({
-            'id': q.id,
-            'question_text': q.question_text,
-            'option_a': q.option_a,
-            'option_b': q.option_b,
-            'option_c': q.option_c,
-            'option_d': q.option_d,
-            'correct_option': q.correct_option
-        })
-    return render_template('play_quiz_form.html', quiz=quiz, questions=questions)
+@app.route('/play/<int:quiz_id>/questions.json')
+def play_quiz_questions(quiz_id):
+    """Perguntas (sem respostas) em formato compacto: [id, texto, a, b, c, d].
+
+    Com ?v=<versão atual> a resposta é imutável e fica na cache do browser.
+    """
+    if not g.user:
+        return jsonify({'error': 'Não autenticado'}), 401
+
+    def build():
+        quiz = get_quiz_by_id(quiz_id)
+        if not quiz:
+            return None
+        payload = {
+            'v': quiz.version,
+            'q': [[q.id, q.question_text, q.option_a, q.option_b, q.option_c, q.option_d]
+                  for q in quiz.questions],
+        }
+        return quiz.version, json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+
+    cached = fragment_cache.get_or_build(('play_json', quiz_id, fragment_cache.version(f'quiz:{quiz_id}')), build)
+    if cached is None:
+        return jsonify({'error': 'Quiz não encontrado'}), 404
+    version, body = cached
+
+    resp = conditional_response(body, f"questions-{quiz_id}-v{version}", mimetype='application/json')
+    if request.args.get('v', type=int) == version:
+        resp.cache_control.no_cache = None
+        resp.cache_control.max_age = 31536000
+        resp.cache_control.immutable = True
+    return resp
 
 @app.route('/dashboard/quiz/<int:quiz_id>')
 def quiz_detail(quiz_id):
-    quiz = get_quiz_by_id(quiz_id)
-    if not quiz:
-        return "Quiz não encontrado.", 404
-
     is_favorited = False
     if g.user:
-        fav = get_favorite(g.user.id, quiz.id)
+        fav = get_favorite(g.user.id, quiz_id)
         is_favorited = fav is not None
 
-    creator = get_user_by_id(quiz.created_by)
-    return render_template(
-        "quiz_detail.html",
-        quiz=quiz,
-        creator=creator,
-        is_favorited=is_favorited
-    )
+    # Só duas variantes por quiz: com e sem favorito
+    def build():
+        quiz = get_quiz_by_id(quiz_id)
+        if not quiz:
+            return None
+        creator = get_user_by_id(quiz.created_by)
+        etag = f"detail-{quiz.id}-v{quiz.version}-{int(is_favorited)}-{TEMPLATES_DIGEST}"
+        return etag, render_template(
+            "quiz_detail.html",
+            quiz=quiz,
+            creator=creator,
+            is_favorited=is_favorited
+        )
+
+    key = ('quiz_detail', quiz_id, is_favorited, fragment_cache.version(f'quiz:{quiz_id}'))
+    cached = fragment_cache.get_or_build(key, build)
+    if cached is None:
+        return "Quiz não encontrado.", 404
+    etag, html = cached
+    return conditional_response(html, etag)
+
+@app.route('/dashboard/quiz/<int:quiz_id>/leaderboard')
+def quiz_leaderboard(quiz_id):
+    # fora da página em cache: muda a cada tentativa e "me" é de cada utilizador
+    return jsonify(get_leaderboard(quiz_id, user_id=g.user.id if g.user else None))
 
 @app.route('/dashboard/edit_quiz/<int:quiz_id>', methods=['GET', 'POST'])
 def edit_quiz(quiz_id):
     if not g.user:
         return redirect(url_for('login'))
 
-    quiz = get_quiz_by_id(quiz_id)
+    quiz = get_quiz_by_id(quiz_id, with_questions=False)
     if not quiz:
         return "Quiz não encontrado.", 404
     if quiz.created_by != g.user.id:
@@ -694,14 +4580,18 @@ def edit_quiz(quiz_id):
         is_public = bool(request.form.get('is_public'))
 
         cover_image = request.files.get('cover_image')
-        cover_image_url = None
+        cover_image_url = cover_bytes = None
         if cover_image and allowed_file(cover_image.filename):
-            filename = f"{uuid.uuid4().hex}_{secure_filename(cover_image.filename)}"
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            cover_image.save(filepath)
-            cover_image_url = f'/static/uploads/{filename}'
+            try:
+                # a capa atual vai ser substituída: não conta para a quota
+                cover_image_url, cover_bytes = save_cover_upload(
+                    cover_image, upload_allowance(g.user.id, exclude_quiz_id=quiz.id))
+            except UploadQuotaExceeded:
+                return render_template('edit_quiz_form.html', quiz=quiz, active_page='my_sets',
+                                       message='Sem espaço para esta imagem: apaga capas antigas ou escolhe uma mais pequena.')
 
-        update_quiz(quiz.id, title=title, description=description, is_public=is_public, cover_image_url=cover_image_url)
+        update_quiz(quiz.id, title=title, description=description, is_public=is_public,
+                    cover_image_url=cover_image_url, cover_bytes=cover_bytes)
         return redirect(url_for('my_sets'))
 
     return render_template('edit_quiz_form.html', quiz=quiz, active_page='my_sets')
@@ -711,7 +4601,7 @@ def delete_quiz(quiz_id):
     if not g.user:
         return redirect(url_for('login'))
 
-    quiz = get_quiz_by_id(quiz_id)
+    quiz = get_quiz_by_id(quiz_id, with_questions=False)
     if not quiz:
         return "Quiz não encontrado.", 404
     if quiz.created_by != g.user.id:
@@ -725,7 +4615,7 @@ def toggle_favorite(quiz_id):
     if not g.user:
         return jsonify({'success': False, 'error': 'Não autenticado'}), 401
 
-    quiz = get_quiz_by_id(quiz_id)
+    quiz = get_quiz_by_id(quiz_id, with_questions=False)
     if not quiz:
         return jsonify({'success': False, 'error': 'Quiz não encontrado'}), 404
 
@@ -742,33 +4632,41 @@ def favorites():
     if not g.user:
         return redirect(url_for('login'))
 
-    favorites = get_favorites_for_user(g.user.id)
-    return render_template('favorites.html', quizzes=favorites, active_page='favorites')
+    user_id = g.user.id
+    after = request.args.get('after', type=int)
+
+    def build():
+        favorites, next_cursor = get_favorites_for_user(user_id, after=after)
+        return render_template('favorites.html', quizzes=favorites, next_cursor=next_cursor, active_page='favorites')
+
+    key = ('favorites', user_id, after,
+           fragment_cache.version('quizzes'), fragment_cache.version(f'favorites:{user_id}'))
+    return fragment_cache.get_or_build(key, build)
 
 @app.route('/dashboard/submit_quiz/<int:quiz_id>', methods=['POST'])
 def submit_quiz(quiz_id):
     if not g.user:
         return jsonify({'error': 'Não autenticado'}), 401
 
-    quiz = get_quiz_by_id(quiz_id)
-    if not quiz:
+    answer_key = get_answer_key(quiz_id)
+    if not answer_key and not get_quiz_by_id(quiz_id, with_questions=False):
         return jsonify({'error': 'Quiz não encontrado'}), 404
 
-    respostas = request.get_json() or {}
-    score = 0
-    for q in quiz.questions:
-        resposta_user = respostas.get(f"q{q.id}")
-        if resposta_user and resposta_user == q.correct_option:
-            score += 1
+    respostas = request.get_json(silent=True) or {}
+    if not isinstance(respostas, dict):
+        return jsonify({'error': 'Respostas inválidas'}), 400
+    answers = {f"q{qid}": respostas.get(f"q{qid}") for qid in answer_key}
+    score = grade_answers(answer_key, answers)
+    record_attempt(g.user.id, quiz_id, score, len(answer_key), answers)
 
-    return jsonify({'score': score, 'total': len(quiz.questions)})
+    return jsonify({'score': score, 'total': len(answer_key)})
 
 @app.route('/dashboard/finish_quiz/<int:quiz_id>', methods=['POST'])
 def finish_quiz(quiz_id):
     if not g.user:
         return redirect(url_for('login'))
 
-    quiz = get_quiz_by_id(quiz_id)
+    quiz = get_quiz_by_id(quiz_id, with_questions=False)
     if not quiz:
         return "Quiz não encontrado.", 404
     if quiz.created_by != g.user.id:
@@ -792,11 +4690,15 @@ def save_avatar():
 
     if accessory is not None:
         accessory_clean = str(accessory).replace('.png', '')
+        if not valid_avatar_option('accessories', accessory_clean):
+            return jsonify({'success': False, 'error': 'Acessório inválido'}), 400
     else:
         accessory_clean = None
 
     if outfit is not None:
         outfit_clean = str(outfit).replace('.png', '')
+        if not valid_avatar_option('clothes', outfit_clean):
+            return jsonify({'success': False, 'error': 'Roupa inválida'}), 400
     else:
         outfit_clean = None
 
@@ -804,9 +4706,256 @@ def save_avatar():
     avatar = get_avatar_by_user_id(g.user.id)
     return jsonify({'success': True, 'avatar': {
         'accessory': avatar.accessory,
-        'outfit': avatar.outfit
+        'outfit': avatar.outfit,
+        'url': avatar_url(avatar.outfit, avatar.accessory),
     }})
 
+# -----------------------------------------------------------------------------
+# Salas ao vivo
+# -----------------------------------------------------------------------------
+@app.route('/live', methods=['GET', 'POST'])
+def live_join():
+    if not g.user:
+        return redirect(url_for('login'))
+    message = None
+    if request.method == 'POST':
+        room = live_rooms.get(request.form.get('code'))
+        if room:
+            return redirect(url_for('live_room', code=room.code))
+        message = 'Não existe nenhuma sala com esse código.'
+    return render_template('live_join.html', message=message, active_page='live')
+
+@app.route('/live/new/<int:quiz_id>', methods=['POST'])
+def live_create(quiz_id):
+    if not g.user:
+        return redirect(url_for('login'))
+    quiz = get_quiz_by_id(quiz_id)
+    if not quiz or not (quiz.is_public or quiz.created_by == g.user.id):
+        return "Quiz não encontrado.", 404
+    if not quiz.questions:
+        return "O quiz não tem perguntas.", 400
+    room = live_rooms.create(quiz, quiz.questions, g.user.id)
+    return redirect(url_for('live_room', code=room.code))
+
+@app.route('/live/<code>')
+def live_room(code):
+    if not g.user:
+        return redirect(url_for('login'))
+    room = live_rooms.get(code)
+    if room is None:
+        return render_template('live_join.html', message='A sala já terminou ou não existe.',
+                               active_page='live'), 404
+    if not room.join(g.user):
+        return render_template('live_join.html', message='A sala está cheia.', active_page='live'), 409
+    return render_template('live_room.html', room=room, is_host=room.host_id == g.user.id)
+
+@app.route('/live/<code>/events')
+def live_events(code):
+    if not g.user:
+        return jsonify({'error': 'Não autenticado'}), 401
+    room = live_rooms.get(code)
+    if room is None:
+        return jsonify({'error': 'Sala não encontrada'}), 404
+    if not room.is_member(g.user.id):
+        return jsonify({'error': 'Não estás nesta sala'}), 403
+    if not live_rooms.acquire_stream():
+        return jsonify({'error': 'Demasiadas ligações'}), 503
+
+    last_seq = request.headers.get('Last-Event-ID', type=int)
+    # o gerador não usa g nem a base de dados: a ligação do pedido já foi devolvida
+    response = Response(room.stream(g.user.id, last_seq), mimetype='text/event-stream')
+    response.call_on_close(live_rooms.release_stream)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'   # nginx: não acumular o stream
+    return response
+
+@app.route('/live/<code>/answer', methods=['POST'])
+def live_answer(code):
+    if not g.user:
+        return jsonify({'error': 'Não autenticado'}), 401
+    room = live_rooms.get(code)
+    if room is None:
+        return jsonify({'error': 'Sala não encontrada'}), 404
+    if g.user.id not in room.players:
+        return jsonify({'error': 'Não estás nesta sala'}), 403
+    data = request.get_json(silent=True) or {}
+    index = data.get('index')
+    if not isinstance(index, int):
+        return jsonify({'error': 'Pergunta inválida'}), 400
+    result = room.answer(g.user.id, index, str(data.get('option', '')).upper())
+    if result != 'ok':
+        return jsonify({'accepted': False, 'reason': result}), 409
+    return jsonify({'accepted': True})
+
+@app.route('/live/<code>/next', methods=['POST'])
+def live_next(code):
+    if not g.user:
+        return jsonify({'error': 'Não autenticado'}), 401
+    room = live_rooms.get(code)
+    if room is None:
+        return jsonify({'error': 'Sala não encontrada'}), 404
+    if room.host_id != g.user.id:
+        return jsonify({'error': 'Só o anfitrião controla a sala'}), 403
+    if room.advance():
+        # fim do jogo: cada jogador fica com uma tentativa no histórico
+        for user_id, correct, answers in room.results():
+            record_attempt(user_id, room.quiz_id, correct, len(room.questions), answers)
+    return jsonify({'state': room.state, 'index': room.index})
+
+# -----------------------------------------------------------------------------
+# CLI (flask --app app <comando>)
+# -----------------------------------------------------------------------------
+@app.cli.command('init-db')
+def init_db_command():
+    """Cria as tabelas e índices em falta."""
+    init_db()
+    print('Base de dados inicializada.')
+
+@app.cli.command('reindex-search')
+def reindex_search_command():
+    """Reconstrói o índice de pesquisa de todos os quizzes."""
+    total = reindex_all_quizzes()
+    print(f'{total} quizzes indexados.')
+
+@app.cli.command('import-questions')
+@click.argument('quiz_id', type=int)
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'json', 'jsonl']), help='Por omissão, pela extensão.')
+@click.option('--strict', is_flag=True, help='Cancela tudo se alguma linha for inválida.')
+def import_questions_command(quiz_id, path, fmt, strict):
+    """Importa perguntas de um ficheiro CSV/JSON para o quiz QUIZ_ID."""
+    fmt = fmt or import_format_for(path)
+    if fmt is None:
+        raise click.UsageError('Indica --format (csv, json ou jsonl).')
+    if not get_quiz_by_id(quiz_id, with_questions=False):
+        raise click.UsageError(f'Quiz {quiz_id} não existe.')
+
+    started = time.perf_counter()
+    with open(path, 'rb') as f:
+        report = import_questions(quiz_id, parse_question_rows(f, fmt), strict=strict)
+    elapsed = time.perf_counter() - started
+
+    for err in report['errors']:
+        print(f"linha {err['row']}: {err['error']}")
+    print(f"{report['imported']} perguntas importadas, {report['error_count']} linhas com erros ({elapsed:.2f}s).")
+
+@app.cli.command('export')
+@click.argument('path', default='-', type=click.Path(dir_okay=False, allow_dash=True))
+def export_command(path):
+    """Exporta utilizadores, avatares, quizzes, perguntas e favoritos para PATH (NDJSON; '-' = stdout)."""
+    counts = {}
+    started = time.perf_counter()
+    with click.open_file(path, 'w', encoding='utf-8') as f:
+        for chunk in export_ndjson(counts):
+            f.write(chunk)
+    summary = ', '.join(f'{n} {kind}' for kind, n in counts.items()) or 'nada'
+    click.echo(f'Exportado: {summary} ({time.perf_counter() - started:.2f}s).', err=True)
+
+@app.cli.command('import')
+@click.argument('path', type=click.Path(dir_okay=False, allow_dash=True, exists=True))
+def import_command(path):
+    """Restaura uma exportação NDJSON (de `flask export`) numa base vazia."""
+    started = time.perf_counter()
+    with click.open_file(path, 'r', encoding='utf-8') as f:
+        try:
+            counts = restore_ndjson(f)
+        except RestoreError as e:
+            raise click.ClickException(str(e))
+    summary = ', '.join(f'{n} {kind}' for kind, n in counts.items()) or 'nada'
+    click.echo(f'Restaurado: {summary} ({time.perf_counter() - started:.2f}s).', err=True)
+
+@app.cli.command('send-mail')
+def send_mail_command():
+    """Envia já tudo o que está em atraso na caixa de saída (ex.: a partir do cron)."""
+    total = 0
+    while True:
+        handled = mail_sender.send_due()
+        if not handled:
+            break
+        total += handled
+    print(f"{total} e-mails processados: {mail_sender.stats()}")
+
+@app.cli.command('process-covers')
+def process_covers_command():
+    """Gera as variantes WebP em falta para as capas já existentes."""
+    rows = execute_query("SELECT DISTINCT cover_image_url FROM quizzes WHERE cover_image_url IS NOT NULL",
+                         fetchall=True) or []
+    created = missing = 0
+    for row in rows:
+        path = os.path.join(app.static_folder, row['cover_image_url'][len('/static/'):])
+        if not os.path.exists(path):
+            missing += 1
+            continue
+        try:
+            created += make_cover_variants(path)
+        except Exception as e:
+            print(f"{row['cover_image_url']}: {e}")
+    print(f'{len(rows)} capas, {created} variantes criadas, {missing} ficheiros em falta.')
+
+@app.cli.command('gc-uploads')
+@click.option('--grace', type=int, default=UPLOAD_GC_GRACE, show_default=True,
+              help='Segundos durante os quais um ficheiro novo nunca é apagado.')
+@click.option('--batch-size', type=int, default=UPLOAD_GC_BATCH, show_default=True)
+@click.option('--dry-run', is_flag=True, help='Só mostra o que seria apagado.')
+def gc_uploads_command(grace, batch_size, dry_run):
+    """Apaga de static/uploads os ficheiros que nenhum quiz usa."""
+    stats = collect_orphaned_uploads(grace=grace, batch_size=batch_size, dry_run=dry_run)
+    verb = 'a apagar' if dry_run else 'apagados'
+    print(f"{stats['scanned']} ficheiros, {stats['orphans']} órfãos, {stats['deleted']} {verb} "
+          f"({stats['bytes_freed'] / 1024 / 1024:.1f} MB), {stats['recent']} recentes ignorados, "
+          f"{stats['cover_bytes_refreshed']} tamanhos atualizados.")
+
+@app.cli.command('storage-usage')
+@click.option('--top', type=int, default=20, show_default=True)
+def storage_usage_command(top):
+    """Espaço ocupado pelas capas, por utilizador."""
+    for row in storage_usage_by_user(top):
+        print(f"{row['username']:<24} {row['covers']:>5} capas {int(row['bytes'] or 0) / 1024 / 1024:>9.2f} MB")
+
+@app.cli.command('reconcile-counters')
+@click.option('--batch-size', type=int, default=COUNTER_RECONCILE_BATCH, show_default=True)
+def reconcile_counters_command(batch_size):
+    """Recalcula question_count/favorite_count dos quizzes e corrige os que divergem."""
+    stats = reconcile_quiz_counters(batch_size=batch_size)
+    print(f"{stats['scanned']} quizzes verificados, {stats['repaired']} corrigidos.")
+
+@app.cli.command('rebuild-leaderboards')
+def rebuild_leaderboards_command():
+    """Recalcula os melhores resultados e os pontos a partir de todas as tentativas."""
+    print(f"{rebuild_leaderboards()} melhores resultados recalculados.")
+
+@app.cli.command('cache-server')
+@click.option('--socket', 'path', default=CACHE_SOCKET, show_default=True)
+@click.option('--max-entries', type=int, default=CACHE_SERVER_MAX, show_default=True)
+def cache_server_command(path, max_entries):
+    """Servidor de cache partilhado pelos workers desta máquina (CACHE_BACKEND=local)."""
+    server = LocalCacheServer(path, max_entries)
+    print(f'Cache à escuta em {path}')
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+@app.cli.command('compress-static')
+def compress_static_command():
+    """Gera as variantes .gz/.br dos ficheiros estáticos (correr em cada deploy)."""
+    written = compress_static_files()
+    note = '' if brotli else ' (sem o módulo brotli: só .gz)'
+    print(f'{written} ficheiros comprimidos{note}.')
+
+@app.cli.command('build-avatars')
+def build_avatars_command():
+    """Gera já todas as combinações de avatar e o sprite sheet do editor."""
+    build_avatar_sprite()
+    total = 0
+    for outfit in avatar_options('clothes'):
+        for accessory in avatar_options('accessories'):
+            build_avatar(outfit, accessory)
+            total += 1
+    print(f'{total} avatares e sprite sheet em {AVATAR_FOLDER}.')
+
 # -----------------------------------------------------------------------------
 # Start
 # -----------------------------------------------------------------------------
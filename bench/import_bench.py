@@ -0,0 +1,84 @@
+"""Compara adicionar perguntas uma a uma (POST /dashboard/add_questions) com a
+importação em massa (POST /dashboard/import_questions), numa base SQLite temporária.
+
+    python bench/import_bench.py --questions 200 2000
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as sabio  # noqa: E402
+
+
+def make_client():
+    sabio.DB_PATH = os.path.join(tempfile.mkdtemp(prefix="sabio-import-"), "bench.db")
+    sabio._pool = None
+    sabio.init_db()
+    client = sabio.app.test_client()
+    client.post("/register", data={"username": "bench", "email": "bench@x", "password": "pw"})
+    client.post("/login", data={"identifier": "bench", "password": "pw"})
+    return client
+
+
+def new_quiz(client):
+    r = client.post("/dashboard/create_quiz", data={"title": "Bench", "description": "", "is_public": "1"})
+    return int(r.headers["Location"].rstrip("/").split("/")[-1])
+
+
+def question(i):
+    return {
+        "question_text": f"Pergunta número {i}?",
+        "option_a": "a", "option_b": "b", "option_c": "c", "option_d": "d",
+        "correct_option": "ABCD"[i % 4],
+    }
+
+
+def per_question(client, n):
+    quiz_id = new_quiz(client)
+    started = time.perf_counter()
+    for i in range(n):
+        client.post(f"/dashboard/add_questions/{quiz_id}", data=question(i))
+    return time.perf_counter() - started
+
+
+def bulk(client, n):
+    quiz_id = new_quiz(client)
+    payload = "\n".join(json.dumps(question(i)) for i in range(n)).encode()
+    started = time.perf_counter()
+    r = client.post(
+        f"/dashboard/import_questions/{quiz_id}",
+        data={"file": (io.BytesIO(payload), "questions.jsonl")},
+        content_type="multipart/form-data",
+    )
+    elapsed = time.perf_counter() - started
+    assert r.json["imported"] == n, r.json
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", type=int, nargs="+", default=[200, 2000])
+    args = parser.parse_args()
+
+    client = make_client()
+    results = []
+    for n in args.questions:
+        one_by_one = per_question(client, n)
+        batched = bulk(client, n)
+        results.append({
+            "questions": n,
+            "per_question_s": round(one_by_one, 3),
+            "bulk_s": round(batched, 3),
+            "speedup": round(one_by_one / batched, 1),
+        })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
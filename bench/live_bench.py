@@ -0,0 +1,239 @@
+"""Teste de carga das salas ao vivo: centenas de streams SSE num só processo.
+
+Arranca um servidor werkzeug local com threads, abre uma sala com o anfitrião
+e liga --players jogadores, cada um com o seu stream SSE (http.client). Em cada
+pergunta o anfitrião avança, os jogadores respondem assim que a recebem e no
+fim mede-se quanto tempo cada evento demorou a chegar a todos (fan-out), a
+latência das respostas e quantos eventos se perderam.
+
+    python bench/live_bench.py --players 300 --questions 5
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as sabio  # noqa: E402
+
+HOST_ID = 1
+
+
+def seed(db_path, args):
+    sabio.DB_PATH = db_path
+    sabio._pool = None
+    sabio.init_db()
+    conn = sabio.sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO users (id, username, email, password_hash) VALUES (?, ?, ?, '-')",
+        ((i, f"user{i}", f"user{i}@bench") for i in range(1, args.players + 2)),
+    )
+    conn.execute("INSERT INTO quizzes (id, title, description, is_public, created_by) VALUES (1, 'Ao vivo', '', 1, ?)",
+                 (HOST_ID,))
+    conn.executemany(
+        "INSERT INTO questions (quiz_id, question_text, option_a, option_b, option_c, option_d, correct_option) "
+        "VALUES (1, ?, 'a', 'b', 'c', 'd', ?)",
+        ((f"Pergunta {i}?", "ABCD"[i % 4]) for i in range(args.questions)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def session_cookie(uid):
+    serializer = sabio.app.session_interface.get_signing_serializer(sabio.app)
+    return f"{sabio.app.config['SESSION_COOKIE_NAME']}={serializer.dumps({'user_id': uid})}"
+
+
+class Server:
+    def __init__(self):
+        from werkzeug.serving import make_server
+
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        self.server = make_server("127.0.0.1", 0, sabio.app, threaded=True)
+        self.port = self.server.server_port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def request(self, uid, method, path, payload=None):
+        headers = {"Cookie": session_cookie(uid)}
+        body = None
+        if payload is not None:
+            body = json.dumps(payload)
+            headers["Content-Type"] = "application/json"
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+            return response.status, response.getheader("Location"), data
+        finally:
+            conn.close()
+
+    def close(self):
+        self.server.shutdown()
+
+
+class Player(threading.Thread):
+    """Lê o stream SSE e responde a cada pergunta."""
+
+    def __init__(self, server, uid, code, rng, think_time):
+        super().__init__(daemon=True)
+        self.server, self.uid, self.code = server, uid, code
+        self.rng = random.Random(rng.random())
+        self.think_time = think_time
+        self.received = {}        # (evento, índice) -> instante de chegada
+        self.answer_latencies = []
+        self.rejected = 0
+        self.errors = 0
+        self.connected = threading.Event()
+        self.connect_time = None
+
+    def events(self, response):
+        name, data = None, []
+        while True:
+            line = response.readline()
+            if not line:
+                return
+            line = line.decode().rstrip("\r\n")
+            if not line:
+                if name:
+                    yield name, "\n".join(data)
+                name, data = None, []
+            elif line.startswith("event:"):
+                name = line[6:].strip()
+            elif line.startswith("data:"):
+                data.append(line[5:].strip())
+
+    def answer(self, index):
+        time.sleep(self.rng.random() * self.think_time)
+        started = time.perf_counter()
+        status, _, _ = self.server.request(self.uid, "POST", f"/live/{self.code}/answer",
+                                           {"index": index, "option": self.rng.choice("ABCD")})
+        self.answer_latencies.append(time.perf_counter() - started)
+        if status != 200:
+            self.rejected += 1
+
+    def run(self):
+        try:
+            self.server.request(self.uid, "GET", f"/live/{self.code}")
+            started = time.perf_counter()
+            conn = http.client.HTTPConnection("127.0.0.1", self.server.port, timeout=120)
+            conn.request("GET", f"/live/{self.code}/events", headers={"Cookie": session_cookie(self.uid)})
+            response = conn.getresponse()
+            for name, data in self.events(response):
+                now = time.perf_counter()
+                if name == "snapshot":
+                    self.connect_time = now - started
+                    self.connected.set()
+                elif name in ("question", "reveal"):
+                    index = json.loads(data)["index"]
+                    self.received[(name, index)] = now
+                    if name == "question":
+                        threading.Thread(target=self.answer, args=(index,), daemon=True).start()
+                elif name == "finished":
+                    self.received[("finished", 0)] = now
+                    break
+            conn.close()
+        except Exception:
+            self.errors += 1
+            self.connected.set()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def latency(values):
+    return {
+        "p50": round(percentile(values, 50) * 1000, 2),
+        "p95": round(percentile(values, 95) * 1000, 2),
+        "p99": round(percentile(values, 99) * 1000, 2),
+        "max": round(max(values, default=0) * 1000, 2),
+    }
+
+
+def wait_for(players, key, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if all(key in p.received or p.errors for p in players):
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--players", type=int, default=300)
+    parser.add_argument("--questions", type=int, default=5)
+    parser.add_argument("--think-time", type=float, default=2.0, help="atraso máximo (s) de cada resposta")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    sabio.app.logger.disabled = True
+    sabio.ATTEMPT_WRITE_BEHIND = True
+    seed(os.path.join(tempfile.mkdtemp(prefix="sabio-live-"), "bench.db"), args)
+    server = Server()
+    try:
+        _, location, _ = server.request(HOST_ID, "POST", "/live/new/1")
+        code = location.rstrip("/").split("/")[-1]
+
+        rng = random.Random(args.seed)
+        players = [Player(server, uid, code, rng, args.think_time) for uid in range(2, args.players + 2)]
+        for p in players:
+            p.start()
+        for p in players:
+            p.connected.wait(60)
+        peak_threads = threading.active_count()
+
+        fanout = {"question": [], "reveal": []}
+        incomplete = 0
+        started = time.perf_counter()
+        for index in range(args.questions):
+            for event in ("question", "reveal"):
+                if event == "reveal":
+                    time.sleep(args.think_time + 0.5)   # tempo para todos responderem
+                sent = time.perf_counter()
+                server.request(HOST_ID, "POST", f"/live/{code}/next")
+                if not wait_for(players, (event, index), 30):
+                    incomplete += 1
+                fanout[event] += [p.received[(event, index)] - sent for p in players if (event, index) in p.received]
+        server.request(HOST_ID, "POST", f"/live/{code}/next")
+        wait_for(players, ("finished", 0), 30)
+        elapsed = time.perf_counter() - started
+        for p in players:
+            p.join(5)
+
+        answers = [x for p in players for x in p.answer_latencies]
+        expected = args.players * args.questions
+        output = {
+            "players": args.players,
+            "questions": args.questions,
+            "streams_connected": sum(1 for p in players if p.connect_time is not None),
+            "stream_errors": sum(p.errors for p in players),
+            "peak_threads": peak_threads,
+            "connect_ms": latency([p.connect_time for p in players if p.connect_time is not None]),
+            "fanout_ms": {event: latency(values) for event, values in fanout.items()},
+            "events_missed": 2 * expected - sum(len(v) for v in fanout.values()),
+            "rounds_incomplete": incomplete,
+            "answers": {"sent": len(answers), "expected": expected,
+                        "rejected": sum(p.rejected for p in players), "latency_ms": latency(answers)},
+            "game_s": round(elapsed, 2),
+            "server": sabio.live_rooms.stats(),
+        }
+    finally:
+        server.close()
+    print(json.dumps(output, indent=2))
+
+
+if __name__ == "__main__":
+    main()
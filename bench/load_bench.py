@@ -0,0 +1,314 @@
+"""Benchmark de carga das rotas principais com um dataset semeado e reprodutível.
+
+Cria uma base SQLite temporária com init_db(), semeia utilizadores, quizzes,
+perguntas e favoritos e mede as rotas reais através do test client do Flask
+(ou de um servidor HTTP local com várias threads, --driver http). O resultado
+é JSON com throughput, p50/p95/p99 e queries por request (lidas do cabeçalho
+Server-Timing); pode ser gravado como baseline e comparado em corridas futuras.
+
+    python bench/load_bench.py --users 10000 --quizzes 50000 --questions 500000 --favorites 1000000
+    python bench/load_bench.py --save-baseline bench/baseline.json
+    python bench/load_bench.py --baseline bench/baseline.json --tolerance 0.2
+    python bench/load_bench.py --driver http --threads 8
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as sabio  # noqa: E402
+
+PASSWORD = "bench-pw"
+SCENARIOS = ("login", "discover", "search", "play", "submit", "favorite")
+WORDS = (
+    "rio serra capital europa historia reis batalha ciencia celula atomo energia planeta "
+    "matematica algebra geometria verbo poema autor livro musica arte futebol animal oceano"
+).split()
+QUERIES_RE = re.compile(r'db;desc="(\d+) queries"')
+
+
+def seed(db_path, args):
+    rng = random.Random(args.seed)
+    sabio.DB_PATH = db_path
+    sabio._pool = None
+    sabio.init_db()
+
+    # Um único hash para todos: semear 10k scrypts demoraria minutos.
+    password_hash = sabio.generate_password_hash(PASSWORD)
+    conn = sabio.sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO users (id, username, email, password_hash) VALUES (?, ?, ?, ?)",
+        ((i, f"user{i}", f"user{i}@bench", password_hash) for i in range(1, args.users + 1)),
+    )
+    conn.executemany(
+        "INSERT INTO quizzes (id, title, description, is_public, created_by) VALUES (?, ?, ?, ?, ?)",
+        (
+            (i, " ".join(rng.choices(WORDS, k=3)), " ".join(rng.choices(WORDS, k=8)),
+             int(rng.random() < 0.8), rng.randint(1, args.users))
+            for i in range(1, args.quizzes + 1)
+        ),
+    )
+    conn.executemany(
+        "INSERT INTO questions (quiz_id, question_text, option_a, option_b, option_c, option_d, correct_option) "
+        "VALUES (?, ?, 'a', 'b', 'c', 'd', ?)",
+        (
+            (rng.randint(1, args.quizzes), " ".join(rng.choices(WORDS, k=10)) + "?", rng.choice("ABCD"))
+            for _ in range(args.questions)
+        ),
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO favorites (user_id, quiz_id) VALUES (?, ?)",
+        ((rng.randint(1, args.users), rng.randint(1, args.quizzes)) for _ in range(args.favorites)),
+    )
+    conn.commit()
+    counts = {
+        table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        for table in ("users", "quizzes", "questions", "favorites")
+    }
+    public_ids = [row[0] for row in conn.execute("SELECT id FROM quizzes WHERE is_public = 1")]
+    conn.close()
+
+    sabio.reindex_all_quizzes()
+    # as inserções diretas não mexem em question_count/favorite_count
+    sabio.reconcile_quiz_counters()
+    return counts, public_ids
+
+
+def make_plan(args, public_ids):
+    """Lista fixa de (cenário, utilizador, método, caminho, corpo) para a mesma seed."""
+    rng = random.Random(args.seed + 1)
+    answer_keys = {}
+    plan = []
+    for scenario in args.scenarios:
+        n = args.login_requests if scenario == "login" else args.requests
+        for _ in range(n):
+            uid = rng.randint(1, args.users)
+            quiz_id = rng.choice(public_ids)
+            if scenario == "login":
+                plan.append((scenario, None, "POST", "/login",
+                             {"form": {"identifier": f"user{uid}", "password": PASSWORD}}))
+            elif scenario == "discover":
+                plan.append((scenario, uid, "GET", "/dashboard/discover", None))
+            elif scenario == "search":
+                plan.append((scenario, uid, "GET", f"/dashboard/discover?q={rng.choice(WORDS)[:5]}", None))
+            elif scenario == "play":
+                plan.append((scenario, uid, "GET", f"/play/{quiz_id}", None))
+            elif scenario == "submit":
+                if quiz_id not in answer_keys:
+                    answer_keys[quiz_id] = sabio.get_answer_key(quiz_id)
+                answers = {f"q{qid}": rng.choice("ABCD") for qid in answer_keys[quiz_id]}
+                plan.append((scenario, uid, "POST", f"/dashboard/submit_quiz/{quiz_id}", {"json": answers}))
+            elif scenario == "favorite":
+                plan.append((scenario, uid, "POST", f"/favorite/{quiz_id}", None))
+    return plan
+
+
+def session_cookie(uid):
+    serializer = sabio.app.session_interface.get_signing_serializer(sabio.app)
+    return serializer.dumps({"user_id": uid})
+
+
+class ClientDriver:
+    """Test client do Flask, sequencial: mede o custo da aplicação sem rede."""
+
+    def __init__(self, args):
+        self.client = sabio.app.test_client()
+        self.cookie_name = sabio.app.config["SESSION_COOKIE_NAME"]
+
+    def request(self, uid, method, path, body):
+        if uid is None:
+            self.client.delete_cookie(self.cookie_name)
+        else:
+            self.client.set_cookie(self.cookie_name, session_cookie(uid))
+        kwargs = dict(body or {})
+        if "form" in kwargs:
+            kwargs["data"] = kwargs.pop("form")
+        response = self.client.open(path, method=method, **kwargs)
+        return response.status_code, response.headers.get("Server-Timing", "")
+
+    def run(self, plan):
+        samples = []
+        for scenario, *request in plan:
+            started = time.perf_counter()
+            status, timing = self.request(*request)
+            samples.append((status, timing, scenario, time.perf_counter() - started))
+        return samples
+
+    def close(self):
+        pass
+
+
+class HttpDriver:
+    """Servidor werkzeug local com threads e N clientes HTTP em paralelo."""
+
+    def __init__(self, args):
+        from werkzeug.serving import make_server
+
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        self.threads = args.threads
+        self.server = make_server("127.0.0.1", 0, sabio.app, threaded=True)
+        self.port = self.server.server_port
+        self.cookie_name = sabio.app.config["SESSION_COOKIE_NAME"]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def request(self, uid, method, path, body):
+        headers = {}
+        payload = None
+        if uid is not None:
+            headers["Cookie"] = f"{self.cookie_name}={session_cookie(uid)}"
+        if body and "json" in body:
+            payload = json.dumps(body["json"])
+            headers["Content-Type"] = "application/json"
+        elif body and "form" in body:
+            payload = urlencode(body["form"])
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+        try:
+            conn.request(method, path, body=payload, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            return response.status, response.getheader("Server-Timing", "")
+        finally:
+            conn.close()
+
+    def run(self, plan):
+        def one(item):
+            started = time.perf_counter()
+            status, timing = self.request(*item[1:])
+            return status, timing, item[0], time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            return list(pool.map(one, plan))
+
+    def close(self):
+        self.server.shutdown()
+
+
+def run_scenarios(driver, plan, scenarios):
+    results = {}
+    for scenario in scenarios:
+        items = [item for item in plan if item[0] == scenario]
+        if not items:
+            continue
+        started = time.perf_counter()
+        samples = driver.run(items)
+        wall = time.perf_counter() - started
+        results[scenario] = summarize(samples, wall)
+    return results
+
+
+def percentile(values, p):
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def summarize(samples, wall):
+    latencies = [s[3] * 1000 for s in samples]
+    queries = [int(m.group(1)) for m in (QUERIES_RE.search(s[1]) for s in samples) if m]
+    statuses = {}
+    for status, *_ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "requests": len(samples),
+        "throughput_rps": round(len(samples) / wall, 1),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "max": round(max(latencies), 2),
+        },
+        "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+        "status": statuses,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Regressões: p95 acima ou throughput abaixo da baseline por mais que a tolerância."""
+    report, regressions = {}, []
+    for scenario, current in results.items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if not previous:
+            continue
+        p95_ratio = current["latency_ms"]["p95"] / max(previous["latency_ms"]["p95"], 1e-9)
+        rps_ratio = current["throughput_rps"] / max(previous["throughput_rps"], 1e-9)
+        report[scenario] = {"p95_ratio": round(p95_ratio, 2), "throughput_ratio": round(rps_ratio, 2)}
+        if p95_ratio > 1 + tolerance or rps_ratio < 1 - tolerance:
+            regressions.append(scenario)
+        if (current["queries_per_request"] or 0) > (previous["queries_per_request"] or 0):
+            report[scenario]["queries_per_request"] = [previous["queries_per_request"], current["queries_per_request"]]
+            regressions.append(scenario)
+    return report, sorted(set(regressions))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--quizzes", type=int, default=50_000)
+    parser.add_argument("--questions", type=int, default=500_000)
+    parser.add_argument("--favorites", type=int, default=1_000_000)
+    parser.add_argument("--requests", type=int, default=500, help="pedidos por cenário")
+    parser.add_argument("--login-requests", type=int, default=20, help="o hash da password domina este cenário")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--driver", choices=("client", "http"), default="client")
+    parser.add_argument("--threads", type=int, default=8, help="clientes em paralelo com --driver http")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--baseline", help="JSON de uma corrida anterior para comparar")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--save-baseline", help="grava o resultado neste ficheiro")
+    args = parser.parse_args()
+
+    sabio.app.logger.disabled = True  # o log de queries lentas polui o output
+    sabio.AUTH_THROTTLE = False       # todos os pedidos vêm do mesmo IP
+    db_path = os.path.join(tempfile.mkdtemp(prefix="sabio-load-"), "bench.db")
+    t0 = time.perf_counter()
+    counts, public_ids = seed(db_path, args)
+    seed_s = time.perf_counter() - t0
+
+    plan = make_plan(args, public_ids)
+    driver = (HttpDriver if args.driver == "http" else ClientDriver)(args)
+    try:
+        results = run_scenarios(driver, plan, args.scenarios)
+    finally:
+        driver.close()
+        sabio.attempt_recorder.flush()
+
+    output = {
+        "driver": args.driver,
+        "threads": args.threads if args.driver == "http" else 1,
+        "seed": args.seed,
+        "dataset": counts,
+        "seed_s": round(seed_s, 2),
+        "scenarios": results,
+    }
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report, regressions = compare(results, baseline, args.tolerance)
+        # Só faz sentido comparar corridas com o mesmo driver e o mesmo dataset.
+        mismatched = [k for k in ("driver", "threads", "seed", "dataset") if baseline.get(k) != output[k]]
+        output["baseline"] = {"file": args.baseline, "tolerance": args.tolerance, "mismatched": mismatched,
+                              "comparison": report, "regressions": regressions}
+        exit_code = 1 if regressions else 0
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(output, f, indent=2)
+
+    print(json.dumps(output, indent=2))
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
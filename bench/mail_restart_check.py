@@ -0,0 +1,146 @@
+"""E-mails em espera sobrevivem a um restart: a outbox é enviada sem novo pedido de envio.
+
+1. Um "worker" guarda um e-mail na outbox com o SMTP em baixo: a tentativa
+   falha e a linha fica pendente, em backoff. O processo termina.
+2. Arranca um servidor SMTP de teste (local, em memória).
+3. Um novo processo (o worker depois do deploy) serve um único pedido qualquer
+   (/health) e nada mais; medimos quanto tempo o e-mail demora a chegar.
+
+    python bench/mail_restart_check.py --timeout 15
+"""
+import argparse
+import json
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    """O mínimo de SMTP para o smtplib: guarda cada mensagem em server.messages."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.reply("220 localhost SMTP de teste")
+        envelope = {}
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors="replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb == "EHLO":
+                self.reply("250 localhost")
+            elif verb == "MAIL":
+                envelope = {"from": command[10:], "to": []}
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                envelope.setdefault("to", []).append(command[8:])
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 fim com <CRLF>.<CRLF>")
+                data = []
+                for raw in iter(self.rfile.readline, b""):
+                    if raw in (b".\r\n", b".\n"):
+                        break
+                    data.append(raw)
+                envelope["data"] = b"".join(data).decode(errors="replace")
+                self.server.messages.append((time.perf_counter(), envelope))
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 adeus")
+                return
+            else:   # HELO, RSET, NOOP
+                self.reply("250 OK")
+
+
+class SmtpStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port):
+        super().__init__(("127.0.0.1", port), SmtpHandler)
+        self.messages = []
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def phase(name, db_path, env, timeout):
+    return subprocess.run([sys.executable, __file__, "--phase", name, "--db", db_path],
+                          env=env, timeout=timeout, check=True, capture_output=True, text=True).stdout
+
+
+def run_phase(name, db_path, timeout):
+    sys.path.insert(0, ROOT)
+    import app as sabio
+
+    sabio.DB_PATH = db_path
+    if name == "enqueue":
+        sabio.init_db()
+        sabio.enqueue_mail("ana@example.com", "Recuperar palavra-passe", "Link: http://localhost/reset/x")
+        # espera pela primeira tentativa (falhada: SMTP em baixo) e sai
+        deadline = time.time() + timeout
+        while time.time() < deadline and not sabio.mail_sender.stats()["retried"]:
+            time.sleep(0.05)
+        row = sabio.execute_query("SELECT status, attempts FROM outbox", fetchone=True)
+        print(json.dumps({"stats": sabio.mail_sender.stats(), "row": dict(row)}))
+    else:
+        # o "worker reiniciado": um pedido que não tem nada a ver com e-mail
+        sabio.app.test_client().get("/health")
+        deadline = time.time() + timeout
+        while time.time() < deadline and not sabio.mail_sender.stats()["sent"]:
+            time.sleep(0.05)
+        row = sabio.execute_query("SELECT status, attempts FROM outbox", fetchone=True)
+        print(json.dumps({"stats": sabio.mail_sender.stats(), "row": dict(row)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--timeout", type=float, default=15.0)
+    parser.add_argument("--phase", choices=["enqueue", "serve"], help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.phase:
+        run_phase(args.phase, args.db, args.timeout)
+        return
+
+    port = free_port()
+    db_path = os.path.join(tempfile.mkdtemp(prefix="sabio-mail-"), "mail.db")
+    env = dict(os.environ, MAIL_SERVER="127.0.0.1", MAIL_PORT=str(port), MAIL_USE_TLS="0", MAIL_USE_SSL="0",
+               EMAIL_USER="sabio@localhost", EMAIL_PASS="", MAIL_POLL_INTERVAL="0.2", MAIL_RETRY_BASE="1")
+
+    before = json.loads(phase("enqueue", db_path, env, args.timeout + 10))
+
+    server = SmtpStandIn(port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    started = time.perf_counter()
+    after = json.loads(phase("serve", db_path, env, args.timeout + 10))
+    server.shutdown()
+
+    delivered = [envelope for _, envelope in server.messages]
+    report = {
+        "before_restart": before,
+        "after_restart": after,
+        "delivered": len(delivered),
+        "recipients": [to for envelope in delivered for to in envelope["to"]],
+        "seconds_to_delivery": round(server.messages[0][0] - started, 2) if server.messages else None,
+        "ok": after["row"]["status"] == "sent" and len(delivered) == 1,
+    }
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report["ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()
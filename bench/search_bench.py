@@ -0,0 +1,124 @@
+"""Benchmark da pesquisa full-text (FTS5) com um catálogo grande.
+
+Cria uma base de dados SQLite temporária, semeia N quizzes com perguntas,
+reconstrói o índice e mede a latência de search_quizzes().
+
+    python bench/search_bench.py --quizzes 100000 --queries 500
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as sabio  # noqa: E402
+
+WORDS = (
+    "rio serra capital europa historia reis batalha descobrimentos ciencia celula atomo "
+    "energia planeta sistema solar matematica algebra geometria fracao equacao verbo sujeito "
+    "poema autor livro musica arte pintura futebol olimpiadas animal floresta oceano clima "
+    "vulcao sismo mapa pais cidade lingua ingles frances quimica fisica biologia computador"
+).split()
+
+
+SYLLABLES = "ba be bi bo bu ca ce ci co cu da de di do du fa fe fi fo ga go la le li lo lu ma me mi mo mu na ne no pa pe po ra re ri ro sa se si so ta te ti to va ve vi vo".split()
+
+
+def vocabulary(rng, size):
+    # Palavras comuns primeiro; o resto é sintético. Pesos ~ Zipf, como texto real.
+    words = list(WORDS)
+    while len(words) < size:
+        words.append("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+    return words, cum_weights
+
+
+def sentence(rng, vocab, n):
+    words, cum_weights = vocab
+    return " ".join(rng.choices(words, cum_weights=cum_weights, k=n))
+
+
+def seed(db_path, quizzes, questions_per_quiz, vocab, seed_value):
+    rng = random.Random(seed_value)
+    sabio.DB_PATH = db_path
+    sabio.init_db()
+
+    conn = sabio.sqlite3.connect(db_path)
+    conn.execute("INSERT INTO users (id, username, email, password_hash) VALUES (1, 'bench', 'bench@x', '-')")
+    conn.executemany(
+        "INSERT INTO quizzes (id, title, description, is_public, created_by) VALUES (?, ?, ?, ?, 1)",
+        ((i, sentence(rng, vocab, 3), sentence(rng, vocab, 8), int(rng.random() < 0.8)) for i in range(1, quizzes + 1)),
+    )
+    conn.executemany(
+        "INSERT INTO questions (quiz_id, question_text, option_a, option_b, option_c, option_d, correct_option) "
+        "VALUES (?, ?, 'a', 'b', 'c', 'd', 'A')",
+        ((i, sentence(rng, vocab, 10)) for i in range(1, quizzes + 1) for _ in range(questions_per_quiz)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quizzes", type=int, default=100_000)
+    parser.add_argument("--questions-per-quiz", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--vocabulary", type=int, default=20_000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="sabio-search-")
+    db_path = os.path.join(tmp, "bench.db")
+
+    t0 = time.perf_counter()
+    vocab = vocabulary(random.Random(args.seed), args.vocabulary)
+    seed(db_path, args.quizzes, args.questions_per_quiz, vocab, args.seed)
+    seed_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    sabio.reindex_all_quizzes()
+    index_s = time.perf_counter() - t0
+
+    rng = random.Random(args.seed + 1)
+    timings = []
+    hits = 0
+    for i in range(args.queries):
+        # 1-2 termos, por vezes truncados (pesquisa por prefixo enquanto se escreve)
+        terms = " ".join(w[: rng.randint(3, 8)] for w in rng.choices(vocab[0], cum_weights=vocab[1], k=rng.randint(1, 2)))
+        offset = sabio.QUIZ_PAGE_SIZE * rng.randint(0, 3)
+        t0 = time.perf_counter()
+        items, _ = sabio.search_quizzes(terms, offset=offset)
+        timings.append((time.perf_counter() - t0) * 1000)
+        hits += len(items)
+
+    print(json.dumps({
+        "backend": "sqlite-fts5",
+        "quizzes": args.quizzes,
+        "questions": args.quizzes * args.questions_per_quiz,
+        "seed_s": round(seed_s, 2),
+        "reindex_s": round(index_s, 2),
+        "vocabulary": args.vocabulary,
+        "queries": args.queries,
+        "avg_results": round(hits / args.queries, 1),
+        "latency_ms": {
+            "p50": round(percentile(timings, 50), 2),
+            "p95": round(percentile(timings, 95), 2),
+            "p99": round(percentile(timings, 99), 2),
+            "max": round(max(timings), 2),
+        },
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""Leituras por segundo com escritas em simultâneo: perfil SQLite `basic` (pool,
+journal por omissão) contra `production` (WAL, pragmas, leitores por thread e um
+único escritor por processo).
+
+Cada perfil corre numa base temporária nova. Vários processos (como os workers
+do gunicorn), cada um com threads de leitura (Descobrir + detalhe de um quiz) e
+de escrita (favoritar / desfavoritar), durante --duration segundos.
+
+    python bench/sqlite_bench.py --processes 4 --readers 4 --writers 1 --duration 5
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as sabio  # noqa: E402
+
+PROFILES = ("basic", "production")
+
+
+def seed(db_path, args):
+    rng = random.Random(args.seed)
+    sabio.DB_PATH = db_path
+    sabio._pool = None
+    sabio.init_db()
+
+    conn = sabio.sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO users (id, username, email, password_hash) VALUES (?, ?, ?, '-')",
+        ((i, f"user{i}", f"user{i}@bench") for i in range(1, args.users + 1)),
+    )
+    conn.executemany(
+        "INSERT INTO quizzes (id, title, description, is_public, created_by) VALUES (?, ?, '', 1, ?)",
+        ((i, f"Quiz {i}", rng.randint(1, args.users)) for i in range(1, args.quizzes + 1)),
+    )
+    conn.executemany(
+        "INSERT INTO questions (quiz_id, question_text, option_a, option_b, option_c, option_d, correct_option) "
+        "VALUES (?, ?, 'a', 'b', 'c', 'd', 'A')",
+        ((i, f"Pergunta {j} do quiz {i}?") for i in range(1, args.quizzes + 1) for j in range(args.questions_per_quiz)),
+    )
+    conn.commit()
+    conn.close()
+    sabio.reconcile_quiz_counters()
+
+
+def reader(args, deadline, out):
+    rng = random.Random()
+    latencies, errors = [], 0
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            sabio.get_public_quizzes()
+            sabio.get_quiz_by_id(rng.randint(1, args.quizzes))
+        except sabio.sqlite3.OperationalError:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+    out.append(("read", latencies, errors))
+
+
+def writer(args, deadline, out):
+    rng = random.Random()
+    latencies, errors = [], 0
+    while time.perf_counter() < deadline:
+        user_id, quiz_id = rng.randint(1, args.users), rng.randint(1, args.quizzes)
+        started = time.perf_counter()
+        try:
+            if sabio.get_favorite(user_id, quiz_id):
+                sabio.remove_favorite(user_id, quiz_id)
+            else:
+                sabio.add_favorite(user_id, quiz_id)
+        except sabio.sqlite3.OperationalError:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+    out.append(("write", latencies, errors))
+
+
+def worker(args, start_at, queue):
+    """Um processo: threads de leitura e de escrita até ao fim do intervalo."""
+    out = []
+    time.sleep(max(start_at - time.time(), 0))
+    deadline = time.perf_counter() + args.duration
+    threads = [threading.Thread(target=reader, args=(args, deadline, out)) for _ in range(args.readers)]
+    threads += [threading.Thread(target=writer, args=(args, deadline, out)) for _ in range(args.writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    queue.put(out)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def run_profile(profile, args):
+    sabio.SQLITE_PROFILE = profile
+    sabio.SLOW_QUERY_MS = float("inf")   # as esperas pelo lock são o que estamos a medir
+    seed(os.path.join(tempfile.mkdtemp(prefix=f"sabio-sqlite-{profile}-"), "bench.db"), args)
+
+    # fork: cada processo recria o pool / as ligações (verificação do pid)
+    ctx = multiprocessing.get_context("fork")
+    queue = ctx.Queue()
+    start_at = time.time() + 0.5
+    procs = [ctx.Process(target=worker, args=(args, start_at, queue)) for _ in range(args.processes)]
+    for p in procs:
+        p.start()
+    results = [queue.get() for _ in procs]
+    for p in procs:
+        p.join()
+
+    summary = {}
+    for kind in ("read", "write"):
+        latencies = [x for out in results for k, lat, _ in out if k == kind for x in lat]
+        errors = sum(err for out in results for k, _, err in out if k == kind)
+        summary[kind] = {
+            "ops": len(latencies),
+            "per_s": round(len(latencies) / args.duration, 1),
+            "errors": errors,
+            "latency_ms": {
+                "p50": round(percentile(latencies, 50) * 1000, 2),
+                "p95": round(percentile(latencies, 95) * 1000, 2),
+                "p99": round(percentile(latencies, 99) * 1000, 2),
+            },
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=4, help="threads de leitura por processo")
+    parser.add_argument("--writers", type=int, default=1, help="threads de escrita por processo")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--quizzes", type=int, default=2000)
+    parser.add_argument("--questions-per-quiz", type=int, default=10)
+    parser.add_argument("--profiles", nargs="+", choices=PROFILES, default=list(PROFILES))
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    report = {"config": {k: v for k, v in vars(args).items() if k != "profiles"}}
+    for profile in args.profiles:
+        report[profile] = run_profile(profile, args)
+    if set(PROFILES) <= set(report):
+        report["read_speedup"] = round(
+            report["production"]["read"]["per_s"] / max(report["basic"]["read"]["per_s"], 1e-9), 2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
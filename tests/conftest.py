@@ -0,0 +1,79 @@
+"""Fixtures partilhadas: a app com uma base de dados SQLite nova por teste.
+
+    python -m pytest -q
+"""
+import os
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# A configuração é lida no import: os testes correm sempre em SQLite, com a
+# cache em memória e sem ficheiros de métricas partilhados.
+os.environ.pop('DATABASE_URL', None)
+os.environ.pop('METRICS_DIR', None)
+os.environ['CACHE_BACKEND'] = 'memory'
+
+import app as sabio  # noqa: E402
+
+
+def wait_until(condition, timeout=10):
+    """Espera (pelas threads de background) até condition() ser verdadeira."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@pytest.fixture
+def app_db(tmp_path, monkeypatch):
+    """O módulo da app, a apontar para uma base de dados nova e com as caches vazias."""
+    monkeypatch.setattr(sabio, 'DB_PATH', str(tmp_path / 'test.db'))
+    monkeypatch.setattr(sabio, '_pool', None)
+    sabio.init_db()
+    # os ids repetem-se entre bases de dados: nada do teste anterior pode ser servido
+    sabio.fragment_cache.clear()
+    sabio._user_cache.clear()
+    sabio.leaderboards.clear()
+    return sabio
+
+
+@pytest.fixture
+def client(app_db):
+    return app_db.app.test_client()
+
+
+@pytest.fixture
+def user(client):
+    """Regista e autentica um utilizador no `client`; devolve o id."""
+    client.post('/register', data={'username': 'ana', 'email': 'ana@example.com', 'password': 'pw'})
+    r = client.post('/login', data={'identifier': 'ana', 'password': 'pw'})
+    assert r.status_code == 302
+    return sabio.execute_query("SELECT id FROM users WHERE username = 'ana'", fetchone=True)['id']
+
+
+@pytest.fixture
+def quiz(client, user):
+    """Um quiz público do `user`, com três perguntas; devolve o id."""
+    r = client.post('/dashboard/create_quiz', data={'title': 'Capitais', 'description': 'Europa', 'is_public': '1'})
+    quiz_id = int(r.headers['Location'].rstrip('/').split('/')[-1])
+    for i in range(3):
+        client.post(f'/dashboard/add_questions/{quiz_id}', data={
+            'question_text': f'Capital {i}?', 'option_a': 'a', 'option_b': 'b', 'option_c': 'c',
+            'option_d': 'd', 'correct_option': 'A',
+        })
+    return quiz_id
+
+
+@pytest.fixture
+def max_queries():
+    """`with max_queries(n): client.get(...)` falha se o bloco fizer mais de n queries.
+
+    Devolve as estatísticas (capture_queries) para verificações adicionais.
+    """
+    return sabio.max_queries
@@ -0,0 +1,85 @@
+"""Backends de cache: cliente RESP contra o servidor local e invalidação entre workers."""
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import pytest
+
+import app as sabio
+from conftest import wait_until
+
+
+@pytest.fixture
+def cache_url():
+    """URL de um LocalCacheServer a correr (o substituto do Redis)."""
+    # caminho curto: os sockets Unix têm um limite de ~100 caracteres
+    tmp = tempfile.mkdtemp(prefix='sabio-')
+    server = sabio.LocalCacheServer(os.path.join(tmp, 'cache.sock'), 1000)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'unix://{server.server_address}'
+    server.shutdown()
+    server.server_close()
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+def worker_cache(url, channel):
+    """A FragmentCache de um worker: ligação, CacheBus e cache local próprios."""
+    backend = sabio.RespCacheBackend(url, 0.5)
+    return sabio.FragmentCache(backend, sabio.CacheBus(backend, channel), 10, 30)
+
+
+def test_get_set_delete_with_ttl(cache_url):
+    cache = sabio.RespCacheBackend(cache_url, 0.5)
+
+    cache.set('a', 'um')
+    cache.set('b', b'dois', ttl=0.1)
+    assert cache.get('a') == b'um'
+    assert cache.get_many(['a', 'b', 'c']) == [b'um', b'dois', None]
+    assert cache.incr('n') == 1 and cache.incr('n') == 2
+    assert cache.get('n') == b'2'
+
+    time.sleep(0.15)
+    assert cache.get('b') is None
+    assert cache.delete('a', 'b', 'c') == 1
+    assert cache.get('a') is None
+
+
+def test_versioned_key_invalidated_across_workers(cache_url):
+    channel = f'test:{os.getpid()}:invalidate'
+    first, second = worker_cache(cache_url, channel), worker_cache(cache_url, channel)
+    builds = []
+
+    def page(cache, html):
+        key = ('quiz', 1, cache.version('quiz:1'))
+        return cache.get_or_build(key, lambda: builds.append(html) or html)
+
+    assert page(first, 'v0') == 'v0'
+    assert page(second, 'outra') == 'v0'            # vem do servidor, sem reconstruir
+    assert builds == ['v0']
+    assert wait_until(lambda: second.bus.reconnects >= 1, timeout=5)   # subscrito
+
+    # o update_quiz noutro worker: a versão nova chega por pub/sub
+    first.bump('quiz:1')
+    assert wait_until(lambda: second._versions.get('quiz:1') == 1, timeout=5)
+    assert second.bus.received == 1
+    assert page(second, 'v1') == 'v1'
+    assert page(first, 'outra') == 'v1'
+    assert builds == ['v0', 'v1']
+
+
+def test_falls_back_to_memory_when_server_unreachable():
+    backend = sabio.RespCacheBackend('unix:///nonexistent/sabio-cache.sock', 0.1)
+    cache = sabio.FragmentCache(backend, sabio.CacheBus(backend, 'test:invalidate'), 10, 30)
+    assert isinstance(cache._local, sabio.MemoryCacheBackend)
+    builds = []
+
+    for _ in range(3):
+        assert cache.get_or_build('pagina', lambda: builds.append(1) or 'html') == 'html'
+    assert builds == [1]                            # servido pela cache local
+    assert cache.errors == 1                        # e o servidor não é tentado de novo logo a seguir
+
+    assert cache.version('quizzes') == 0
+    cache.bump('quizzes')
+    assert cache.version('quizzes') == 1            # as versões avançam só neste processo
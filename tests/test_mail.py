@@ -0,0 +1,109 @@
+"""Caixa de saída de e-mail contra um servidor SMTP local (o de bench/mail_restart_check.py)."""
+import threading
+import time
+
+import pytest
+
+import app as sabio
+from bench.mail_restart_check import SmtpStandIn, free_port
+from conftest import wait_until
+
+
+def outbox_row():
+    return sabio.execute_query("SELECT * FROM outbox ORDER BY id LIMIT 1", fetchone=True)
+
+
+@pytest.fixture
+def smtp_port(app_db, monkeypatch):
+    """Porta do servidor SMTP de teste (ainda sem ninguém à escuta)."""
+    port = free_port()
+    state = sabio.mail.state
+    for name, value in {'server': '127.0.0.1', 'port': port, 'use_tls': False, 'use_ssl': False,
+                        'username': None, 'password': None, 'suppress': False,
+                        'default_sender': ('SABIO', 'sabio@localhost')}.items():
+        monkeypatch.setattr(state, name, value)
+    return port
+
+
+@pytest.fixture
+def smtp(smtp_port):
+    server = SmtpStandIn(smtp_port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def sender(app_db, monkeypatch):
+    """Um MailSender novo, como num worker acabado de arrancar (a thread ainda não existe)."""
+    # o sender global pode já ter arrancado num pedido de outro teste: só este envia
+    sabio.mail_sender.close()
+    sender = sabio.MailSender(sabio.MAIL_BATCH_SIZE, 0.05)
+    monkeypatch.setattr(sabio, 'mail_sender', sender)
+    monkeypatch.setattr(sabio, 'MAIL_RETRY_BASE', 0.2)
+    yield sender
+    sender.close()
+
+
+def test_queued_mail_is_delivered(smtp, sender):
+    assert sabio.enqueue_mail('ana@example.com', 'Recuperar palavra-passe', 'Link: http://localhost/reset/x')
+
+    assert wait_until(lambda: outbox_row()['status'] == 'sent')
+    assert [envelope['to'] for _, envelope in smtp.messages] == [['<ana@example.com>']]
+    assert 'Recuperar palavra-passe' in smtp.messages[0][1]['data']
+    assert outbox_row()['attempts'] == 1
+
+
+def test_repeated_request_is_deduplicated(smtp, sender):
+    assert sabio.enqueue_mail('ana@example.com', 'Reset', 'x', dedupe_key='reset:ana')
+    assert not sabio.enqueue_mail('ana@example.com', 'Reset', 'x', dedupe_key='reset:ana')
+
+    assert wait_until(lambda: outbox_row()['status'] == 'sent')
+    assert sabio.execute_query("SELECT COUNT(*) AS n FROM outbox", fetchone=True)['n'] == 1
+    assert sender.deduped == 1
+
+
+def test_failed_send_is_retried_with_backoff(smtp_port, sender):
+    # SMTP em baixo: a primeira tentativa falha e a linha fica pendente, em backoff
+    before = time.time()
+    sabio.enqueue_mail('ana@example.com', 'Reset', 'x')
+    assert wait_until(lambda: outbox_row()['attempts'] >= 1)
+    row = outbox_row()
+    assert row['status'] == 'pending' and row['last_error'] and row['claim'] is None
+    assert row['next_attempt_at'] >= before + sabio.MAIL_RETRY_BASE
+
+    server = SmtpStandIn(smtp_port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        assert wait_until(lambda: outbox_row()['status'] == 'sent')
+        assert len(server.messages) == 1
+        assert outbox_row()['attempts'] >= 2
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_gives_up_after_max_attempts(smtp_port, sender, monkeypatch):
+    monkeypatch.setattr(sabio, 'MAIL_MAX_ATTEMPTS', 2)
+    sabio.enqueue_mail('ana@example.com', 'Reset', 'x')
+
+    assert wait_until(lambda: outbox_row()['status'] == 'failed')
+    assert outbox_row()['attempts'] == 2
+
+
+def test_pending_mail_is_sent_after_restart(smtp, sender, client):
+    # linha deixada por um processo que morreu a meio: reclamada, com o prazo já expirado
+    now = time.time()
+    sabio.execute_query(
+        "INSERT INTO outbox (recipient, subject, body, created_at, next_attempt_at, attempts, claim) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        ('ana@example.com', 'Reset', 'x', now - 60, now - 1, 1, 'worker-morto'), commit=True,
+    )
+
+    # o worker novo só recebe um pedido que nada tem a ver com e-mail
+    client.get('/health')
+
+    assert wait_until(lambda: outbox_row()['status'] == 'sent')
+    assert len(smtp.messages) == 1
+    assert sender.sent == 1
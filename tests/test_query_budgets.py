@@ -0,0 +1,34 @@
+"""Número máximo de queries por rota (páginas renderizadas de novo, utilizador já em cache)."""
+import pytest
+
+import app as sabio
+
+
+@pytest.fixture
+def cold_pages(client, quiz):
+    # um pedido normal deixa a identidade em cache; as páginas são reconstruídas
+    client.get('/')
+    sabio.fragment_cache.clear()
+
+
+@pytest.mark.parametrize('path, budget', [
+    ('/dashboard/discover', 1),
+    ('/dashboard/discover?sort=popular', 1),
+    ('/dashboard/discover?q=capitais', 1),
+    ('/dashboard/my_sets', 1),
+    ('/dashboard/favorites', 1),
+    ('/play/{quiz}', 2),
+    ('/play/{quiz}/questions.json', 2),
+])
+def test_route_query_budget(client, quiz, cold_pages, max_queries, path, budget):
+    with max_queries(budget):
+        r = client.get(path.format(quiz=quiz))
+    assert r.status_code == 200
+
+
+@pytest.mark.parametrize('path', ['/dashboard/discover', '/dashboard/my_sets', '/dashboard/favorites'])
+def test_list_pages_use_counters(client, quiz, cold_pages, max_queries, path):
+    # as contagens vêm de quizzes.question_count / favorite_count
+    with max_queries(1) as stats:
+        client.get(path)
+    assert not any('questions' in fp or 'COUNT(' in fp.upper() for fp in stats.fingerprints)